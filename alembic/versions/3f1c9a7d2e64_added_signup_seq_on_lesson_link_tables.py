@@ -0,0 +1,46 @@
+"""added signup_seq on lesson link tables
+
+Revision ID: 3f1c9a7d2e64
+Revises: dbabf429a183
+Create Date: 2026-10-18 10:12:40.118264
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c9a7d2e64'
+down_revision: Union[str, None] = 'dbabf429a183'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("userlessonlink", sa.Column("signup_seq", sa.Integer(), nullable=True))
+    op.add_column("userchildlessonlink", sa.Column("signup_seq", sa.Integer(), nullable=True))
+    # existing rows keep the order they were inserted in (rowid order)
+    op.execute(
+        "UPDATE userlessonlink SET signup_seq = ("
+        "SELECT COUNT(*) FROM userlessonlink AS other "
+        "WHERE other.lesson_id = userlessonlink.lesson_id AND other.rowid <= userlessonlink.rowid)"
+    )
+    op.execute(
+        "UPDATE userchildlessonlink SET signup_seq = ("
+        "SELECT COUNT(*) FROM userchildlessonlink AS other "
+        "WHERE other.lesson_id = userchildlessonlink.lesson_id AND other.rowid <= userchildlessonlink.rowid)"
+    )
+    op.create_index("ix_userlessonlink_lesson_id_signup_seq", "userlessonlink", ["lesson_id", "signup_seq"])
+    op.create_index("ix_userchildlessonlink_lesson_id_signup_seq", "userchildlessonlink", ["lesson_id", "signup_seq"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_userchildlessonlink_lesson_id_signup_seq", table_name="userchildlessonlink")
+    op.drop_index("ix_userlessonlink_lesson_id_signup_seq", table_name="userlessonlink")
+    with op.batch_alter_table("userchildlessonlink") as batch_op:
+        batch_op.drop_column("signup_seq")
+    with op.batch_alter_table("userlessonlink") as batch_op:
+        batch_op.drop_column("signup_seq")
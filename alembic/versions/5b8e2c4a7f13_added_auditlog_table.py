@@ -0,0 +1,48 @@
+"""added auditlog table
+
+Revision ID: 5b8e2c4a7f13
+Revises: 3f1c9a7d2e64
+Create Date: 2026-10-18 14:05:21.402871
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b8e2c4a7f13'
+down_revision: Union[str, None] = '3f1c9a7d2e64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table("auditlog",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("timestamp", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("action", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("lesson_number", sa.Integer(), nullable=False),
+        sa.Column("lesson_title", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("user_name", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("user_tel", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("user_address", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.PrimaryKeyConstraint("id")
+    )
+    op.create_index(op.f("ix_auditlog_timestamp"), "auditlog", ["timestamp"], unique=False)
+    op.create_index(op.f("ix_auditlog_action"), "auditlog", ["action"], unique=False)
+    op.create_index(op.f("ix_auditlog_lesson_number"), "auditlog", ["lesson_number"], unique=False)
+    op.create_index(op.f("ix_auditlog_user_name"), "auditlog", ["user_name"], unique=False)
+    op.create_index("ix_auditlog_lesson_number_timestamp", "auditlog", ["lesson_number", "timestamp"], unique=False)
+    # the existing log files are loaded afterwards with: python logs.py import
+
+
+def downgrade() -> None:
+    op.drop_index("ix_auditlog_lesson_number_timestamp", table_name="auditlog")
+    op.drop_index(op.f("ix_auditlog_user_name"), table_name="auditlog")
+    op.drop_index(op.f("ix_auditlog_lesson_number"), table_name="auditlog")
+    op.drop_index(op.f("ix_auditlog_action"), table_name="auditlog")
+    op.drop_index(op.f("ix_auditlog_timestamp"), table_name="auditlog")
+    op.drop_table("auditlog")
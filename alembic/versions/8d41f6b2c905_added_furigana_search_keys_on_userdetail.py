@@ -0,0 +1,50 @@
+"""added furigana search keys on userdetail
+
+Revision ID: 8d41f6b2c905
+Revises: 5b8e2c4a7f13
+Create Date: 2026-10-18 18:22:07.530114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+import unicodedata
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d41f6b2c905'
+down_revision: Union[str, None] = '5b8e2c4a7f13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# same as kana.normalize_kana at the time of this revision
+def normalize_kana(text):
+    if text is None:
+        return None
+    text = unicodedata.normalize("NFKC", text).translate({code: code - 0x60 for code in range(0x30A1, 0x30F7)})
+    return "".join(text.split()).lower()
+
+
+def upgrade() -> None:
+    op.add_column("userdetail", sa.Column("last_name_search", sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+    op.add_column("userdetail", sa.Column("first_name_search", sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+    connection = op.get_bind()
+    rows = connection.execute(sa.text("SELECT id, last_name_furigana, first_name_furigana FROM userdetail")).all()
+    if rows:
+        connection.execute(
+            sa.text("UPDATE userdetail SET last_name_search = :last_name_search, first_name_search = :first_name_search WHERE id = :id"),
+            [{"id": id, "last_name_search": normalize_kana(last), "first_name_search": normalize_kana(first)} for id, last, first in rows],
+        )
+    op.create_index("ix_userdetail_last_name_search_first_name_search", "userdetail", ["last_name_search", "first_name_search"], unique=False)
+    op.create_index(op.f("ix_userdetail_first_name_search"), "userdetail", ["first_name_search"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_userdetail_first_name_search"), table_name="userdetail")
+    op.drop_index("ix_userdetail_last_name_search_first_name_search", table_name="userdetail")
+    with op.batch_alter_table("userdetail") as batch_op:
+        batch_op.drop_column("first_name_search")
+        batch_op.drop_column("last_name_search")
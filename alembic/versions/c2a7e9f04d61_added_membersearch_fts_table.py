@@ -0,0 +1,30 @@
+"""added membersearch fts table and userchild user_id index
+
+Revision ID: c2a7e9f04d61
+Revises: 8d41f6b2c905
+Create Date: 2026-10-18 21:04:51.208337
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c2a7e9f04d61'
+down_revision: Union[str, None] = '8d41f6b2c905'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# the rows are filled by member_search.create_member_search on the next startup
+def upgrade() -> None:
+    op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS membersearch USING fts5(user_id UNINDEXED, name, furigana, tel, address, children, tokenize = 'trigram')")
+    op.create_index(op.f("ix_userchild_user_id"), "userchild", ["user_id"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_userchild_user_id"), table_name="userchild")
+    op.execute("DROP TABLE IF EXISTS membersearch")
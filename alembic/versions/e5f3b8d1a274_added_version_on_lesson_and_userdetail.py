@@ -0,0 +1,32 @@
+"""added version on lesson and userdetail
+
+Revision ID: e5f3b8d1a274
+Revises: c2a7e9f04d61
+Create Date: 2026-10-18 23:41:12.804517
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5f3b8d1a274'
+down_revision: Union[str, None] = 'c2a7e9f04d61'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # existing rows start at version 1
+    op.add_column("lesson", sa.Column("version", sa.Integer(), server_default="1", nullable=False))
+    op.add_column("userdetail", sa.Column("version", sa.Integer(), server_default="1", nullable=False))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("userdetail") as batch_op:
+        batch_op.drop_column("version")
+    with op.batch_alter_table("lesson") as batch_op:
+        batch_op.drop_column("version")
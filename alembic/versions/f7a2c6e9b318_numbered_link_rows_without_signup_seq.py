@@ -0,0 +1,37 @@
+"""numbered link rows without signup_seq
+
+Revision ID: f7a2c6e9b318
+Revises: e5f3b8d1a274
+Create Date: 2026-10-19 10:12:44.351208
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f7a2c6e9b318'
+down_revision: Union[str, None] = 'e5f3b8d1a274'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # rows added by relationship appends before signup_seq had a default: after the numbered rows of their lesson, in rowid order
+    for table in ("userlessonlink", "userchildlessonlink"):
+        op.execute(
+            f"UPDATE {table} SET signup_seq = ("
+            f"SELECT COALESCE(MAX(numbered.signup_seq), 0) FROM {table} AS numbered "
+            f"WHERE numbered.lesson_id = {table}.lesson_id AND numbered.signup_seq IS NOT NULL"
+            f") + ("
+            f"SELECT COUNT(*) FROM {table} AS other "
+            f"WHERE other.lesson_id = {table}.lesson_id AND other.signup_seq IS NULL AND other.rowid <= {table}.rowid"
+            f") WHERE signup_seq IS NULL"
+        )
+
+
+def downgrade() -> None:
+    pass
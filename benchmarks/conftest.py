@@ -0,0 +1,179 @@
+# --- benchmarks/conftest.py ---
+# time the hot endpoints in-process with TestClient against a club generated by datagen.py:
+#   python -m pytest benchmarks --benchmark-save baseline.json        # record a baseline
+#   python -m pytest benchmarks --benchmark-compare baseline.json     # fail cases slower than the baseline by more than --benchmark-threshold
+# the same --benchmark-users/--benchmark-seed always benchmark the same rows. run apart from tests/: both bind the app to their own database.
+
+# modules
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+workdir = tempfile.mkdtemp(prefix="yoro-sc-benchmark-")
+DB_FILE = os.path.join(workdir, "benchmark.sqlite")
+# the app binds its engine to DB_CONNECTION_STRING on import: set before any benchmark imports it
+os.environ["DB_CONNECTION_STRING"] = f"sqlite:///{DB_FILE}"
+os.environ["LOG_PATH"] = os.path.join(workdir, "logs.jsonl")
+sys.path.insert(0, ROOT)
+os.chdir(ROOT) # static/ and templates/ are served from the working directory
+
+from datetime import datetime, timedelta
+import json
+import platform
+import sqlite3
+import time
+import pytest
+
+# my modules
+import datagen
+
+
+PASSWORD = "benchmark"
+
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmark")
+    group.addoption("--benchmark-users", type=int, default=5000, help="users in the generated club")
+    group.addoption("--benchmark-seed", type=int, default=1)
+    group.addoption("--benchmark-repeat", type=int, default=50, help="timed calls per case")
+    group.addoption("--benchmark-warmup", type=int, default=5, help="untimed calls before each case")
+    group.addoption("--benchmark-save", help="write the results as a baseline json file")
+    group.addoption("--benchmark-compare", help="baseline json file to compare against")
+    group.addoption("--benchmark-threshold", type=float, default=0.2, help="allowed p50 slowdown, 0.2 = 20 %%")
+
+
+
+def summarize(samples: list) -> dict:
+    samples = sorted(samples)
+    def percentile(fraction):
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+    return {
+        "n": len(samples),
+        "mean_ms": sum(samples) / len(samples) * 1000,
+        "p50_ms": percentile(0.5) * 1000,
+        "p95_ms": percentile(0.95) * 1000,
+        "min_ms": samples[0] * 1000,
+    }
+
+
+# run request() repeat times after warmup untimed calls; every response must have an expected status
+def time_case(request, repeat: int, warmup: int, expected: tuple = (200,)) -> dict:
+    samples = []
+    for i in range(warmup + repeat):
+        started = time.perf_counter()
+        response = request(i)
+        elapsed = time.perf_counter() - started
+        assert response.status_code in expected, f"unexpected status {response.status_code}: {response.text[:200]}"
+        if i >= warmup:
+            samples.append(elapsed)
+    return summarize(samples)
+
+
+
+# the generated club, with its season open now and the first user an admin
+@pytest.fixture(scope="session")
+def club(pytestconfig):
+    users = pytestconfig.getoption("benchmark_users")
+    started = time.perf_counter()
+    club = datagen.generate(DB_FILE, users=users, seed=pytestconfig.getoption("benchmark_seed"), password=PASSWORD)
+    connection = sqlite3.connect(DB_FILE)
+    with connection:
+        now = datetime.utcnow()
+        connection.execute("UPDATE period SET start_time = ?, end_time = ?",
+                           (datagen.to_sqlite_datetime(now - timedelta(hours=1)), datagen.to_sqlite_datetime(now + timedelta(days=14))))
+        connection.execute('UPDATE "user" SET is_admin = 1 WHERE id = 1')
+    connection.close()
+    print(f"\ngenerated {users} users in {time.perf_counter() - started:.2f}s")
+    return club
+
+
+@pytest.fixture(scope="session")
+def password():
+    return PASSWORD
+
+
+@pytest.fixture(scope="session")
+def client(club):
+    from fastapi.testclient import TestClient
+    import main
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture(scope="session")
+def headers_of(client):
+    from routers.auth import create_access_token
+    def headers_of(username: str) -> dict:
+        return {"Authorization": "Bearer " + create_access_token(data={"sub": username}, expires_delta=timedelta(hours=1))}
+    return headers_of
+
+
+@pytest.fixture(scope="session")
+def admin(club, headers_of):
+    return headers_of(club["accounts"][0]["username"])
+
+
+# users signing up in the benchmarks: one per call so every call really inserts
+@pytest.fixture(scope="session")
+def signup_users(club, headers_of, pytestconfig):
+    calls = pytestconfig.getoption("benchmark_warmup") + pytestconfig.getoption("benchmark_repeat")
+    return [headers_of(account["username"]) for account in club["accounts"][1:calls + 1]]
+
+
+
+@pytest.fixture(scope="session")
+def baseline(pytestconfig, club):
+    path = pytestconfig.getoption("benchmark_compare")
+    if not path:
+        return None
+    with open(os.path.join(pytestconfig.invocation_params.dir, path), "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline["meta"]["users"] != pytestconfig.getoption("benchmark_users") or baseline["meta"]["seed"] != pytestconfig.getoption("benchmark_seed"):
+        print("\nwarning: the baseline was taken with another dataset")
+    return baseline
+
+
+# results of every case, printed and saved as a baseline at the end of the session
+@pytest.fixture(scope="session")
+def results(pytestconfig):
+    results = {}
+    yield results
+    if not results:
+        return
+    print(f"\n{'case':<40}{'n':>5}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'min ms':>10}")
+    for case, result in results.items():
+        print(f"{case:<40}{result['n']:>5}{result['mean_ms']:>10.2f}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['min_ms']:>10.2f}")
+    save_path = pytestconfig.getoption("benchmark_save")
+    if save_path:
+        report = {
+            "meta": {"users": pytestconfig.getoption("benchmark_users"), "seed": pytestconfig.getoption("benchmark_seed"),
+                     "repeat": pytestconfig.getoption("benchmark_repeat"), "python": platform.python_version(),
+                     "sqlite": sqlite3.sqlite_version, "machine": platform.node(), "date": datetime.now().isoformat(timespec="seconds")},
+            "results": results,
+        }
+        save_path = os.path.join(pytestconfig.invocation_params.dir, save_path)
+        with open(save_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"baseline saved to {save_path}")
+
+
+# measure(request, repeat=None): time one case named after the test, record it and fail if its p50 grew past the threshold
+@pytest.fixture
+def measure(request, pytestconfig, results, baseline):
+    case = request.node.name.removeprefix("test_")
+
+    def measure(call, repeat: int = None, warmup: int = None) -> dict:
+        repeat = pytestconfig.getoption("benchmark_repeat") if repeat is None else repeat
+        warmup = pytestconfig.getoption("benchmark_warmup") if warmup is None else warmup
+        result = time_case(call, repeat, warmup)
+        results[case] = result
+        before = baseline["results"].get(case) if baseline else None
+        if before is not None and before["p50_ms"]:
+            threshold = pytestconfig.getoption("benchmark_threshold")
+            change = result["p50_ms"] / before["p50_ms"] - 1
+            assert change <= threshold, f"p50 {result['p50_ms']:.2f} ms is {change * 100:.1f} % slower than the baseline {before['p50_ms']:.2f} ms"
+        return result
+
+    return measure
@@ -0,0 +1,44 @@
+# --- benchmarks/test_endpoints.py ---
+# one test per hot endpoint, in this order: the signup cases leave their users signed up or not for the next ones
+
+# my modules
+import datagen
+
+
+
+def test_read_lesson_list_json(client, measure):
+    measure(lambda i: client.get("/json/lessons"))
+
+
+def test_create_my_lessons(client, club, signup_users, measure):
+    lesson_id = club["lessons"][0]
+    measure(lambda i: client.post(f"/lessons/{lesson_id}", headers=signup_users[i]))
+
+
+def test_json_read_lesson_signup_position_all(client, signup_users, measure):
+    measure(lambda i: client.get("/json/my/lessons/position", headers=signup_users[i]))
+
+
+def test_delete_my_lesson(client, club, signup_users, measure):
+    lesson_id = club["lessons"][0]
+    measure(lambda i: client.delete(f"/my/lessons/{lesson_id}", headers=signup_users[i]))
+
+
+# the roster of the open season: sign everybody up again first
+def test_admin_json_read_users_of_every_lessons(client, club, signup_users, admin, measure):
+    lesson_id = club["lessons"][0]
+    for headers in signup_users:
+        client.post(f"/lessons/{lesson_id}", headers=headers)
+    measure(lambda i: client.get("/json/admin/lessons/users", headers=admin))
+
+
+# surnames from the generator's list, so every search has hits
+def test_admin_user_search(client, admin, measure):
+    measure(lambda i: client.get("/json/admin/users/search", params={"last_name_furigana": datagen.LAST_NAMES[i % len(datagen.LAST_NAMES)][1]}, headers=admin))
+
+
+# bcrypt: a few rounds are enough
+def test_login_for_access_token(client, club, password, pytestconfig, measure):
+    accounts = club["accounts"]
+    measure(lambda i: client.post("/token", data={"username": accounts[i % len(accounts)]["username"], "password": password}),
+            repeat=max(3, pytestconfig.getoption("benchmark_repeat") // 10), warmup=1)
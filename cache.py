@@ -0,0 +1,83 @@
+# --- cache.py ---
+
+# modules
+from collections import OrderedDict
+import threading
+import time
+
+
+# every cache created below, by name: read by the admin/metrics endpoints
+caches = {}
+
+
+
+# bounded LRU cache whose entries also expire after ttl seconds
+class TTLCache:
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 60.0):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict() # key: (expires_at, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        caches[name] = self
+
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+
+    def set(self, key, value, ttl: float = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+
+    # drop one key, or everything when key is None
+    def invalidate(self, key=None):
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"name": self.name, "size": len(self.entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+
+# monotonically increasing version number of a piece of shared data
+class VersionCounter:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+
+    def bump(self) -> int:
+        with self.lock:
+            self.value += 1
+            return self.value
+
+
+
+# version of the public lesson catalog: bump it after every commit that changes lessons, capacity_left or the period
+catalog_version = VersionCounter()
+
+
+def bump_catalog_version():
+    catalog_version.bump()
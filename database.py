@@ -2,8 +2,16 @@
 
 # modules
 from sqlmodel import SQLModel, create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
+import gzip
+import logging
 import os
 import shutil
+import sqlite3
+import threading
+import uuid
 from datetime import datetime, timedelta
 
 
@@ -35,11 +43,127 @@ else:
     db_connection_string = f"sqlite:///{db_file}"
     connect_args={'check_same_thread': False}
 
+# pooled sqlite connections are shared by the request threads and the background writers
+is_sqlite = db_connection_string.startswith("sqlite")
+if is_sqlite:
+    connect_args={'check_same_thread': False}
+
+
+# sqlite profile applied to every new connection
+if "SQLITE_JOURNAL_MODE" in os.environ:
+    SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE")
+else:
+    SQLITE_JOURNAL_MODE = "WAL" # readers no longer wait for the writer and vice versa
+
+if "SQLITE_SYNCHRONOUS" in os.environ:
+    SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS")
+else:
+    SQLITE_SYNCHRONOUS = "NORMAL" # durable in WAL mode except on power loss
+
+if "SQLITE_CACHE_SIZE" in os.environ:
+    SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE"))
+else:
+    SQLITE_CACHE_SIZE = -64000 # negative: KiB, i.e. about 64 MB per connection
+
+if "SQLITE_MMAP_SIZE" in os.environ:
+    SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE"))
+else:
+    SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+
+if "SQLITE_TEMP_STORE" in os.environ:
+    SQLITE_TEMP_STORE = os.getenv("SQLITE_TEMP_STORE")
+else:
+    SQLITE_TEMP_STORE = "MEMORY"
+
+if "SQLITE_BUSY_TIMEOUT" in os.environ:
+    SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT"))
+else:
+    SQLITE_BUSY_TIMEOUT = 5000 # milliseconds to wait for a lock before "database is locked"
+
+sqlite_pragmas = {
+    "journal_mode": SQLITE_JOURNAL_MODE,
+    "synchronous": SQLITE_SYNCHRONOUS,
+    "cache_size": SQLITE_CACHE_SIZE,
+    "mmap_size": SQLITE_MMAP_SIZE,
+    "temp_store": SQLITE_TEMP_STORE,
+    "busy_timeout": SQLITE_BUSY_TIMEOUT,
+}
+
 
 # database settings
 engine = create_engine(db_connection_string, echo=False, connect_args=connect_args)
 
 
+# def: apply the sqlite profile on connect
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in sqlite_pragmas.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+if is_sqlite:
+    event.listen(engine, "connect", set_sqlite_pragmas)
+
+
+# def: start the transaction with BEGIN IMMEDIATE when the connection asks for it (write_engine below).
+# sqlite has no row locks: a deferred transaction that reads and then writes can interleave with a writer in another
+# worker process and fail or act on stale rows; IMMEDIATE takes the write lock first, waiting up to busy_timeout.
+# pysqlite does not begin by itself once a transaction is open, so only these connections change behavior.
+def begin_sqlite_transaction(conn):
+    if conn.get_execution_options().get("sqlite_begin_immediate"):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+if is_sqlite:
+    event.listen(engine, "begin", begin_sqlite_transaction)
+
+
+# engine for transactions that read, decide and write (enrollment): same pool, transactions begin immediate on sqlite
+write_engine = engine.execution_options(sqlite_begin_immediate=True)
+
+
+# async engine for the read endpoints that are "async def": they wait for the database without holding a threadpool thread.
+# the url is ASYNC_DB_CONNECTION_STRING, or the sync url with its driver swapped for an async one
+async_drivers = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+}
+
+
+def to_async_url(url: str) -> str:
+    scheme, separator, rest = url.partition("://")
+    return async_drivers.get(scheme, scheme) + separator + rest
+
+
+if "ASYNC_DB_CONNECTION_STRING" in os.environ:
+    async_db_connection_string = os.getenv("ASYNC_DB_CONNECTION_STRING")
+else:
+    async_db_connection_string = to_async_url(db_connection_string)
+
+async_engine = create_async_engine(async_db_connection_string, echo=False)
+
+if is_sqlite:
+    event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
+
+
+# def: read back the pragmas as sqlite applied them (e.g. journal_mode stays "memory" for in-memory databases)
+def read_sqlite_pragmas() -> dict:
+    if not is_sqlite:
+        return {}
+    with engine.connect() as connection:
+        return {name: connection.exec_driver_sql(f"PRAGMA {name}").scalar() for name in sqlite_pragmas}
+
+
+def report_sqlite_pragmas():
+    if is_sqlite:
+        settings = ", ".join(f"{name}={value}" for name, value in read_sqlite_pragmas().items())
+        logging.getLogger("uvicorn.error").info(f"sqlite: {settings}")
+
+
 # def: create the database
 def create_database():
     SQLModel.metadata.create_all(engine)
@@ -51,6 +175,12 @@ def get_session():
         yield session
 
 
+# def: async database session for dependency injection (no lazy loading: query relationships explicitly)
+async def get_async_session():
+    async with AsyncSession(async_engine) as session:
+        yield session
+
+
 
 
 
@@ -71,14 +201,171 @@ def make_remote_db_dir():
 #         shutil.copy2(backup_db, current_db)
 
 
-def make_backup_db():
-    backup_db_dir = "/mount/db_dir/"
-    if os.path.exists(backup_db_dir) and env_mount in os.environ:
-        current_datetime = (datetime.utcnow() + timedelta(hours=9)).strftime("%Y-%m-%dT%H-%M-%S")
-        backup_db = f"{backup_db_dir}yoro-sc_{current_datetime}.sqlite"
-        current_db = db_file
-        shutil.copy2(current_db, backup_db)
-    else:
+# backup settings: pages copied per step and the pause between steps, compression and retention
+if "BACKUP_PAGES_PER_STEP" in os.environ:
+    BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP"))
+else:
+    BACKUP_PAGES_PER_STEP = 1000
+
+if "BACKUP_STEP_SLEEP" in os.environ:
+    BACKUP_STEP_SLEEP = float(os.getenv("BACKUP_STEP_SLEEP"))
+else:
+    BACKUP_STEP_SLEEP = 0.05 # seconds to wait before retrying a step that found the database busy or locked
+
+if "BACKUP_COMPRESS" in os.environ:
+    BACKUP_COMPRESS = os.getenv("BACKUP_COMPRESS").lower() in ("1", "true", "yes")
+else:
+    BACKUP_COMPRESS = False
+
+if "BACKUP_KEEP_HOURLY" in os.environ:
+    BACKUP_KEEP_HOURLY = int(os.getenv("BACKUP_KEEP_HOURLY"))
+else:
+    BACKUP_KEEP_HOURLY = 24
+
+if "BACKUP_KEEP_DAILY" in os.environ:
+    BACKUP_KEEP_DAILY = int(os.getenv("BACKUP_KEEP_DAILY"))
+else:
+    BACKUP_KEEP_DAILY = 30
+
+# a stepwise backup starts over whenever another connection writes: after this many restarts the rest is copied in one step
+if "BACKUP_MAX_RESTARTS" in os.environ:
+    BACKUP_MAX_RESTARTS = int(os.getenv("BACKUP_MAX_RESTARTS"))
+else:
+    BACKUP_MAX_RESTARTS = 3
+
+# finished backup jobs kept for GET /backupdatabase/{job_id}, oldest evicted first
+if "BACKUP_JOBS_KEPT" in os.environ:
+    BACKUP_JOBS_KEPT = int(os.getenv("BACKUP_JOBS_KEPT"))
+else:
+    BACKUP_JOBS_KEPT = 20
+
+backup_db_dir = "/mount/db_dir/"
+backup_prefix = "yoro-sc_"
+backup_time_format = "%Y-%m-%dT%H-%M-%S"
+
+
+# backup jobs by id, oldest first: status is "running", "done", "failed" or "skipped"
+backup_jobs = {}
+backup_lock = threading.Lock()
+
+
+# def: start a backup in the background and return its job id (the running job's id if one is in progress)
+def make_backup_db() -> str:
+    with backup_lock:
+        for job_id, job in backup_jobs.items():
+            if job["status"] == "running":
+                return job_id
+        prune_backup_jobs()
+        job_id = uuid.uuid4().hex
+        backup_jobs[job_id] = {"status": "running", "file": None, "pages": None, "remaining": None, "restarts": 0,
+                               "started": datetime.utcnow().isoformat(), "finished": None, "error": None}
+    threading.Thread(target=run_backup_job, args=(job_id,), name="db-backup", daemon=True).start()
+    return job_id
+
+
+# def: drop the oldest finished jobs beyond BACKUP_JOBS_KEPT (call with backup_lock held)
+def prune_backup_jobs(keep: int = None):
+    keep = BACKUP_JOBS_KEPT if keep is None else keep
+    finished = [job_id for job_id, job in backup_jobs.items() if job["status"] != "running"]
+    for job_id in finished[:max(len(finished) - keep, 0)]:
+        del backup_jobs[job_id]
+
+
+def get_backup_job(job_id: str):
+    return backup_jobs.get(job_id)
+
+
+def run_backup_job(job_id: str):
+    job = backup_jobs[job_id]
+    try:
+        if env_mount not in os.environ or not is_sqlite:
+            job["status"] = "skipped"
+            return
         make_remote_db_dir()
+        current_datetime = (datetime.utcnow() + timedelta(hours=9)).strftime(backup_time_format)
+        backup_db = f"{backup_db_dir}{backup_prefix}{current_datetime}.sqlite"
+        job["file"] = backup_online(engine.url.database, backup_db, job)
+        prune_backups()
+        job["status"] = "done"
+    except Exception as error:
+        job["status"] = "failed"
+        job["error"] = str(error)
+        logging.getLogger("uvicorn.error").exception("database backup failed")
+    finally:
+        job["finished"] = datetime.utcnow().isoformat()
+
+
+class BackupRestarted(Exception):
+    pass
+
+
+# def: copy the live database with sqlite's online backup api, a few pages at a time
+# every write from another connection restarts a stepwise copy, so after BACKUP_MAX_RESTARTS restarts
+# the copy is done in one step instead (it holds the read lock until done, but always finishes)
+def backup_online(source_db: str, backup_db: str, job: dict = None, compress: bool = BACKUP_COMPRESS) -> str:
+    job = {} if job is None else job
+    job.setdefault("restarts", 0)
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal last_remaining
+        job["pages"] = total
+        job["remaining"] = remaining
+        if last_remaining is not None and remaining > last_remaining:
+            job["restarts"] += 1
+            if job["restarts"] >= BACKUP_MAX_RESTARTS:
+                raise BackupRestarted()
+        last_remaining = remaining
+
+    part_file = backup_db + ".part"
+    source = sqlite3.connect(source_db)
+    destination = sqlite3.connect(part_file)
+    try:
+        try:
+            source.backup(destination, pages=BACKUP_PAGES_PER_STEP, progress=progress, sleep=BACKUP_STEP_SLEEP)
+        except BackupRestarted:
+            source.backup(destination)
+            job["remaining"] = 0
+    finally:
+        destination.close()
+        source.close()
+    if compress:
+        with open(part_file, "rb") as src, gzip.open(backup_db + ".gz.part", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(part_file)
+        part_file = backup_db + ".gz.part"
+        backup_db = backup_db + ".gz"
+    # a half-written file never has the final name
+    os.replace(part_file, backup_db)
+    return backup_db
 
 
+# def: keep the newest backup of each of the last N hours and of the last N days, delete the rest
+def prune_backups(directory: str = backup_db_dir, keep_hourly: int = BACKUP_KEEP_HOURLY, keep_daily: int = BACKUP_KEEP_DAILY) -> list:
+    backups = []
+    for name in os.listdir(directory):
+        if not name.startswith(backup_prefix) or name.endswith(".part"):
+            continue
+        try:
+            taken = datetime.strptime(name[len(backup_prefix):].split(".")[0], backup_time_format)
+        except ValueError:
+            continue
+        backups.append((taken, name))
+    backups.sort(reverse=True)
+    keep = set()
+    for bucket_format, count in (("%Y-%m-%dT%H", keep_hourly), ("%Y-%m-%d", keep_daily)):
+        buckets = set()
+        for taken, name in backups:
+            bucket = taken.strftime(bucket_format)
+            if bucket in buckets:
+                continue
+            if len(buckets) >= count:
+                break
+            buckets.add(bucket)
+            keep.add(name)
+    removed = []
+    for taken, name in backups:
+        if name not in keep:
+            os.remove(os.path.join(directory, name))
+            removed.append(name)
+    return removed
@@ -0,0 +1,240 @@
+# --- datagen.py ---
+# generate a synthetic club into a new sqlite file:
+#   python datagen.py --db big.sqlite --users 100000 --seed 1
+# every user gets details, some get children, every year/season gets lessons and enrollments.
+# the same arguments always produce the same rows.
+
+# modules
+from datetime import datetime, timedelta
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from sqlmodel import SQLModel, create_engine
+
+# my modules
+from kana import normalize_kana
+from member_search import create_member_search, member_search_row, MEMBER_SEARCH_COLUMNS
+
+
+LAST_NAMES = [
+    ("佐藤", "さとう"), ("鈴木", "すずき"), ("高橋", "たかはし"), ("田中", "たなか"), ("伊藤", "いとう"),
+    ("渡辺", "わたなべ"), ("山本", "やまもと"), ("中村", "なかむら"), ("小林", "こばやし"), ("加藤", "かとう"),
+    ("吉田", "よしだ"), ("山田", "やまだ"), ("佐々木", "ささき"), ("山口", "やまぐち"), ("松本", "まつもと"),
+    ("井上", "いのうえ"), ("木村", "きむら"), ("林", "はやし"), ("斎藤", "さいとう"), ("清水", "しみず"),
+    ("山崎", "やまざき"), ("森", "もり"), ("池田", "いけだ"), ("橋本", "はしもと"), ("阿部", "あべ"),
+    ("石川", "いしかわ"), ("山下", "やました"), ("中島", "なかじま"), ("石井", "いしい"), ("小川", "おがわ"),
+    ("前田", "まえだ"), ("岡田", "おかだ"), ("長谷川", "はせがわ"), ("藤田", "ふじた"), ("後藤", "ごとう"),
+    ("近藤", "こんどう"), ("村上", "むらかみ"), ("遠藤", "えんどう"), ("青木", "あおき"), ("坂本", "さかもと"),
+    ("伊達", "だて"), ("水野", "みずの"), ("服部", "はっとり"), ("大野", "おおの"), ("河合", "かわい"),
+    ("野村", "のむら"), ("桑原", "くわばら"), ("日比野", "ひびの"), ("安田", "やすだ"), ("早川", "はやかわ"),
+]
+FIRST_NAMES = [
+    ("太郎", "たろう"), ("一郎", "いちろう"), ("健", "けん"), ("誠", "まこと"), ("大輔", "だいすけ"),
+    ("翔太", "しょうた"), ("拓也", "たくや"), ("直樹", "なおき"), ("浩", "ひろし"), ("修", "おさむ"),
+    ("和也", "かずや"), ("隆", "たかし"), ("亮", "りょう"), ("悠斗", "ゆうと"), ("蓮", "れん"),
+    ("花子", "はなこ"), ("美咲", "みさき"), ("陽子", "ようこ"), ("由美", "ゆみ"), ("恵子", "けいこ"),
+    ("裕子", "ゆうこ"), ("真由美", "まゆみ"), ("智子", "ともこ"), ("直美", "なおみ"), ("久美子", "くみこ"),
+    ("さくら", "さくら"), ("愛", "あい"), ("舞", "まい"), ("彩", "あや"), ("千尋", "ちひろ"),
+]
+CHILD_FIRST_NAMES = [
+    ("陽翔", "はると"), ("蒼", "あおい"), ("湊", "みなと"), ("樹", "いつき"), ("大和", "やまと"),
+    ("悠真", "ゆうま"), ("朝陽", "あさひ"), ("律", "りつ"), ("結菜", "ゆいな"), ("陽葵", "ひまり"),
+    ("凛", "りん"), ("芽依", "めい"), ("紬", "つむぎ"), ("澪", "みお"), ("結愛", "ゆあ"), ("葵", "あおい"),
+]
+DISTRICTS = ["養老町高田", "養老町石畑", "養老町押越", "養老町大場", "養老町船附", "養老町直江", "養老町室原", "養老町小倉",
+             "養老町鷲巣", "養老町飯ノ木", "養老町大巻", "養老町烏江", "養老町広瀬", "養老町橋爪", "養老町沢田"]
+LESSON_TITLES = ["親子体操", "ヨガ", "ピラティス", "太極拳", "卓球", "バドミントン", "ソフトテニス", "フラダンス",
+                 "エアロビクス", "ストレッチ", "ウォーキング", "キッズダンス", "バレーボール", "筋力トレーニング", "健康体操",
+                 "ズンバ", "ボクササイズ", "社交ダンス", "ノルディックウォーキング", "リズム体操"]
+DAYS = ["月", "火", "水", "木", "金", "土"]
+TIMES = ["9:30〜11:00", "10:00〜11:30", "13:30〜15:00", "19:00〜20:30", "19:30〜21:00"]
+BCRYPT_SALT_CHARS = "./ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+BASE_TIME = datetime(2023, 1, 1, 9, 0, 0) # created_time of the first user, JST like the app stores it
+
+
+
+# create the schema through the app's models so the file matches create_database()
+# (an engine of its own: the app's engine is bound to DB_CONNECTION_STRING once database.py is imported)
+def create_schema(db_file: str):
+    import models.items, models.todos, models.users, models.lessons, models.settings, models.link_table, models.logs # every table for create_all
+    engine = create_engine(f"sqlite:///{db_file}")
+    try:
+        SQLModel.metadata.create_all(engine)
+        create_member_search(engine)
+    finally:
+        # close the pooled connections: the loader below needs the file to itself
+        engine.dispose()
+
+
+# bcrypt with a salt taken from the seeded generator: same seed, same hash
+def hash_password(password: str, random_generator: random.Random, rounds: int = 12) -> str:
+    import bcrypt
+    salt = "".join(random_generator.choice(BCRYPT_SALT_CHARS) for i in range(21)) + random_generator.choice(".Oeu")
+    return bcrypt.hashpw(password.encode(), f"$2b${rounds:02d}${salt}".encode()).decode()
+
+
+def to_sqlite_datetime(value: datetime) -> str:
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def bulk_insert(connection: sqlite3.Connection, table: str, columns: tuple, rows: list):
+    if rows:
+        placeholders = ", ".join("?" for column in columns)
+        connection.executemany(f'INSERT INTO "{table}" ({", ".join(columns)}) VALUES ({placeholders})', rows)
+
+
+
+# generate everything and return what the load test needs to drive the app
+def generate(db_file: str, users: int = 1000, seed: int = 1, password: str = "password", children_ratio: float = 0.3,
+             first_year: int = 2024, years: int = 2, lessons_per_season: int = 15, capacity: int = 20,
+             participation: float = 0.4, lessons_per_user: int = 2, period_start: datetime = None) -> dict:
+    """period_start (utc): the last season opens then and has no enrollments yet, otherwise every season is full of signups"""
+    random_generator = random.Random(seed)
+    create_schema(db_file)
+    connection = sqlite3.connect(db_file)
+    # a throwaway file: no journal and no fsync while loading
+    connection.execute("PRAGMA journal_mode=OFF")
+    connection.execute("PRAGMA synchronous=OFF")
+    hashed_password = hash_password(password, random_generator)
+
+    # users, details and children
+    user_rows, detail_rows, detail_links, child_rows, child_links, search_rows = [], [], [], [], [], []
+    accounts = []
+    children_of = {}
+    child_id = 0
+    for user_id in range(1, users + 1):
+        last_name, last_name_furigana = random_generator.choice(LAST_NAMES)
+        first_name, first_name_furigana = random_generator.choice(FIRST_NAMES)
+        username = f"user{user_id:06d}"
+        created_time = to_sqlite_datetime(BASE_TIME + timedelta(minutes=user_id))
+        user_rows.append((user_id, username, hashed_password, True, False))
+        tel = f"0584-{random_generator.randint(30, 35)}-{random_generator.randint(0, 9999):04d}"
+        postal_code = f"503-{random_generator.randint(1300, 1399)}"
+        address = f"{random_generator.choice(DISTRICTS)}{random_generator.randint(1, 3000)}"
+        detail_rows.append((user_id, user_id, None, first_name, last_name, first_name_furigana, last_name_furigana, tel, postal_code, address,
+                            created_time, normalize_kana(first_name_furigana), normalize_kana(last_name_furigana)))
+        detail_links.append((user_id, user_id))
+        children_ids = []
+        children_names = []
+        if random_generator.random() < children_ratio:
+            for i in range(random_generator.choice((1, 1, 2, 2, 3))):
+                child_id += 1
+                child_first_name, child_first_name_furigana = random_generator.choice(CHILD_FIRST_NAMES)
+                child_rows.append((child_id, user_id, child_first_name, last_name, child_first_name_furigana, last_name_furigana))
+                child_links.append((user_id, child_id))
+                children_ids.append(child_id)
+                children_names.append((child_first_name, last_name, child_first_name_furigana, last_name_furigana))
+        row = member_search_row(user_id, user_id, last_name, first_name, last_name_furigana, first_name_furigana, tel, postal_code, address, children_names)
+        search_rows.append(tuple(row.values()))
+        children_of[user_id] = children_ids
+        accounts.append({"user_id": user_id, "username": username, "children_ids": children_ids})
+
+    # lessons: number 1 is the lesson for parents and children in every season
+    lesson_rows = []
+    seasons = []
+    lesson_id = 0
+    for year in range(first_year, first_year + years):
+        for season in (1, 2):
+            season_lessons = []
+            for number in range(1, lessons_per_season + 1):
+                lesson_id += 1
+                title = LESSON_TITLES[(number - 1) % len(LESSON_TITLES)]
+                lesson_rows.append([lesson_id, year, season, number, title, f"{random_generator.choice(LAST_NAMES)[0]}講師",
+                                    random_generator.choice(DAYS), random_generator.choice(TIMES), random_generator.choice((3000, 4000, 5000, 6000)),
+                                    f"{title}の教室です。", capacity, 10, capacity])
+                season_lessons.append((lesson_id, number))
+            seasons.append((year, season, season_lessons))
+
+    # enrollments in signup order: lesson_id -> next signup_seq
+    user_links, child_lesson_links = [], []
+    members = {}
+    child_members = {}
+    open_season = seasons[-1] if period_start is not None else None
+    for year, season, season_lessons in seasons:
+        if (year, season, season_lessons) == open_season:
+            continue
+        adult_lessons = [lesson for lesson in season_lessons if lesson[1] != 1]
+        family_lesson = season_lessons[0][0]
+        for account in random_generator.sample(accounts, len(accounts)): # shuffled signup order
+            if random_generator.random() >= participation:
+                continue
+            user_id = account["user_id"]
+            picks = random_generator.sample(adult_lessons, min(random_generator.randint(1, lessons_per_user), len(adult_lessons)))
+            for picked_lesson_id, number in picks:
+                members[picked_lesson_id] = members.get(picked_lesson_id, 0) + 1
+                user_links.append((user_id, picked_lesson_id, members[picked_lesson_id]))
+            if children_of[user_id] and random_generator.random() < 0.5:
+                members[family_lesson] = members.get(family_lesson, 0) + 1
+                user_links.append((user_id, family_lesson, members[family_lesson]))
+                for child in children_of[user_id]:
+                    child_members[family_lesson] = child_members.get(family_lesson, 0) + 1
+                    child_lesson_links.append((child, family_lesson, child_members[family_lesson]))
+    for row in lesson_rows:
+        taken = child_members.get(row[0], 0) if row[3] == 1 else members.get(row[0], 0)
+        row[-1] = capacity - taken
+
+    # the current period: the last season, opening at period_start or already open
+    year, season, season_lessons = seasons[-1]
+    if period_start is None:
+        period_start = datetime(year, 3 if season == 1 else 9, 1, 0, 0, 0)
+    period_row = (1, year, season, to_sqlite_datetime(period_start), to_sqlite_datetime(period_start + timedelta(days=14)))
+
+    with connection:
+        bulk_insert(connection, "user", ("id", "username", "hashed_password", "is_active", "is_admin"), user_rows)
+        bulk_insert(connection, "userdetail", ("id", "user_id", "email", "first_name", "last_name", "first_name_furigana",
+                                               "last_name_furigana", "tel", "postal_code", "address", "created_time",
+                                               "first_name_search", "last_name_search"), detail_rows)
+        bulk_insert(connection, "useruserdetaillink", ("user_id", "user_details_id"), detail_links)
+        bulk_insert(connection, "userchild", ("id", "user_id", "child_first_name", "child_last_name",
+                                              "child_first_name_furigana", "child_last_name_furigana"), child_rows)
+        bulk_insert(connection, "useruserchildlink", ("user_id", "user_children_id"), child_links)
+        bulk_insert(connection, "membersearch", ("rowid",) + MEMBER_SEARCH_COLUMNS, search_rows)
+        bulk_insert(connection, "lesson", ("id", "year", "season", "number", "title", "teacher", "day", "time", "price",
+                                           "description", "capacity", "lessons", "capacity_left"), lesson_rows)
+        bulk_insert(connection, "userlessonlink", ("user_id", "lesson_id", "signup_seq"), user_links)
+        bulk_insert(connection, "userchildlessonlink", ("user_child_id", "lesson_id", "signup_seq"), child_lesson_links)
+        bulk_insert(connection, "period", ("id", "year", "season", "start_time", "end_time"), [period_row])
+    connection.execute("ANALYZE")
+    connection.close()
+    return {
+        "accounts": accounts,
+        "year": year,
+        "season": season,
+        "lessons": [lesson_id for lesson_id, number in season_lessons if number != 1],
+        "family_lesson": season_lessons[0][0],
+        "counts": {"users": len(user_rows), "children": len(child_rows), "lessons": len(lesson_rows),
+                   "enrollments": len(user_links), "child_enrollments": len(child_lesson_links)},
+    }
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="generate a synthetic club into a new sqlite file")
+    parser.add_argument("--db", required=True, help="sqlite file to create")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--password", default="password", help="password of every generated user")
+    parser.add_argument("--children-ratio", type=float, default=0.3, help="share of users with children")
+    parser.add_argument("--first-year", type=int, default=2024)
+    parser.add_argument("--years", type=int, default=2, help="two seasons per year")
+    parser.add_argument("--lessons", type=int, default=15, help="lessons per season")
+    parser.add_argument("--capacity", type=int, default=20)
+    parser.add_argument("--participation", type=float, default=0.4, help="share of users signing up in a season")
+    parser.add_argument("--lessons-per-user", type=int, default=2)
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        sys.exit(f"{args.db} already exists")
+    started = time.perf_counter()
+    result = generate(args.db, users=args.users, seed=args.seed, password=args.password, children_ratio=args.children_ratio,
+                      first_year=args.first_year, years=args.years, lessons_per_season=args.lessons, capacity=args.capacity,
+                      participation=args.participation, lessons_per_user=args.lessons_per_user)
+    counts = ", ".join(f"{count} {name}" for name, count in result["counts"].items())
+    print(f"{args.db}: {counts} in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
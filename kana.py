@@ -0,0 +1,22 @@
+# --- kana.py ---
+
+# modules
+import unicodedata
+
+
+# katakana ァ (U+30A1) .. ヶ (U+30F6) -> hiragana ぁ (U+3041) .. ゖ (U+3096)
+KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+
+# search key of a furigana: width folded (NFKC), katakana -> hiragana, no whitespace, lower case
+# "ヤマダ　タロウ", "ﾔﾏﾀﾞ" and "やまだ " all become "やまだ..." so a prefix search finds them all
+def normalize_kana(text: str) -> str:
+    if text is None:
+        return None
+    text = unicodedata.normalize("NFKC", text).translate(KATAKANA_TO_HIRAGANA)
+    return "".join(text.split()).lower()
+
+
+# upper bound of a prefix range: key <= value < prefix_end(key) is "value starts with key" and can use an index
+def prefix_end(key: str) -> str:
+    return key + "\U0010ffff"
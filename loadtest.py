@@ -0,0 +1,216 @@
+# --- loadtest.py ---
+# replay the signup opening against a local server:
+#   python loadtest.py --users 300 --concurrency 50
+# seeds a fresh sqlite file with datagen.py, starts the server on it (serve.py, --workers processes), logs every user in, polls /json/lessons,
+# waits for the period to open and fires the signups, then reports latency and checks capacity_left
+
+# modules
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# my modules
+import datagen
+
+
+PASSWORD = "loadtest"
+
+
+
+# one keep-alive connection per worker thread, like one browser per parent
+class Client:
+    local = threading.local()
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.lock = threading.Lock()
+        self.samples = {} # label: [(seconds, status), ...]
+
+
+    def request(self, label: str, method: str, path: str, body: bytes = None, headers: dict = None) -> tuple:
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            self.local.connection = connection
+        started = time.perf_counter()
+        try:
+            connection.request(method, path, body=body, headers=headers or {})
+            response = connection.getresponse()
+            status, data, response_headers = response.status, response.read(), dict(response.getheaders())
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self.local.connection = None
+            status, data, response_headers = 0, b"", {}
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.samples.setdefault(label, []).append((elapsed, status))
+        return status, data, response_headers
+
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def run_phase(name: str, accounts: list, concurrency: int, work) -> float:
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(work, accounts))
+    elapsed = time.perf_counter() - started
+    print(f"{name}: {len(accounts)} users in {elapsed:.2f}s")
+    return elapsed
+
+
+def print_report(client: Client, phase_seconds: dict):
+    print()
+    print(f"{'request':<18}{'count':>7}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for label, samples in client.samples.items():
+        latencies = sorted(seconds for seconds, status in samples)
+        # errors: no response or 5xx; other statuses (403 before the opening, 304, ...) are listed for information
+        errors = sum(1 for seconds, status in samples if status == 0 or status >= 500)
+        statuses = {}
+        for seconds, status in samples:
+            if status != 200:
+                statuses[status] = statuses.get(status, 0) + 1
+        throughput = len(samples) / phase_seconds[label] if phase_seconds.get(label) else 0.0
+        print(f"{label:<18}{len(samples):>7}{errors:>8}{throughput:>9.1f}"
+              f"{percentile(latencies, 0.5) * 1000:>9.1f}{percentile(latencies, 0.99) * 1000:>9.1f}{latencies[-1] * 1000:>9.1f}"
+              + (f"  status: {statuses}" if statuses else ""))
+
+
+# capacity_left must equal capacity minus the members counted from the link tables, and signup_seq must be unique
+def check_consistency(db_file: str) -> bool:
+    connection = sqlite3.connect(db_file)
+    rows = connection.execute(
+        "SELECT lesson.id, lesson.number, lesson.capacity, lesson.capacity_left, "
+        "(SELECT COUNT(*) FROM userlessonlink WHERE lesson_id = lesson.id), "
+        "(SELECT COUNT(*) FROM userchildlessonlink WHERE lesson_id = lesson.id), "
+        "(SELECT COUNT(DISTINCT signup_seq) FROM userlessonlink WHERE lesson_id = lesson.id), "
+        "(SELECT COUNT(DISTINCT signup_seq) FROM userchildlessonlink WHERE lesson_id = lesson.id) "
+        "FROM lesson ORDER BY lesson.id"
+    ).fetchall()
+    connection.close()
+    consistent = True
+    print()
+    print(f"{'lesson':<8}{'capacity':>9}{'left':>7}{'members':>9}  check")
+    for lesson_id, number, capacity, capacity_left, users, children, user_seqs, child_seqs in rows:
+        members, seqs = (children, child_seqs) if number == 1 else (users, user_seqs)
+        problems = []
+        if capacity_left != capacity - members:
+            problems.append(f"capacity_left should be {capacity - members}")
+        if seqs != members or user_seqs != users:
+            problems.append("duplicate signup_seq")
+        consistent = consistent and not problems
+        print(f"{lesson_id:<8}{capacity:>9}{capacity_left:>7}{members:>9}  {'; '.join(problems) or 'ok'}")
+    return consistent
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="replay the signup opening against a local server")
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--lessons", type=int, default=15)
+    parser.add_argument("--capacity", type=int, default=20)
+    parser.add_argument("--children-ratio", type=float, default=0.3, help="share of users with children")
+    parser.add_argument("--lessons-per-user", type=int, default=3)
+    parser.add_argument("--polls", type=int, default=3, help="GET /json/lessons per user before the opening")
+    parser.add_argument("--concurrency", type=int, default=50, help="users acting at the same time")
+    parser.add_argument("--opens-in", type=float, default=60.0, help="seconds from seeding to the period start")
+    parser.add_argument("--workers", type=int, default=1, help="server worker processes (serve.py)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--db", help="sqlite file to create (default: a temporary file)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="yoro-sc-loadtest-")
+    db_file = os.path.abspath(args.db or os.path.join(workdir, "loadtest.sqlite"))
+    if os.path.exists(db_file):
+        sys.exit(f"{db_file} already exists")
+    opens_at = datetime.utcnow() + timedelta(seconds=args.opens_in)
+    started = time.perf_counter()
+    # last season's signups are history, this season opens at opens_at
+    club = datagen.generate(db_file, users=args.users, seed=args.seed, password=PASSWORD, children_ratio=args.children_ratio,
+                            first_year=opens_at.year, years=1, lessons_per_season=args.lessons, capacity=args.capacity,
+                            period_start=opens_at)
+    accounts = club["accounts"]
+    counts = ", ".join(f"{count} {name}" for name, count in club["counts"].items())
+    print(f"seeded {db_file}: {counts} in {time.perf_counter() - started:.2f}s")
+
+    env = dict(os.environ, DB_CONNECTION_STRING=f"sqlite:///{db_file}", LOG_PATH=os.path.join(workdir, "logs.jsonl"),
+               WORKERS=str(args.workers), HOST="127.0.0.1", PORT=str(args.port), LOG_LEVEL="warning")
+    server = subprocess.Popen([sys.executable, "serve.py"], cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    try:
+        client = Client("127.0.0.1", args.port)
+        for attempt in range(100):
+            if client.request("warmup", "GET", "/warmup")[0] == 200:
+                break
+            time.sleep(0.1)
+        else:
+            sys.exit("server did not start")
+        client.samples.clear()
+        random_generator = random.Random(args.seed)
+        adult_lessons = club["lessons"]
+        for account in accounts:
+            account["lessons"] = random_generator.sample(adult_lessons, min(args.lessons_per_user, len(adult_lessons)))
+        phase_seconds = {}
+
+        def login(account):
+            body = urlencode({"username": account["username"], "password": PASSWORD}).encode()
+            status, data, response_headers = client.request("POST /token", "POST", "/token", body, {"Content-Type": "application/x-www-form-urlencoded"})
+            account["headers"] = {"Authorization": "Bearer " + json.loads(data)["access_token"]} if status == 200 else {}
+
+        def poll(account):
+            # revalidate with the etag like the browser does (cache: "no-cache")
+            etag = None
+            for i in range(args.polls):
+                status, data, response_headers = client.request("GET /json/lessons", "GET", "/json/lessons", headers={"If-None-Match": etag} if etag else {})
+                etag = response_headers.get("etag", etag)
+
+        def sign_up(account):
+            # one more look at the lessons once they are open, then the signups
+            client.request("GET /json/lessons", "GET", "/json/lessons")
+            for lesson_id in account["lessons"]:
+                client.request("POST /lessons/{id}", "POST", f"/lessons/{lesson_id}", headers=account["headers"])
+            if account["children_ids"]:
+                body = json.dumps({"children_ids": account["children_ids"]}).encode()
+                client.request("POST children", "POST", f"/lessons_for_children/{club['family_lesson']}", body, {**account["headers"], "Content-Type": "application/json"})
+
+        phase_seconds["POST /token"] = run_phase("login", accounts, args.concurrency, login)
+        poll_seconds = run_phase("poll", accounts, args.concurrency, poll)
+        wait = (opens_at - datetime.utcnow()).total_seconds()
+        if wait > 0:
+            print(f"waiting {wait:.1f}s for the opening")
+            time.sleep(wait + 0.1)
+        else:
+            print(f"the period opened {-wait:.1f}s before the signups started: raise --opens-in")
+        signup_seconds = run_phase("signup", accounts, args.concurrency, sign_up)
+        phase_seconds["GET /json/lessons"] = poll_seconds + signup_seconds
+        phase_seconds["POST /lessons/{id}"] = signup_seconds
+        phase_seconds["POST children"] = signup_seconds
+        print_report(client, phase_seconds)
+    finally:
+        server.terminate()
+        server.wait()
+    consistent = check_consistency(db_file)
+    print()
+    print("capacity consistent" if consistent else "CAPACITY INCONSISTENT")
+    sys.exit(0 if consistent else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,73 @@
+import atexit
+from collections import Counter
+import contextlib
+import gzip
 import json
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from sqlmodel import Session, select
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from database import engine
+from models.logs import AuditLog
+
+try:
+    import fcntl # ワーカープロセス間のローテーションの排他に使う（Windowsにはない）
+except ImportError:
+    fcntl = None
+
+FILE_PATH = Path("logs.json") # 旧形式: JSON配列をまるごと書き換えていたファイル
+# 現在のセグメント: 1行1件で追記する
+if "LOG_PATH" in os.environ:
+    LOG_PATH = Path(os.getenv("LOG_PATH"))
+else:
+    LOG_PATH = Path("logs.jsonl")
+
+# ローテーション設定: サイズ(バイト)と経過日数のどちらかを超えたら新しいセグメントにする
+if "LOG_MAX_BYTES" in os.environ:
+    LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES"))
+else:
+    LOG_MAX_BYTES = 10 * 1024 * 1024
+
+if "LOG_MAX_AGE_DAYS" in os.environ:
+    LOG_MAX_AGE_DAYS = float(os.getenv("LOG_MAX_AGE_DAYS"))
+else:
+    LOG_MAX_AGE_DAYS = 7
+
+# バックグラウンド書き込みの設定: キューの上限、1回にまとめて書く件数、キューが満杯のときに待つ秒数
+if "LOG_QUEUE_SIZE" in os.environ:
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE"))
+else:
+    LOG_QUEUE_SIZE = 10000
+
+if "LOG_BATCH_SIZE" in os.environ:
+    LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE"))
+else:
+    LOG_BATCH_SIZE = 500
+
+if "LOG_QUEUE_TIMEOUT" in os.environ:
+    LOG_QUEUE_TIMEOUT = float(os.getenv("LOG_QUEUE_TIMEOUT"))
+else:
+    LOG_QUEUE_TIMEOUT = 0.5
+
+JST = timezone(timedelta(hours=9))
+
+_rotate_lock = threading.Lock()
+_segment_started = {} # セグメントのパス: (ファイルの(st_dev, st_ino), 最初のログの時刻)
 
-FILE_PATH = Path("logs.json")
 
 def add_log(user_name: str, user_tel: str, user_address: str,
             lesson_number: int, lesson_title: str, action: str,
-            file_path: Path = FILE_PATH):
+            file_path: Path = LOG_PATH):
     """
-    ログをJSONファイルに追記する関数
+    ログをJSON Lines形式でファイルの末尾に1行追記する関数
 
     Parameters
     ----------
@@ -25,21 +84,12 @@ def add_log(user_name: str, user_tel: str, user_address: str,
     action : str
         "apply" or "cancel" などのアクション名
     file_path : Path, optional
-        ログを保存するファイルパス（デフォルトは "logs.json"）
+        ログを保存するファイルパス（デフォルトは "logs.jsonl"）
     """
-    # JSONファイルを読み込む
-    if file_path.exists():
-        with open(file_path, "r", encoding="utf-8") as f:
-            logs = json.load(f)
-    else:
-        logs = []
-
     # JSTの現在時刻を取得
-    jst = timezone(timedelta(hours=9))
-    timestamp = datetime.now(jst).isoformat()
+    timestamp = datetime.now(JST).isoformat()
 
-    # ログを追加
-    logs.append({
+    log = {
         "user_name": user_name,
         "user_tel": user_tel,
         "user_address": user_address,
@@ -47,8 +97,360 @@ def add_log(user_name: str, user_tel: str, user_address: str,
         "lesson_title": lesson_title,
         "action": action,
         "timestamp": timestamp
-    })
+    }
+    # ファイルへの書き込みはバックグラウンドのライターに任せる
+    if file_path == log_writer.file_path:
+        log_writer.submit(log)
+    else:
+        write_log_lines([log], file_path)
+
+
+def write_log_lines(logs: list, file_path: Path = LOG_PATH):
+    """
+    ログのリストをまとめて追記する（ファイル全体は読み込まない）
+    """
+    rotate_if_needed(file_path)
+    lines = "".join(json.dumps(log, ensure_ascii=False) + "\n" for log in logs)
+    # 追記モード: 1回のwriteで書くので他のワーカーの行と混ざらない
+    with open(file_path, "a", encoding="utf-8") as f:
+        f.write(lines)
+
+
+def rotate_if_needed(file_path: Path = LOG_PATH):
+    """
+    現在のセグメントが大きすぎるか古すぎる場合に閉じて、以前に閉じたセグメントを圧縮する
+
+    同じプロセスのスレッド同士はロック、ワーカープロセス同士はロックファイル（flock）で排他し、
+    ロックを取った後にもう一度確かめる（先に他のスレッドやワーカーがローテーションしていれば何もしない）
+    """
+    if not segment_needs_rotation(file_path):
+        return
+    with _rotate_lock, rotation_file_lock(file_path):
+        if not segment_needs_rotation(file_path):
+            return
+        closed_path = new_segment_path(file_path)
+        os.rename(file_path, closed_path)
+        _segment_started.pop(file_path, None)
+        # 直前に閉じたセグメントは他のワーカーが書き込み中の可能性があるので次回に圧縮する
+        for path in closed_segments(file_path):
+            if path.suffix == ".jsonl" and path != closed_path:
+                compress_segment(path)
+
+
+def segment_needs_rotation(file_path: Path) -> bool:
+    try:
+        stat = file_path.stat()
+    except FileNotFoundError:
+        return False
+    # 最初のログの時刻はファイルごとに覚える: 他のワーカーがローテーションしたらinodeが変わるので読み直す
+    file_id = (stat.st_dev, stat.st_ino)
+    cached = _segment_started.get(file_path)
+    if cached is not None and cached[0] == file_id:
+        started = cached[1]
+    else:
+        started = read_segment_start(file_path)
+        _segment_started[file_path] = (file_id, started)
+    too_old = started is not None and datetime.now(JST) - started > timedelta(days=LOG_MAX_AGE_DAYS)
+    return stat.st_size >= LOG_MAX_BYTES or too_old
+
+
+@contextlib.contextmanager
+def rotation_file_lock(file_path: Path):
+    if fcntl is None:
+        yield
+        return
+    with open(file_path.with_name(file_path.name + ".lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def new_segment_path(file_path: Path) -> Path:
+    """
+    閉じるセグメントの名前: "logs-YYYYmmddTHHMMSSffffff-pid.jsonl"（名前順が時刻順）。既存のファイルは上書きしない
+    """
+    label = datetime.now(JST).strftime("%Y%m%dT%H%M%S%f") + f"-{os.getpid()}"
+    closed_path = segment_path(file_path, label, ".jsonl")
+    counter = 1
+    while closed_path.exists() or closed_path.with_name(closed_path.name + ".gz").exists():
+        closed_path = segment_path(file_path, f"{label}-{counter}", ".jsonl")
+        counter += 1
+    return closed_path
+
+
+def read_segment_start(file_path: Path):
+    with open(file_path, "r", encoding="utf-8") as f:
+        first_line = f.readline()
+    if not first_line.strip():
+        return None
+    return datetime.fromisoformat(json.loads(first_line)["timestamp"])
+
+
+def segment_path(file_path: Path, label: str, suffix: str) -> Path:
+    return file_path.with_name(f"{file_path.stem}-{label}{suffix}")
+
+
+def closed_segments(file_path: Path = LOG_PATH) -> list:
+    """
+    閉じたセグメントを古い順に返す（"logs-YYYYmmddTHHMMSS....jsonl" または ".jsonl.gz"）
+    """
+    segments = list(file_path.parent.glob(f"{file_path.stem}-*.jsonl")) + list(file_path.parent.glob(f"{file_path.stem}-*.jsonl.gz"))
+    return sorted(segments, key=lambda path: path.name.split(".")[0])
+
+
+def compress_segment(path: Path):
+    with open(path, "rb") as src, gzip.open(path.with_name(path.name + ".gz"), "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    path.unlink()
+
 
-    # JSONファイルに書き込む
-    with open(file_path, "w", encoding="utf-8") as f:
-        json.dump(logs, f, ensure_ascii=False, indent=2)
+class LogWriter:
+    """
+    ログをメモリ上のキューに受け取り、バックグラウンドのスレッドがまとめてファイルに書き込む
+
+    キューが満杯のときは呼び出し側が最大LOG_QUEUE_TIMEOUT秒待ち、それでも空かなければ
+    その場で直接書き込む（ログは捨てない）。stop()はキューに残ったログをすべて書いてから終わり、
+    その後のログは呼び出し側で直接書き込む
+    """
+
+    def __init__(self, file_path: Path = LOG_PATH, maxsize: int = LOG_QUEUE_SIZE, batch_size: int = LOG_BATCH_SIZE):
+        self.file_path = file_path
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stopped = False
+        # バックプレッシャーの指標（stats()と複数のスレッドから触るのでself.lockを持って更新する）
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.max_depth = 0
+        self.blocked = 0 # キューが満杯で待たされた回数
+        self.blocked_seconds = 0.0
+        self.direct_writes = 0 # 待っても空かず直接書き込んだ回数
+        self.errors = 0
+
+    def start(self):
+        with self.lock:
+            self.stopped = False
+            self.start_thread()
+
+    def start_thread(self):
+        """
+        self.lockを持った状態で呼ぶ
+        """
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.run, name="log-writer", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            thread = self.thread
+            self.thread = None
+        if thread is not None and thread.is_alive():
+            self.queue.put(None)
+            thread.join()
+        # 止める直前にsubmitされて終了の合図より後ろに入ったログも書く
+        leftovers = []
+        while True:
+            try:
+                log = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if log is not None:
+                leftovers.append(log)
+        if leftovers:
+            self.write_batch(leftovers)
+
+    def submit(self, log: dict):
+        with self.lock:
+            stopped = self.stopped
+            if stopped:
+                self.direct_writes += 1
+            else:
+                self.start_thread()
+        if stopped:
+            # stop()の後はライターを起動し直さず、その場で書き込む
+            self.write_batch([log])
+            return
+        try:
+            self.queue.put_nowait(log)
+        except queue.Full:
+            with self.lock:
+                self.blocked += 1
+            started = time.monotonic()
+            try:
+                self.queue.put(log, timeout=LOG_QUEUE_TIMEOUT)
+            except queue.Full:
+                with self.lock:
+                    self.direct_writes += 1
+                self.write_batch([log])
+                return
+            finally:
+                with self.lock:
+                    self.blocked_seconds += time.monotonic() - started
+        depth = self.queue.qsize()
+        with self.lock:
+            self.enqueued += 1
+            self.max_depth = max(self.max_depth, depth)
+
+    def run(self):
+        while True:
+            log = self.queue.get()
+            if log is None:
+                return
+            batch = [log]
+            stop_after_batch = False
+            while len(batch) < self.batch_size:
+                try:
+                    log = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if log is None:
+                    stop_after_batch = True
+                    break
+                batch.append(log)
+            self.write_batch(batch)
+            if stop_after_batch:
+                return
+
+    def write_batch(self, batch: list):
+        # ファイル（アーカイブ）とテーブル（検索用）の両方に書く。失敗しても捨てずに少し待って再試行する
+        file_written = False
+        for attempt in range(5):
+            try:
+                if not file_written:
+                    write_log_lines(batch, self.file_path)
+                    file_written = True
+                insert_audit_logs(batch)
+                with self.lock:
+                    self.written += len(batch)
+                    self.batches += 1
+                return
+            except (OSError, SQLAlchemyError) as e:
+                with self.lock:
+                    self.errors += 1
+                print(f"log writer: failed to write {len(batch)} logs: {e}", file=sys.stderr)
+                time.sleep(0.1 * (attempt + 1))
+        # 最後の手段: 標準エラーに出して残す
+        for log in batch:
+            where = "table" if file_written else "file and table"
+            print(f"log writer: not written to {where}: " + json.dumps(log, ensure_ascii=False), file=sys.stderr)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "queue_depth": self.queue.qsize(),
+                "queue_maxsize": self.queue.maxsize,
+                "max_depth": self.max_depth,
+                "enqueued": self.enqueued,
+                "written": self.written,
+                "batches": self.batches,
+                "blocked": self.blocked,
+                "blocked_seconds": self.blocked_seconds,
+                "direct_writes": self.direct_writes,
+                "errors": self.errors,
+            }
+
+
+def insert_audit_logs(logs: list):
+    """
+    ログのリストをauditlogテーブルに1回のINSERTでまとめて追加する
+    """
+    with Session(engine) as session:
+        session.execute(insert(AuditLog), logs)
+        session.commit()
+
+
+log_writer = LogWriter()
+
+
+def start_log_writer():
+    log_writer.start()
+
+
+def stop_log_writer():
+    """
+    キューに残っているログをすべて書き込んでからライターを止める
+    """
+    log_writer.stop()
+
+
+# on_shutdownが呼ばれずに終了した場合も残りを書き込む
+atexit.register(stop_log_writer)
+
+
+def read_logs(file_path: Path = LOG_PATH, legacy_path: Path = FILE_PATH):
+    """
+    すべてのログを古い順に1件ずつ返すジェネレーター（旧形式のlogs.jsonも含む）
+    """
+    if legacy_path.exists():
+        with open(legacy_path, "r", encoding="utf-8") as f:
+            yield from json.load(f)
+    for path in closed_segments(file_path) + [file_path]:
+        if not path.exists():
+            continue
+        opener = gzip.open if path.suffix == ".gz" else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def convert_legacy_logs(legacy_path: Path = FILE_PATH, file_path: Path = LOG_PATH) -> int:
+    """
+    旧形式のlogs.jsonを圧縮済みのJSON Linesセグメントに一度だけ変換する
+
+    変換後のlogs.jsonは "logs.json.converted" に名前を変えて残す
+    """
+    if not legacy_path.exists():
+        return 0
+    with open(legacy_path, "r", encoding="utf-8") as f:
+        logs = json.load(f)
+    # 既存のセグメントより前に並ぶように日付0のラベルを付ける
+    converted_path = segment_path(file_path, "00000000T000000", ".jsonl.gz")
+    with gzip.open(converted_path, "wt", encoding="utf-8") as f:
+        for log in logs:
+            f.write(json.dumps(log, ensure_ascii=False) + "\n")
+    os.replace(legacy_path, legacy_path.with_name(legacy_path.name + ".converted"))
+    return len(logs)
+
+
+def import_logs(chunk_size: int = 1000, file_path: Path = LOG_PATH, legacy_path: Path = FILE_PATH) -> int:
+    """
+    ファイルに残っているログのうち、auditlogテーブルにまだないものを取り込む
+
+    (timestamp, action, lesson_number, user_name) が同じ行をテーブルにある件数だけ読み飛ばすので、
+    途中で止まった取り込みや、ライターがすでに書いた行があっても何度でもやり直せる
+    """
+    with Session(engine) as session:
+        existing = Counter(tuple(row) for row in session.exec(select(AuditLog.timestamp, AuditLog.action, AuditLog.lesson_number, AuditLog.user_name)).all())
+    count = 0
+    chunk = []
+    for log in read_logs(file_path, legacy_path):
+        key = (log["timestamp"], log["action"], log["lesson_number"], log["user_name"])
+        if existing[key] > 0:
+            existing[key] -= 1
+            continue
+        chunk.append(log)
+        if len(chunk) >= chunk_size:
+            insert_audit_logs(chunk)
+            count += len(chunk)
+            chunk = []
+    if chunk:
+        insert_audit_logs(chunk)
+        count += len(chunk)
+    return count
+
+
+if __name__ == "__main__":
+    # python logs.py convert | import
+    if sys.argv[1:] == ["convert"]:
+        print(f"converted {convert_legacy_logs()} logs")
+    elif sys.argv[1:] == ["import"]:
+        print(f"imported {import_logs()} logs")
+    else:
+        print("usage: python logs.py convert | import")
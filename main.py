@@ -7,20 +7,70 @@ from fastapi.staticfiles import StaticFiles
 import os
 from alembic import command
 from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import inspect
+from sqlmodel import SQLModel
 
 # my modules
-from database import engine, create_database
+from database import engine, async_engine, create_database, report_sqlite_pragmas
 import routers.html, routers.items, routers.users, routers.lessons, routers.auth, routers.todos, routers.test, routers.password_reset, routers.settings
 from force_sqlite import force_sqlite
+from signup_writer import start_signup_writer, stop_signup_writer
+from logs import start_log_writer, stop_log_writer
+from sqlstats import SQLStatsMiddleware
+from metrics import MetricsMiddleware
+from member_search import create_member_search
+from passwords import start_password_hasher, stop_password_hasher
 
 # FastAPI instance
 app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
 
-# migrate database
+# migrate database: the alembic scripts run against the app's own database (the .ini files are for the alembic command line;
+# no config file here, so env.py leaves the logging set up by uvicorn alone)
+def alembic_config() -> Config:
+    alembic_cfg = Config()
+    alembic_cfg.set_main_option("script_location", os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic"))
+    alembic_cfg.set_main_option("sqlalchemy.url", engine.url.render_as_string(hide_password=False).replace("%", "%%"))
+    return alembic_cfg
+
+
 def migrate_database():
-    if "WEBSITES_ENABLE_APP_SERVICE_STORAGE" in os.environ:
-        alembic_cfg = Config("alembic_product.ini")
-        command.upgrade(alembic_cfg, "head")
+    command.upgrade(alembic_config(), "head")
+
+
+# columns of the models that the database does not have: ["table.column", ...]
+def missing_columns(connection) -> list:
+    inspector = inspect(connection)
+    tables = set(inspector.get_table_names())
+    missing = []
+    for table in SQLModel.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        missing += [f"{table.name}.{column.name}" for column in table.columns if column.name not in columns]
+    return missing
+
+
+# bring the schema to the models' revision before anything queries it:
+# a new database gets the tables from the models and is stamped with the head revision, a stamped one is upgraded,
+# an unstamped one (created by create_all) is stamped only if it already has every column, otherwise startup stops here
+def prepare_database():
+    alembic_cfg = alembic_config()
+    heads = set(ScriptDirectory.from_config(alembic_cfg).get_heads())
+    with engine.connect() as connection:
+        revisions = set(MigrationContext.configure(connection).get_current_heads())
+        has_tables = bool(set(inspect(connection).get_table_names()) & set(SQLModel.metadata.tables))
+        missing = missing_columns(connection) if has_tables and not revisions else []
+    if missing:
+        raise RuntimeError(f"the database at {engine.url} has no alembic revision and lacks the columns {', '.join(missing)}: "
+                           "stamp the revision it was created at (alembic stamp <revision>) and run alembic upgrade head")
+    if revisions and revisions != heads:
+        migrate_database()
+    create_database()
+    if not revisions:
+        command.stamp(alembic_cfg, "head")
+    create_member_search(engine)
 
 # include API routers
 app.include_router(routers.html.router)
@@ -34,17 +84,36 @@ app.include_router(routers.password_reset.router)
 app.include_router(routers.settings.router)
 
 
+# count sql statements and database time per request
+app.add_middleware(SQLStatsMiddleware)
+
+# request counts, latency and in-flight requests per route for /metrics
+app.add_middleware(MetricsMiddleware)
+
+
 # static files settings
 app.mount('/static', StaticFiles(directory='static'), name='static')
 
 # create database on startup
 @app.on_event("startup")
 def on_startup():
-    create_database()
+    if "DATABASE_PREPARED" not in os.environ:
+        prepare_database()
+    report_sqlite_pragmas()
+    start_log_writer()
+    start_signup_writer()
+    start_password_hasher()
 
 @app.on_event("shutdown")
 def on_shutdown():
-    pass
+    # password hashing first, then the signup writer (its callers still hand logs to the log writer), the log writer last
+    stop_password_hasher()
+    stop_signup_writer()
+    stop_log_writer()
+
+@app.on_event("shutdown")
+async def close_async_engine():
+    await async_engine.dispose()
 
 # run
 if __name__ == '__main__':
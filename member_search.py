@@ -0,0 +1,188 @@
+# --- member_search.py ---
+# sqlite fts5 index over member details for the admin keyword search:
+# one row per UserDetail (rowid = userdetail.id) with names, furigana, tel, address and the children's names.
+# the trigram tokenizer matches any substring of 3+ characters, so "32-12", "養老町" or a child's name find the member.
+
+# modules
+from sqlalchemy import event, text, select, or_
+from sqlalchemy.orm import Session
+from datetime import datetime
+import os
+
+# my modules
+from models.users import UserDetail, UserChild
+from kana import normalize_kana
+
+
+# settings: keep the index in sync on every flush (turn off on a sqlite built without fts5)
+if "MEMBER_SEARCH" in os.environ:
+    MEMBER_SEARCH = os.getenv("MEMBER_SEARCH").lower() in ("1", "true", "yes")
+else:
+    MEMBER_SEARCH = True
+
+MEMBER_SEARCH_COLUMNS = ("user_id", "name", "furigana", "tel", "address", "children")
+
+# bm25 weights in the column order above: a hit on a name counts more than one on the address
+MEMBER_SEARCH_WEIGHTS = (0.0, 10.0, 10.0, 5.0, 1.0, 3.0)
+
+CREATE_MEMBER_SEARCH = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS membersearch "
+    "USING fts5(user_id UNINDEXED, name, furigana, tel, address, children, tokenize = 'trigram')"
+)
+
+INSERT_MEMBER_SEARCH = (
+    f"INSERT INTO membersearch (rowid, {', '.join(MEMBER_SEARCH_COLUMNS)}) "
+    f"VALUES (:rowid, {', '.join(':' + column for column in MEMBER_SEARCH_COLUMNS)})"
+)
+
+
+
+# text stored in the index, normalized like the query (which loses its whitespace): hyphens dropped so "0584321234" finds "0584-32-1234"
+def search_text(*parts) -> str:
+    return " ".join(normalize_kana(part).replace("-", "") for part in parts if part)
+
+
+# last and first name written together, so "山田太郎" and "ヤマダ タロウ" match
+def full_name(last_name: str, first_name: str) -> str:
+    return (last_name or "") + (first_name or "")
+
+
+# one index row; children: [(first_name, last_name, first_name_furigana, last_name_furigana), ...]
+def member_search_row(detail_id: int, user_id: int, last_name: str, first_name: str, last_name_furigana: str, first_name_furigana: str,
+                      tel: str, postal_code: str, address: str, children: list) -> dict:
+    values = (
+        user_id,
+        search_text(full_name(last_name, first_name)),
+        search_text(full_name(last_name_furigana, first_name_furigana)),
+        search_text(tel),
+        search_text(postal_code, address),
+        search_text(*(name for first, last, first_furigana, last_furigana in children
+                      for name in (full_name(last, first), full_name(last_furigana, first_furigana)))),
+    )
+    return {"rowid": detail_id, **dict(zip(MEMBER_SEARCH_COLUMNS, values))}
+
+
+# index rows of userdetail table rows, reading the children of those members
+def member_search_rows(connection, details: list) -> list:
+    user_ids = [detail.user_id for detail in details if detail.user_id is not None]
+    children_of = {}
+    if user_ids:
+        children = connection.execute(select(UserChild.__table__).where(UserChild.user_id.in_(user_ids)).order_by(UserChild.id)).all()
+        for child in children:
+            children_of.setdefault(child.user_id, []).append(
+                (child.child_first_name, child.child_last_name, child.child_first_name_furigana, child.child_last_name_furigana))
+    return [
+        member_search_row(detail.id, detail.user_id, detail.last_name, detail.first_name, detail.last_name_furigana, detail.first_name_furigana,
+                          detail.tel, detail.postal_code, detail.address, children_of.get(detail.user_id, []))
+        for detail in details
+    ]
+
+
+
+# create the table if missing and fill it while it is empty (a new table or one just created by the migration)
+def create_member_search(engine):
+    if not MEMBER_SEARCH or engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as connection:
+        connection.execute(text(CREATE_MEMBER_SEARCH))
+        if connection.execute(text("SELECT 1 FROM membersearch LIMIT 1")).first() is None:
+            rebuild_member_search(connection)
+
+
+# rewrite every row: after imports that bypass the session
+def rebuild_member_search(connection):
+    connection.execute(text("DELETE FROM membersearch"))
+    rows = member_search_rows(connection, connection.execute(select(UserDetail.__table__).order_by(UserDetail.id)).all())
+    if rows:
+        connection.execute(text(INSERT_MEMBER_SEARCH), rows)
+
+
+
+# session hook: members whose details or children changed in this flush get their rows rewritten in the same transaction
+@event.listens_for(Session, "after_flush")
+def sync_member_search(session: Session, flush_context):
+    if not MEMBER_SEARCH:
+        return
+    detail_ids = set()
+    user_ids = set()
+    deleted_detail_ids = set()
+    for instance in session.new | session.dirty | session.deleted:
+        if isinstance(instance, UserDetail):
+            if instance in session.deleted:
+                deleted_detail_ids.add(instance.id)
+            else:
+                detail_ids.add(instance.id)
+        elif isinstance(instance, UserChild) and instance.user_id is not None:
+            user_ids.add(instance.user_id)
+    if not detail_ids and not user_ids and not deleted_detail_ids:
+        return
+    connection = session.connection()
+    if connection.dialect.name != "sqlite":
+        return
+    details = []
+    if detail_ids or user_ids:
+        details = connection.execute(
+            select(UserDetail.__table__).where(or_(UserDetail.id.in_(detail_ids), UserDetail.user_id.in_(user_ids)))
+        ).all()
+    for rowid in deleted_detail_ids | {detail.id for detail in details}:
+        connection.execute(text("DELETE FROM membersearch WHERE rowid = :rowid"), {"rowid": rowid})
+    rows = member_search_rows(connection, details)
+    if rows:
+        connection.execute(text(INSERT_MEMBER_SEARCH), rows)
+
+
+
+# ranked keyword search: the page of best matches with username, lesson count and children in one statement.
+# queries shorter than a trigram cannot use the index and fall back to a scan of the index table.
+def search_members(session: Session, query: str, offset: int, limit: int) -> list:
+    key = search_text(query)
+    if not key:
+        return []
+    if len(key) >= 3:
+        hits = (
+            f"SELECT rowid AS detail_id, bm25(membersearch, {', '.join(str(weight) for weight in MEMBER_SEARCH_WEIGHTS)}) AS score "
+            "FROM membersearch WHERE membersearch MATCH :match ORDER BY score, rowid LIMIT :limit OFFSET :offset"
+        )
+        parameters = {"match": '"' + key.replace('"', '""') + '"'}
+    else:
+        hits = (
+            "SELECT rowid AS detail_id, 0 AS score FROM membersearch "
+            "WHERE name LIKE :pattern ESCAPE '\\' OR furigana LIKE :pattern ESCAPE '\\' OR tel LIKE :pattern ESCAPE '\\' "
+            "OR address LIKE :pattern ESCAPE '\\' OR children LIKE :pattern ESCAPE '\\' "
+            "ORDER BY rowid LIMIT :limit OFFSET :offset"
+        )
+        parameters = {"pattern": "%" + key.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"}
+    rows = session.execute(text(
+        f"WITH hits AS ({hits}) "
+        "SELECT userdetail.*, \"user\".username, "
+        "(SELECT COUNT(*) FROM userlessonlink WHERE userlessonlink.user_id = userdetail.user_id) AS lessons, "
+        "userchild.id AS child_id, userchild.child_first_name, userchild.child_last_name "
+        "FROM hits JOIN userdetail ON userdetail.id = hits.detail_id "
+        "JOIN \"user\" ON \"user\".id = userdetail.user_id "
+        "LEFT JOIN userchild ON userchild.user_id = userdetail.user_id "
+        "ORDER BY hits.score, hits.detail_id, userchild.id"
+    ), {**parameters, "offset": offset, "limit": limit}).mappings().all()
+
+    members = {}
+    for row in rows:
+        member = members.get(row["id"])
+        if member is None:
+            member = {
+                "user_id": row["user_id"],
+                "username": row["username"],
+                "user_children": [],
+                "email": row["email"],
+                "first_name": row["first_name"],
+                "last_name": row["last_name"],
+                "first_name_furigana": row["first_name_furigana"],
+                "last_name_furigana": row["last_name_furigana"],
+                "tel": row["tel"],
+                "postal_code": row["postal_code"],
+                "address": row["address"],
+                "created_time": datetime.fromisoformat(row["created_time"]) if isinstance(row["created_time"], str) else row["created_time"],
+                "lessons": row["lessons"],
+            }
+            members[row["id"]] = member
+        if row["child_id"] is not None:
+            member["user_children"].append({"user_child_id": row["child_id"], "first_name": row["child_first_name"], "last_name": row["child_last_name"]})
+    return list(members.values())
@@ -0,0 +1,168 @@
+# --- metrics.py ---
+
+# modules
+import threading
+import time
+
+# my modules
+from database import engine, async_engine
+from cache import caches
+from logs import log_writer
+from signup_writer import signup_writer
+from passwords import password_hasher
+
+
+# upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+
+# request counters and latency histograms by (method, route template), in-flight gauges by method
+# (the route template is only known once the router has matched the request)
+class RequestMetrics:
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.requests = {} # (method, route, status): count
+        self.histograms = {} # (method, route): [bucket counts..., +Inf count, sum]
+        self.in_flight = {} # method: count
+
+
+    def start(self, method: str):
+        with self.lock:
+            self.in_flight[method] = self.in_flight.get(method, 0) + 1
+
+
+    def finish(self, method: str, key: tuple, status_code: int, seconds: float):
+        with self.lock:
+            self.in_flight[method] -= 1
+            request_key = key + (status_code,)
+            self.requests[request_key] = self.requests.get(request_key, 0) + 1
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = [0] * (len(self.buckets) + 2)
+                self.histograms[key] = histogram
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.requests), {key: list(value) for key, value in self.histograms.items()}, dict(self.in_flight)
+
+
+request_metrics = RequestMetrics()
+
+
+
+# asgi middleware feeding request_metrics: the route template is the one the router put in the scope, as in sqlstats
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        status_code = 500 # unless a response is started
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        request_metrics.start(method)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            route_path = route.path if route is not None else "(unmatched)"
+            request_metrics.finish(method, (method, route_path), status_code, time.perf_counter() - started)
+
+
+
+# text exposition format
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in labels.items()) + "}"
+
+
+def format_metric(lines: list, name: str, kind: str, help_text: str, samples: list):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    for labels, value in samples:
+        lines.append(f"{name}{format_labels(labels)} {value}")
+
+
+def render_metrics() -> str:
+    lines = []
+    requests, histograms, in_flight = request_metrics.snapshot()
+
+    format_metric(lines, "http_requests_total", "counter", "HTTP requests by route template and status code.",
+                  [({"method": method, "route": route, "status": status_code}, count) for (method, route, status_code), count in sorted(requests.items())])
+
+    lines.append("# HELP http_request_duration_seconds HTTP request latency by route template.")
+    lines.append("# TYPE http_request_duration_seconds histogram")
+    for (method, route), histogram in sorted(histograms.items()):
+        labels = {"method": method, "route": route}
+        for bound, count in zip(request_metrics.buckets, histogram):
+            lines.append(f"http_request_duration_seconds_bucket{format_labels({**labels, 'le': bound})} {count}")
+        lines.append(f"http_request_duration_seconds_bucket{format_labels({**labels, 'le': '+Inf'})} {histogram[-2]}")
+        lines.append(f"http_request_duration_seconds_sum{format_labels(labels)} {histogram[-1]}")
+        lines.append(f"http_request_duration_seconds_count{format_labels(labels)} {histogram[-2]}")
+
+    format_metric(lines, "http_requests_in_flight", "gauge", "HTTP requests being handled by method.",
+                  [({"method": method}, count) for method, count in sorted(in_flight.items())])
+
+    # database connection pools (QueuePool for a sqlite file, AsyncAdaptedQueuePool for the async engine)
+    pool_samples = []
+    for engine_name, pool in (("sync", engine.pool), ("async", async_engine.pool)):
+        for state in ("size", "checkedin", "checkedout", "overflow"):
+            if hasattr(pool, state):
+                pool_samples.append(({"engine": engine_name, "state": state}, getattr(pool, state)()))
+    format_metric(lines, "db_pool_connections", "gauge", "Database connection pool state.", pool_samples)
+
+    # background writers
+    log_stats = log_writer.stats()
+    format_metric(lines, "audit_log_queue_depth", "gauge", "Audit log entries waiting to be written.", [({}, log_stats["queue_depth"])])
+    format_metric(lines, "audit_log_queue_max_depth", "gauge", "Highest audit log queue depth since startup.", [({}, log_stats["max_depth"])])
+    format_metric(lines, "audit_log_written_total", "counter", "Audit log entries written.", [({}, log_stats["written"])])
+    format_metric(lines, "audit_log_blocked_total", "counter", "Audit log submissions that waited for a full queue.", [({}, log_stats["blocked"])])
+    format_metric(lines, "audit_log_direct_writes_total", "counter", "Audit log entries written by the request thread because the queue stayed full.", [({}, log_stats["direct_writes"])])
+    format_metric(lines, "audit_log_errors_total", "counter", "Failed audit log write attempts.", [({}, log_stats["errors"])])
+    format_metric(lines, "signup_queue_depth", "gauge", "Signup intents waiting for the writer.", [({}, signup_writer.queue.qsize())])
+    format_metric(lines, "signup_batches_total", "counter", "Signup batches committed.", [({}, signup_writer.batches)])
+    format_metric(lines, "signup_intents_total", "counter", "Signup intents committed.", [({}, signup_writer.intents)])
+    format_metric(lines, "signup_abandoned_total", "counter", "Signup intents dropped unapplied because their caller timed out.", [({}, signup_writer.abandoned)])
+    format_metric(lines, "signup_lock_timeouts_total", "counter", "Signup batches that waited past busy_timeout for the database write lock.", [({}, signup_writer.lock_timeouts)])
+
+    # password hashing pool
+    password_stats = password_hasher.stats()
+    format_metric(lines, "password_hash_workers", "gauge", "Password hashing worker processes.", [({}, password_stats["workers"])])
+    format_metric(lines, "password_hash_pending", "gauge", "Password hashes running or waiting for a worker.", [({}, password_stats["pending"])])
+    format_metric(lines, "password_hash_max_pending", "gauge", "Highest number of pending password hashes since startup.", [({}, password_stats["max_pending"])])
+    format_metric(lines, "password_hash_operations_total", "counter", "Password hashes and verifications.",
+                  [({"operation": operation}, count) for operation, count in sorted(password_stats["operations"].items())])
+    format_metric(lines, "password_hash_seconds_total", "counter", "Time from submitting a password hash to its result.", [({}, password_stats["seconds"])])
+    format_metric(lines, "password_hash_rejected_total", "counter", "Password hashes refused because too many were pending.", [({}, password_stats["rejected"])])
+    format_metric(lines, "password_rehashed_total", "counter", "Password hashes replaced at login after a bcrypt cost change.", [({}, password_stats["rehashed"])])
+
+    # in-process caches
+    cache_stats = [cache.stats() for name, cache in sorted(caches.items())]
+    format_metric(lines, "cache_hits_total", "counter", "Cache hits.", [({"cache": stats["name"]}, stats["hits"]) for stats in cache_stats])
+    format_metric(lines, "cache_misses_total", "counter", "Cache misses.", [({"cache": stats["name"]}, stats["misses"]) for stats in cache_stats])
+    format_metric(lines, "cache_entries", "gauge", "Entries held by the cache.", [({"cache": stats["name"]}, stats["size"]) for stats in cache_stats])
+
+    return "\n".join(lines) + "\n"
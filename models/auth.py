@@ -17,3 +17,11 @@ class TokenData(SQLModel):
     username: Optional[str] = None
 
 
+
+
+# identity of the logged-in user: this is what get_current_user caches and returns
+class CurrentUser(SQLModel):
+    id: int
+    username: str
+    is_active: Optional[bool] = True
+    is_admin: Optional[bool] = False
@@ -3,6 +3,7 @@
 # modules
 from typing import Optional, List, TYPE_CHECKING
 from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy.orm import declared_attr
 
 # my modules
 from models import link_table
@@ -33,10 +34,16 @@ class LessonBase(SQLModel):
 class Lesson(LessonBase, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     capacity_left: Optional[int] = Field(default=None)
+    # optimistic concurrency: every UPDATE checks and bumps it, see versioning.py (capacity_left moves by plain UPDATEs that leave it alone)
+    version: int = Field(default=1, sa_column_kwargs={"server_default": "1"})
     
     users: List["users.User"] = Relationship(back_populates="lessons", link_model=link_table.UserLessonLink)
     user_children: List["users.UserChild"] = Relationship(back_populates="lessons", link_model=link_table.UserChildLessonLink)
 
+    @declared_attr
+    def __mapper_args__(cls):
+        return {"version_id_col": cls.__table__.c.version}
+
 
 
 # create
@@ -49,6 +56,7 @@ class LessonCreate(LessonBase):
 class LessonRead(LessonBase):
     id: int
     capacity_left: Optional[int]
+    version: int
 
 
 
@@ -3,15 +3,34 @@
 # modules
 from typing import Optional, List, TYPE_CHECKING
 from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import Index, select, func
 
 if TYPE_CHECKING:
     import users, lessons, todos
 
+# next signup_seq of the row's lesson, for inserts that do not number the row themselves (relationship appends such as
+# user.lessons.append): without it the row has no position. rows of one executemany share the context and count on
+def next_signup_seq(context) -> int:
+    table = context.current_column.table
+    lesson_id = context.get_current_parameters()["lesson_id"]
+    issued = context.__dict__.setdefault("issued_signup_seqs", {})
+    if lesson_id in issued:
+        issued[lesson_id] += 1
+    else:
+        issued[lesson_id] = context.connection.execute(
+            select(func.coalesce(func.max(table.c.signup_seq), 0) + 1).where(table.c.lesson_id == lesson_id)
+        ).scalar()
+    return issued[lesson_id]
+
+
+
 # models below
 
 class UserLessonLink(SQLModel, table=True):
+    __table_args__ = (Index("ix_userlessonlink_lesson_id_signup_seq", "lesson_id", "signup_seq"),)
     user_id: Optional[int] = Field(default=None, foreign_key="user.id", primary_key=True)
     lesson_id: Optional[int] = Field(default=None, foreign_key="lesson.id", primary_key=True)
+    signup_seq: Optional[int] = Field(default=None, sa_column_kwargs={"default": next_signup_seq}) # signup order within the lesson: 1, 2, 3, ...
 
 
 
@@ -32,6 +51,8 @@ class UserUserChildLink(SQLModel, table=True):
 
 
 class UserChildLessonLink(SQLModel, table=True):
+    __table_args__ = (Index("ix_userchildlessonlink_lesson_id_signup_seq", "lesson_id", "signup_seq"),)
     user_child_id: Optional[int] = Field(default=None, foreign_key="userchild.id", primary_key=True)
     lesson_id: Optional[int] = Field(default=None, foreign_key="lesson.id", primary_key=True)
+    signup_seq: Optional[int] = Field(default=None, sa_column_kwargs={"default": next_signup_seq}) # signup order within the lesson: 1, 2, 3, ...
 
@@ -0,0 +1,28 @@
+# --- models/logs.py ---
+
+# modules
+from typing import Optional
+from sqlmodel import SQLModel, Field
+from sqlalchemy import Index
+
+# models below
+
+
+# signup/cancel audit trail: one row per add_log() call, the JSON Lines files stay as the archive
+class AuditLogBase(SQLModel):
+    timestamp: str = Field(index=True) # ISO 8601 in JST, same string as in the log files
+    action: str = Field(index=True)
+    lesson_number: int = Field(index=True)
+    lesson_title: str
+    user_name: str = Field(index=True)
+    user_tel: str
+    user_address: str
+
+
+class AuditLog(AuditLogBase, table=True):
+    __table_args__ = (Index("ix_auditlog_lesson_number_timestamp", "lesson_number", "timestamp"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+
+
+class AuditLogRead(AuditLogBase):
+    id: int
@@ -3,11 +3,14 @@
 # modules
 from typing import Optional, List, TYPE_CHECKING
 from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import Index, event
+from sqlalchemy.orm import declared_attr
 # from pydantic import EmailStr
 from datetime import datetime, timedelta
 
 # my modules
 from models import link_table
+from kana import normalize_kana
 
 if TYPE_CHECKING:
     import lessons, todos
@@ -92,10 +95,28 @@ class UserDetailBase(SQLModel):
 
 
 class UserDetail(UserDetailBase, table=True):
+    __table_args__ = (Index("ix_userdetail_last_name_search_first_name_search", "last_name_search", "first_name_search"),)
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: Optional[int] = Field(default=None, foreign_key="user.id")
     user: Optional["User"] = Relationship(back_populates="user_details", link_model=link_table.UserUserDetailLink)
     created_time: datetime = Field(default_factory=lambda: datetime.utcnow() + timedelta(hours=9))
+    # normalized furigana for the admin search: kept in sync by set_user_detail_search_keys below
+    last_name_search: Optional[str] = Field(default=None)
+    first_name_search: Optional[str] = Field(default=None, index=True)
+    # optimistic concurrency: every UPDATE checks and bumps it, see versioning.py
+    version: int = Field(default=1, sa_column_kwargs={"server_default": "1"})
+
+    @declared_attr
+    def __mapper_args__(cls):
+        return {"version_id_col": cls.__table__.c.version}
+
+
+# fill the search keys whenever user details are inserted or updated through the session
+@event.listens_for(UserDetail, "before_insert")
+@event.listens_for(UserDetail, "before_update")
+def set_user_detail_search_keys(mapper, connection, user_details: UserDetail):
+    user_details.last_name_search = normalize_kana(user_details.last_name_furigana)
+    user_details.first_name_search = normalize_kana(user_details.first_name_furigana)
 
 
 
@@ -121,6 +142,7 @@ class UserDetailRead(UserDetailBase):
 
 class UserDetailUsernameRead(UserDetailBase):
     username: str
+    version: int
 
 
 class UserWithUserDetailRead(UserRead, UserDetailRead):
@@ -140,7 +162,7 @@ class UserChildBase(SQLModel):
 
 class UserChild(UserChildBase, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: Optional[int] = Field(default=None, foreign_key="user.id")
+    user_id: Optional[int] = Field(default=None, foreign_key="user.id", index=True)
     user: Optional["User"] = Relationship(back_populates="user_children", link_model=link_table.UserUserChildLink)
     lessons: List["lessons.Lesson"] = Relationship(back_populates="user_children", link_model=link_table.UserChildLessonLink)
 
@@ -0,0 +1,174 @@
+# --- passwords.py ---
+# bcrypt runs in a small process pool: a hash takes tens of milliseconds of cpu, and inline in a handler it holds the GIL
+# and a threadpool thread, so a login storm slows every other endpoint. the pool bounds how many hashes run at once
+# (one per worker process) and how many may wait; beyond that callers get 503 instead of piling up.
+
+# modules
+from fastapi import HTTPException, status
+from starlette.concurrency import run_in_threadpool
+from concurrent.futures import ProcessPoolExecutor
+from passlib.context import CryptContext
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+
+
+# settings: bcrypt cost, worker processes (0: hash in the calling thread) and how many hashes may wait for a worker
+if "BCRYPT_ROUNDS" in os.environ:
+    BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS"))
+else:
+    BCRYPT_ROUNDS = 12
+
+if "PASSWORD_WORKERS" in os.environ:
+    PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS"))
+else:
+    PASSWORD_WORKERS = min(4, os.cpu_count() or 1)
+
+if "PASSWORD_QUEUE_SIZE" in os.environ:
+    PASSWORD_QUEUE_SIZE = int(os.getenv("PASSWORD_QUEUE_SIZE"))
+else:
+    PASSWORD_QUEUE_SIZE = 256
+
+
+
+# hash scheme: hashes made with another cost are "deprecated" and get replaced on the next login
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+# bcrypt only reads the first 72 bytes
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password.encode("utf-8")[:72])
+
+
+# (valid, new hash or None): the new hash is made with the current cost when the stored one uses another
+def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple:
+    return pwd_context.verify_and_update(plain_password.encode("utf-8")[:72], hashed_password)
+
+
+
+class PasswordQueueFull(Exception):
+    pass
+
+
+
+# process pool with a bound on waiting work and counters for /metrics
+class PasswordHasher:
+    def __init__(self, workers: int = PASSWORD_WORKERS, queue_size: int = PASSWORD_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.executor = None
+        self.lock = threading.Lock()
+        self.pending = 0 # submitted and not finished: running + waiting
+        self.max_pending = 0
+        self.operations = {"hash": 0, "verify": 0}
+        self.rehashed = 0
+        self.rejected = 0
+        self.seconds = 0.0 # submit to result, including the wait for a worker
+
+
+    def start(self):
+        with self.lock:
+            if self.executor is None and self.workers > 0:
+                # spawn: the app already runs threads (log and signup writers) that a fork would copy mid-operation
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+    def stop(self):
+        with self.lock:
+            executor = self.executor
+            self.executor = None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+    # count the call in, or refuse it when too many are waiting
+    def enter(self, operation: str):
+        with self.lock:
+            if self.pending >= self.workers + self.queue_size:
+                self.rejected += 1
+                raise PasswordQueueFull()
+            self.pending += 1
+            self.max_pending = max(self.max_pending, self.pending)
+            self.operations[operation] += 1
+
+
+    def leave(self, started: float):
+        with self.lock:
+            self.pending -= 1
+            self.seconds += time.perf_counter() - started
+
+
+    # blocking call for sync handlers: the thread waits on the future without holding the GIL
+    def run(self, operation: str, function, *args):
+        self.enter(operation)
+        started = time.perf_counter()
+        try:
+            executor = self.executor
+            if executor is None:
+                return function(*args)
+            return executor.submit(function, *args).result()
+        finally:
+            self.leave(started)
+
+
+    # awaitable call for async handlers: no threadpool thread is held while the hash runs
+    async def run_async(self, operation: str, function, *args):
+        self.enter(operation)
+        started = time.perf_counter()
+        try:
+            executor = self.executor
+            if executor is None:
+                return await run_in_threadpool(function, *args)
+            return await asyncio.wrap_future(executor.submit(function, *args))
+        finally:
+            self.leave(started)
+
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "pending": self.pending,
+                "max_pending": self.max_pending,
+                "operations": dict(self.operations),
+                "rehashed": self.rehashed,
+                "rejected": self.rejected,
+                "seconds": self.seconds,
+            }
+
+
+password_hasher = PasswordHasher()
+
+
+def start_password_hasher():
+    password_hasher.start()
+
+
+def stop_password_hasher():
+    password_hasher.stop()
+
+
+
+def busy_exception() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Password hashing is busy, please retry", headers={"Retry-After": "1"})
+
+
+def get_hashed_password(password: str) -> str:
+    try:
+        return password_hasher.run("hash", hash_password, password)
+    except PasswordQueueFull:
+        raise busy_exception()
+
+
+# (valid, new hash or None) like verify_and_update_password
+async def verify_password_async(plain_password: str, hashed_password: str) -> tuple:
+    try:
+        valid, new_hash = await password_hasher.run_async("verify", verify_and_update_password, plain_password, hashed_password)
+    except PasswordQueueFull:
+        raise busy_exception()
+    if new_hash is not None:
+        with password_hasher.lock:
+            password_hasher.rehashed += 1
+    return valid, new_hash
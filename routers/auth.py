@@ -6,25 +6,29 @@ from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlmodel import SQLModel, Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import Optional, Annotated, Union
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
-from passlib.context import CryptContext
+from starlette.concurrency import run_in_threadpool
+import hashlib
 import os
+import time
 
 # my modules
-from database import engine, get_session
-from models.auth import Token, TokenData
+from database import engine, async_engine, get_session
+from models.auth import Token, TokenData, CurrentUser
 from models.users import User, UserCreate, UserRead, UserUpdate, UserDelete, UserInDB, UserUsername
+from cache import TTLCache
+from passwords import verify_password_async, get_hashed_password # get_hashed_password is imported from here by the users and password reset routers
 
 # instance of API router and templates
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
 
 
-# auth scheme and hash scheme
+# auth scheme (the hash scheme and its process pool are in passwords.py)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 env_my_secret_key = "MY_SECRET_KEY"
 if env_my_secret_key in os.environ:
@@ -36,19 +40,33 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7 * 30 * 12
 
 
+# cache of resolved user identities by username: patch_user, delete_user and reset_password invalidate it
+if "USER_CACHE_TTL" in os.environ:
+    USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL"))
+else:
+    USER_CACHE_TTL = 60.0
+
+if "USER_CACHE_SIZE" in os.environ:
+    USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE"))
+else:
+    USER_CACHE_SIZE = 2048
 
+user_cache = TTLCache("current_user", maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
 
-# verify password with hashed password
-def verify_password(plain_password, hashed_password):
-    plain_password = plain_password.encode("utf-8")[:72]
-    return pwd_context.verify(plain_password, hashed_password)
 
+# cache of verified access tokens by sha256 digest: a hit skips the signature check; entries never outlive the token's exp
+if "TOKEN_CACHE_TTL" in os.environ:
+    TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL"))
+else:
+    TOKEN_CACHE_TTL = 600.0
+
+if "TOKEN_CACHE_SIZE" in os.environ:
+    TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE"))
+else:
+    TOKEN_CACHE_SIZE = 4096
 
+token_cache = TTLCache("access_token", maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
 
-# make hashed password
-def get_hashed_password(password):
-    password = password.encode("utf-8")[:72]
-    return pwd_context.hash(password)
 
 
 
@@ -62,19 +80,58 @@ def get_hashed_password(password):
 # get user by username
 def get_user(username: str):
     with Session(engine) as session:
-        user = session.exec(select(User).where(User.username == username)).one()
+        user = session.exec(select(User).where(User.username == username)).first()
     return user
 
 
 
-# verify username and password
-def authenticate_user(username: str, password: str):
-    user = get_user(username)
-    if not user:
-        return False
-    if not verify_password(password, user.hashed_password):
-        return False
-    return user
+# store a password hash made with the current bcrypt cost
+def update_hashed_password(user_id: int, hashed_password: str):
+    with Session(engine) as session:
+        user = session.get(User, user_id)
+        if user is not None:
+            user.hashed_password = hashed_password
+            session.add(user)
+            session.commit()
+
+
+
+# get the identity of a user by username: cached, so most requests do not open a session at all
+def get_user_identity(username: str):
+    identity = user_cache.get(username)
+    if identity is None:
+        with Session(engine) as session:
+            row = session.exec(user_identity_query(username)).first()
+        identity = cache_user_identity(username, row)
+    return identity
+
+
+# the same for async handlers
+async def get_user_identity_async(username: str):
+    identity = user_cache.get(username)
+    if identity is None:
+        async with AsyncSession(async_engine) as session:
+            row = (await session.exec(user_identity_query(username))).first()
+        identity = cache_user_identity(username, row)
+    return identity
+
+
+def user_identity_query(username: str):
+    return select(User.id, User.username, User.is_active, User.is_admin).where(User.username == username)
+
+
+def cache_user_identity(username: str, row):
+    if row is None:
+        return None
+    identity = CurrentUser(id=row.id, username=row.username, is_active=row.is_active, is_admin=row.is_admin)
+    user_cache.set(username, identity)
+    return identity
+
+
+
+# forget a cached identity after the user was changed or deleted
+def invalidate_cached_user(username: str):
+    user_cache.invalidate(username)
 
 
 
@@ -91,30 +148,68 @@ def create_access_token(data: dict, expires_delta: Union[timedelta, None] = None
 
 
 
+# verified claims of an access token, or None when it is invalid or expired
+def decode_access_token(token: str):
+    digest = hashlib.sha256(token.encode()).hexdigest()
+    token_data = token_cache.get(digest)
+    if token_data is not None:
+        return token_data
+    try:
+        payload = jwt.decode(token, MY_SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    username: str = payload.get("sub")
+    if username is None:
+        return None
+    token_data = TokenData(username=username)
+    ttl = TOKEN_CACHE_TTL
+    if payload.get("exp") is not None:
+        ttl = min(ttl, payload["exp"] - time.time())
+    if ttl > 0:
+        token_cache.set(digest, token_data, ttl=ttl)
+    return token_data
+
+
+
 # get user from access token
 def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
-    credentials_exception = HTTPException(
+    token_data = decode_access_token(token)
+    if token_data is None:
+        raise credentials_exception()
+    user = get_user_identity(username=token_data.username)
+    if user is None:
+        raise credentials_exception()
+    return user
+
+
+# the same for async handlers: a sync dependency would still take a threadpool thread
+async def get_current_user_async(token: Annotated[str, Depends(oauth2_scheme)]):
+    token_data = decode_access_token(token)
+    if token_data is None:
+        raise credentials_exception()
+    user = await get_user_identity_async(username=token_data.username)
+    if user is None:
+        raise credentials_exception()
+    return user
+
+
+def credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, MY_SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
-    user = get_user(username=token_data.username)
-    if user is None:
-        raise credentials_exception
-    return user
 
 
 
 # eliminate inactive user
-def get_current_active_user(current_user: Annotated[User, Depends(get_current_user)]):
+def get_current_active_user(current_user: Annotated[CurrentUser, Depends(get_current_user)]):
+    if not current_user.is_active:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    return current_user
+
+
+async def get_current_active_user_async(current_user: Annotated[CurrentUser, Depends(get_current_user_async)]):
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
@@ -122,10 +217,17 @@ def get_current_active_user(current_user: Annotated[User, Depends(get_current_us
 
 
 # login to get access token by sending username and password as a form data
+# async: bcrypt runs in the password process pool and the lookups in the threadpool, so a login storm holds no threads while hashing
 @router.post("/token", response_model=Token)
-def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]):
-    user = authenticate_user(form_data.username, form_data.password)
-    if not user:
+async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]):
+    user = await run_in_threadpool(get_user, form_data.username)
+    valid = False
+    if user:
+        valid, new_hash = await verify_password_async(form_data.password, user.hashed_password)
+        # the stored hash uses another bcrypt cost than BCRYPT_ROUNDS: replace it while the plain password is at hand
+        if valid and new_hash is not None:
+            await run_in_threadpool(update_hashed_password, user.id, new_hash)
+    if not valid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password", headers={"WWW-Authenticate": "Bearer"})
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(data={"sub": user.username}, expires_delta=access_token_expires)
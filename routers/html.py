@@ -2,7 +2,7 @@
 
 # modules
 from fastapi import APIRouter, Request, Header, Body, HTTPException, Depends, Query, Form, status
-from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from sqlmodel import SQLModel, Session, select
 from typing import Optional, Annotated
@@ -16,7 +16,12 @@ from models.items import Item, ItemCreate, ItemRead, ItemUpdate, ItemDelete
 from models.users import User, UserCreate, UserRead, UserUpdate, UserDelete
 from models.todos import Todo, TodoCreate, TodoRead, TodoUpdate, TodoDelete
 from routers.auth import get_current_active_user
-from database import make_backup_db
+from database import make_backup_db, get_backup_job
+from models.logs import AuditLog, AuditLogRead
+from logs import JST
+from sqlstats import sql_stats_report
+from metrics import render_metrics
+import os
 
 # instance of API router and templates
 router = APIRouter()
@@ -97,11 +102,40 @@ def warmup():
 
 
 
+# metrics in prometheus text format: set METRICS_KEY to require ?key=, without it only a scraper on this host can read them
+if "METRICS_KEY" in os.environ:
+    METRICS_KEY = os.getenv("METRICS_KEY")
+else:
+    METRICS_KEY = None
+
+LOCAL_HOSTS = ("127.0.0.1", "::1", "localhost")
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def read_metrics(request: Request, key: str = None):
+    if METRICS_KEY is None:
+        if request.client is None or request.client.host not in LOCAL_HOSTS:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="not authorized")
+    elif key != METRICS_KEY:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="not authorized")
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+
 # backup database.sqlite
 @router.get("/backupdatabase")
 def backup_database():
-    make_backup_db()
-    return {"backup database.sqlite to yoro-sc.sqlite": "ok"}
+    # the backup runs in the background: poll /backupdatabase/{job_id} for its status
+    job_id = make_backup_db()
+    return {"backup database.sqlite to yoro-sc.sqlite": "started", "job_id": job_id}
+
+
+@router.get("/backupdatabase/{job_id}")
+def read_backup_job(job_id: str):
+    job = get_backup_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Backup job not found")
+    return {"job_id": job_id, **job}
 
 
 
@@ -120,19 +154,74 @@ async def robots_txt():
     )
 
 
-FILE_PATH = Path("logs.json")
+# audit log page size
+LOG_PAGE_SIZE = 100
+LOG_PAGE_MAX = 1000
+
+
+# naive datetimes from the query string are JST, like the timestamps in the log
+def to_log_timestamp(value: datetime) -> str:
+    if value.tzinfo is None:
+        return value.replace(tzinfo=JST).isoformat()
+    return value.astimezone(JST).isoformat()
+
+
+# write the page row by row: {"logs": [...], "next_cursor": id or null}
+def stream_logs(query, limit: int):
+    with Session(engine) as session:
+        yield '{"logs": ['
+        count = 0
+        last_id = None
+        for log in session.exec(query.execution_options(yield_per=200)):
+            if count > 0:
+                yield ","
+            yield json.dumps(AuditLogRead.model_validate(log).model_dump(), ensure_ascii=False)
+            count += 1
+            last_id = log.id
+        next_cursor = last_id if count == limit else None
+        yield '], "next_cursor": ' + json.dumps(next_cursor) + "}"
+
 
 @router.get("/json/admin/logs")
-def get_logs_json(current_user: Annotated[Session, Depends(get_current_active_user)]):
+def get_logs_json(
+    current_user: Annotated[Session, Depends(get_current_active_user)],
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    lesson_number: Optional[int] = None,
+    action: Optional[str] = None,
+    name: Optional[str] = None,
+    cursor: Optional[int] = None,
+    limit: int = Query(default=LOG_PAGE_SIZE, ge=1, le=LOG_PAGE_MAX),
+):
+    if not current_user.is_admin:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="not authorized")
+    """新しい順にログを返す。続きはnext_cursorをcursorに渡して取得する"""
+    query = select(AuditLog).order_by(AuditLog.id.desc()).limit(limit)
+    if cursor is not None:
+        query = query.where(AuditLog.id < cursor)
+    if since is not None:
+        query = query.where(AuditLog.timestamp >= to_log_timestamp(since))
+    if until is not None:
+        query = query.where(AuditLog.timestamp < to_log_timestamp(until))
+    if lesson_number is not None:
+        query = query.where(AuditLog.lesson_number == lesson_number)
+    if action:
+        query = query.where(AuditLog.action == action)
+    if name:
+        # 前方一致を範囲検索で書く（LIKEと違ってuser_nameのインデックスが使える）
+        query = query.where(AuditLog.user_name >= name, AuditLog.user_name < name + "\U0010ffff")
+    return StreamingResponse(stream_logs(query, limit), media_type="application/json")
+
+
+# admin: sql statements and database time per route since startup (or the last reset)
+@router.get("/json/admin/sqlstats")
+def get_sql_stats_json(current_user: Annotated[Session, Depends(get_current_active_user)], reset: bool = False):
     if not current_user.is_admin:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="not authorized")
-    """JSONファイルのログをすべて返す"""
-    if FILE_PATH.exists():
-        with open(FILE_PATH, "r", encoding="utf-8") as f:
-            logs = json.load(f)
-    else:
-        logs = []
-    return JSONResponse(content=logs)
+    report = sql_stats_report.report()
+    if reset:
+        sql_stats_report.reset()
+    return report
 
 
 @router.get("/admin/logs", response_class=HTMLResponse, tags=["html"])
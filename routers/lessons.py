@@ -2,20 +2,30 @@
 
 # modules
 from fastapi import APIRouter, Request, Header, Body, HTTPException, Depends, Query, Form, status
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 from fastapi.templating import Jinja2Templates
 from sqlmodel import SQLModel, Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import select as sa_select, update, func, case
+from pydantic import TypeAdapter
 from typing import Optional, Annotated
 from datetime import datetime, timedelta, timezone
+import hashlib
+import json
 import os
 
 # my modules
-from database import engine, get_session
+from database import engine, get_session, get_async_session
 from models.lessons import Lesson, LessonCreate, LessonRead, LessonUpdate, LessonDelete
-from models.users import User, UserCreate, UserRead, UserUpdate, UserDelete, UserChild, UserChildRead
-from routers.auth import get_current_active_user
+from models.users import User, UserCreate, UserRead, UserUpdate, UserDelete, UserChild, UserChildRead, UserDetail
+from models.link_table import UserLessonLink, UserChildLessonLink, UserUserDetailLink
+from routers.auth import get_current_active_user, get_current_active_user_async
 from models.settings import Period
+from routers.settings import period_cache, CURRENT_PERIOD_KEY, cache_current_period
 from logs import add_log
+from signup_writer import submit_signup, read_signup_positions, read_signup_positions_async
+from cache import TTLCache, catalog_version, bump_catalog_version
+from versioning import check_if_match, commit_versioned, set_version_etag
 
 # instance of API router and templates
 router = APIRouter()
@@ -48,6 +58,17 @@ else:
     PUBLIC_API_KEY = "fake_key"
 
 
+# lesson catalog cache: keyed by catalog version, the ttl bounds staleness across worker processes
+if "CATALOG_CACHE_TTL" in os.environ:
+    CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL"))
+else:
+    CATALOG_CACHE_TTL = 2.0
+
+catalog_cache = TTLCache("lesson_catalog", maxsize=8, ttl=CATALOG_CACHE_TTL)
+lesson_list_adapter = TypeAdapter(list[LessonRead])
+child_list_adapter = TypeAdapter(list[UserChildRead])
+
+
 # create a lesson: this is not used now
 @router.post("/lessons", response_model=LessonRead, tags=["Lesson"])
 def create_lesson(session: Annotated[Session, Depends(get_session)], lesson_create: LessonCreate):
@@ -55,6 +76,7 @@ def create_lesson(session: Annotated[Session, Depends(get_session)], lesson_crea
     session.add(db_lesson)
     session.commit()
     session.refresh(db_lesson)
+    bump_catalog_version()
     return db_lesson
 
 
@@ -98,24 +120,64 @@ def get_lessons_html(request: Request):
 
 
 
-# get current lesson period infomation
+# get current lesson period infomation: served from the process cache, refreshed by upsert_period
 def get_current_period(session: Session):
-    db_period = session.exec(select(Period)).first()
-    if not db_period:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Period not found in the database")
+    db_period = period_cache.get(CURRENT_PERIOD_KEY)
+    if db_period is None:
+        db_period = session.exec(select(Period)).first()
+        if not db_period:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Period not found in the database")
+        db_period = cache_current_period(db_period)
     return db_period
 
 
+# the same for async handlers
+async def get_current_period_async(session: AsyncSession):
+    db_period = period_cache.get(CURRENT_PERIOD_KEY)
+    if db_period is None:
+        db_period = (await session.exec(select(Period))).first()
+        if not db_period:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Period not found in the database")
+        db_period = cache_current_period(db_period)
+    return db_period
+
+
+
+# pre-serialized lesson catalog per catalog version: {(version, year, season): (etag, body)}
+async def get_lesson_catalog(session: AsyncSession, current_period: Period) -> tuple[str, bytes]:
+    key = (catalog_version.value, current_period.year, current_period.season)
+    catalog = catalog_cache.get(key)
+    if catalog is None:
+        lessons = (await session.exec(select(Lesson).where(Lesson.year == current_period.year, Lesson.season == current_period.season))).all()
+        body = lesson_list_adapter.dump_json([LessonRead.model_validate(lesson) for lesson in lessons])
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        catalog = (etag, body)
+        catalog_cache.set(key, catalog)
+    return catalog
+
 
-# json: get lesson list
+
+# true when one of the If-None-Match entity tags matches the current one
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+
+# json: get lesson list (async: the polling before the opening does not take threadpool threads)
 @router.get("/json/lessons", response_model=list[LessonRead], tags=["Lesson"])
-def read_lesson_list_json(session: Annotated[Session, Depends(get_session)]):
-    current_period = get_current_period(session)
+async def read_lesson_list_json(session: Annotated[AsyncSession, Depends(get_async_session)], if_none_match: Annotated[Optional[str], Header()] = None):
+    current_period = await get_current_period_async(session)
     current_time = datetime.utcnow()
     if current_time < current_period.start_time:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Lesson signup is not allowed yet")
-    lessons = session.exec(select(Lesson).where(Lesson.year == current_period.year, Lesson.season == current_period.season)).all()
-    return lessons
+    etag, body = await get_lesson_catalog(session, current_period)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 
@@ -127,8 +189,7 @@ def read_lesson_list_json_admin(session: Annotated[Session, Depends(get_session)
     current_period = get_current_period(session)
     # if current_time < current_period.start_time:
     #     raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="it is before test start time")
-    user = session.exec(select(User).where(User.username == current_user.username)).one()
-    if not user.is_admin:
+    if not current_user.is_admin:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="not authorized")
     lessons = session.exec(select(Lesson).where(Lesson.year == current_period.year, Lesson.season == current_period.season)).all()
     return lessons
@@ -138,23 +199,25 @@ def read_lesson_list_json_admin(session: Annotated[Session, Depends(get_session)
 
 # get: read a lesson
 @router.get("/lessons/{lesson_id}", response_model=LessonRead, tags=["Lesson"])
-def read_lesson(session: Annotated[Session, Depends(get_session)], lesson_id: int):
+def read_lesson(session: Annotated[Session, Depends(get_session)], lesson_id: int, response: Response):
     lesson = session.get(Lesson, lesson_id)
     if lesson is None:
         raise HTTPException(status_code=404, detail="Not found")
+    set_version_etag(response, lesson.version)
     return lesson
 
 
 
-# patch: update lesson information
+# patch: update lesson information (If-Match: the ETag of the version the edit was made from, 409 when it is stale)
 @router.patch("/lessons/{lesson_id}", response_model=LessonRead, tags=["Lesson"])
-def update_lesson(session: Annotated[Session, Depends(get_session)], lesson_id: int, lesson_update: LessonUpdate, current_user: Annotated[User, Depends(get_current_active_user)]):
-    user = session.exec(select(User).where(User.username == current_user.username)).one()
-    if not user.is_admin:
+def update_lesson(session: Annotated[Session, Depends(get_session)], lesson_id: int, lesson_update: LessonUpdate, current_user: Annotated[User, Depends(get_current_active_user)],
+                  response: Response, if_match: Annotated[Optional[str], Header()] = None):
+    if not current_user.is_admin:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authorized")
     db_lesson = session.get(Lesson, lesson_id)
     if not db_lesson:
         raise HTTPException(status_code=404, detail="Not found")
+    check_if_match(if_match, db_lesson.version)
     
     lesson_update_dict = lesson_update.model_dump(exclude_unset=True)
     
@@ -162,8 +225,10 @@ def update_lesson(session: Annotated[Session, Depends(get_session)], lesson_id:
         setattr(db_lesson, key, value)
         
     session.add(db_lesson)
-    session.commit()
+    commit_versioned(session, db_lesson)
     session.refresh(db_lesson)
+    bump_catalog_version()
+    set_version_etag(response, db_lesson.version)
     return db_lesson
 
 
@@ -178,6 +243,7 @@ def delete_lesson(session: Annotated[Session, Depends(get_session)], lesson_id:
         raise HTTPException(status_code=404, detail="Not found")
     session.delete(lesson)
     session.commit()
+    bump_catalog_version()
     return {"deleted": lesson}
 
 
@@ -185,21 +251,23 @@ def delete_lesson(session: Annotated[Session, Depends(get_session)], lesson_id:
 
 # get: read my lessons
 @router.get("/json/my/lessons", response_model=list[LessonRead], tags=["Lesson"])
-def read_my_lessons(session: Annotated[Session, Depends(get_session)], current_user: Annotated[UserRead, Depends(get_current_active_user)]):
-    user = session.exec(select(User).where(User.username == current_user.username)).one()
-    if user is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="user not found")
-    my_lessons = user.lessons
+async def read_my_lessons(session: Annotated[AsyncSession, Depends(get_async_session)], current_user: Annotated[UserRead, Depends(get_current_active_user_async)]):
+    my_lessons = (await session.exec(my_lessons_query(current_user.id))).all()
     return my_lessons
 
 
+# lessons of a user (explicit join: async sessions cannot lazy load user.lessons)
+def my_lessons_query(user_id: int):
+    return select(Lesson).join(UserLessonLink, UserLessonLink.lesson_id == Lesson.id).where(UserLessonLink.user_id == user_id).order_by(UserLessonLink.lesson_id)
+
+
 
 # post: sign up to a lessons
 @router.post("/lessons/{id}", response_model=list[LessonRead], tags=["Lesson"])
 def create_my_lessons(session: Annotated[Session, Depends(get_session)], current_user: Annotated[UserRead, Depends(get_current_active_user)], id: int):
     current_time = datetime.utcnow()
     current_period = get_current_period(session)
-    user = session.exec(select(User).where(User.username == current_user.username)).one()
+    user = session.get(User, current_user.id)
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authorized")
     if current_time < current_period.start_time and not user.is_admin:
@@ -207,30 +275,14 @@ def create_my_lessons(session: Annotated[Session, Depends(get_session)], current
     new_lesson = session.exec(select(Lesson).where(Lesson.id == id)).one()
     if new_lesson.year != current_period.year or new_lesson.season != current_period.season:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed")
-    if not new_lesson in user.lessons:
-        user.lessons.append(new_lesson)
-        session.add(user)
-        session.commit()
-        session.refresh(user)
-    if new_lesson.number == 1: # subject to change: lessons for children
-        user_children = session.exec(select(UserChild).where(UserChild.user_id == user.id)).all()
-        for child in user_children:
-            if not new_lesson in child.lessons:
-                child.lessons.append(new_lesson)
-        new_lesson.capacity_left = new_lesson.capacity - len(new_lesson.user_children)
-        session.add(new_lesson)
-        session.commit()
-        session.refresh(new_lesson)
-    else:
-        new_lesson.capacity_left = new_lesson.capacity - len(new_lesson.users)
-        session.add(new_lesson)
-        session.commit()
-        session.refresh(new_lesson)
-    my_lessons = user.lessons
+    log_user = read_log_user(user)
+    release_session(session)
+    # the signup writer applies the enrollment together with other requests in one transaction
+    submit_signup("apply", user.id, new_lesson.id)
+    my_lessons = session.exec(my_lessons_query(user.id)).all()
+    release_session(session)
     add_log(
-        user_name=user.user_details.last_name + "　" + user.user_details.first_name,
-        user_tel=user.user_details.tel,
-        user_address=user.user_details.address,
+        **log_user,
         lesson_number=new_lesson.number,
         lesson_title=new_lesson.title,
         action="apply"
@@ -239,6 +291,25 @@ def create_my_lessons(session: Annotated[Session, Depends(get_session)], current
 
 
 
+# name, tel and address of a user for the audit log
+def read_log_user(user: User) -> dict:
+    user_details = user.user_details
+    return {
+        "user_name": user_details.last_name + "　" + user_details.first_name,
+        "user_tel": user_details.tel,
+        "user_address": user_details.address,
+    }
+
+
+# give the request's pooled connection back before waiting for the signup writer: during the rush the waiting handlers
+# would otherwise hold the whole pool and the writer could not get a connection for its batch.
+# the same after the last query: serializing the response waits for a threadpool thread, which the rush may have taken.
+# loaded attributes stay readable; the session opens a new connection if it is used again
+def release_session(session: Session):
+    session.close()
+
+
+
 
 class ChildrenIdsRequest(SQLModel):
     children_ids: list[int]
@@ -268,30 +339,20 @@ def create_my_lessons_for_children(
             raise HTTPException(status_code=404, detail="user child not found")
         if user_child.user_id != current_user.id:
             raise HTTPException(status_code=403, detail="invalid child id")
-        
-        if not lesson in user_child.lessons:
-            user_child.lessons.append(lesson)
     
-    # current_user.lessons.append(lesson)
-    user = session.exec(select(User).where(User.username == current_user.username)).one()
-    user.lessons.append(lesson)
-
-    lesson.capacity_left = lesson.capacity - len(lesson.user_children)
-    
-    session.add(lesson)
-    session.commit()
-    session.refresh(lesson)
+    user = session.get(User, current_user.id)
+    log_user = read_log_user(user)
+    release_session(session)
+    signup_result = submit_signup("apply", user.id, lesson.id, children_ids_request.children_ids)
     
     add_log(
-        user_name=user.user_details.last_name + "　" + user.user_details.first_name,
-        user_tel=user.user_details.tel,
-        user_address=user.user_details.address,
+        **log_user,
         lesson_number=lesson.number,
         lesson_title=lesson.title,
         action="apply"
     )
 
-    return {"success": "children signed up to the lesson"}
+    return {"success": "children signed up to the lesson", "status": signup_result["status"], "position": signup_result["position"]}
 
 
 
@@ -327,48 +388,21 @@ def delete_my_lesson(session: Annotated[Session, Depends(get_session)], current_
     current_period = get_current_period(session)
     if cancel_lesson.year != current_period.year or cancel_lesson.season != current_period.season:
         raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail="Outdated")
-    user = session.exec(select(User).where(User.username == current_user.username)).one()
+    user = session.get(User, current_user.id)
     if user is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    if not user in cancel_lesson.users:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not signed up")
-    if cancel_lesson in user.lessons:
-        user.lessons.remove(cancel_lesson)
-        session.add(user)
-        session.commit()
-        session.refresh(user)
-    if cancel_lesson.number == 1: # subject to change: lessons for children
-        user_children = session.exec(select(UserChild).where(UserChild.user_id == user.id)).all()
-        for child in user_children:
-            if cancel_lesson in child.lessons:
-                child.lessons.remove(cancel_lesson)
-        cancel_lesson.capacity_left = cancel_lesson.capacity - len(cancel_lesson.user_children)
-        session.add(cancel_lesson)
-        session.commit()
-        session.refresh(cancel_lesson)
-        add_log(
-            user_name=user.user_details.last_name + "　" + user.user_details.first_name,
-            user_tel=user.user_details.tel,
-            user_address=user.user_details.address,
-            lesson_number=cancel_lesson.number,
-            lesson_title=cancel_lesson.title,
-            action="cancel"
-        )
-        return {"removed": cancel_lesson}
-    else:
-        cancel_lesson.capacity_left = cancel_lesson.capacity - len(cancel_lesson.users)
-        session.add(cancel_lesson)
-        session.commit()
-        session.refresh(cancel_lesson)
-        add_log(
-            user_name=user.user_details.last_name + "　" + user.user_details.first_name,
-            user_tel=user.user_details.tel,
-            user_address=user.user_details.address,
-            lesson_number=cancel_lesson.number,
-            lesson_title=cancel_lesson.title,
-            action="cancel"
-        )
-        return {"removed": cancel_lesson}
+    log_user = read_log_user(user)
+    release_session(session)
+    submit_signup("cancel", user.id, cancel_lesson.id)
+    cancel_lesson = session.get(Lesson, lesson_id)
+    release_session(session)
+    add_log(
+        **log_user,
+        lesson_number=cancel_lesson.number,
+        lesson_title=cancel_lesson.title,
+        action="cancel"
+    )
+    return {"removed": cancel_lesson}
 
 
 
@@ -376,8 +410,7 @@ def delete_my_lesson(session: Annotated[Session, Depends(get_session)], current_
 # admin: read user list of a lesson
 @router.get("/json/admin/lessons/{lesson_id}/users", response_model=list[UserRead], tags={"Lesson"})
 def admin_json_read_users_of_a_lesson(session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(get_current_active_user)], lesson_id: int):
-    operating_user = session.exec(select(User).where(User.username == current_user.username)).one()
-    if not operating_user.is_admin:
+    if not current_user.is_admin:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authorized")
     # using session below
     lesson = session.exec(select(Lesson).where(Lesson.id == lesson_id)).one()
@@ -387,36 +420,73 @@ def admin_json_read_users_of_a_lesson(session: Annotated[Session, Depends(get_se
 
 
 
+# members of lessons in signup order with one joined query: {lesson_id: [UserDetail, ...]}
+# outer joins: a member who has not entered their details yet still holds a seat, with None in place of the UserDetail
+def read_lesson_members(session: Session, lesson_ids: list[int]) -> dict:
+    query = (
+        select(UserLessonLink.lesson_id, UserDetail)
+        .outerjoin(UserUserDetailLink, UserUserDetailLink.user_id == UserLessonLink.user_id)
+        .outerjoin(UserDetail, UserDetail.id == UserUserDetailLink.user_details_id)
+        .where(UserLessonLink.lesson_id.in_(lesson_ids))
+        .order_by(UserLessonLink.lesson_id, UserLessonLink.signup_seq)
+    )
+    members = {lesson_id: [] for lesson_id in lesson_ids}
+    for lesson_id, user_details in session.exec(query).all():
+        members[lesson_id].append(user_details)
+    return members
+
+
+# children of lessons in signup order with their parent's details, one joined query: {lesson_id: [(UserChild, UserDetail), ...]}
+# the parent's UserDetail is None when the parent has no details row (outer joins, as for members)
+def read_lesson_children(session: Session, lesson_ids: list[int]) -> dict:
+    query = (
+        select(UserChildLessonLink.lesson_id, UserChild, UserDetail)
+        .join(UserChild, UserChild.id == UserChildLessonLink.user_child_id)
+        .outerjoin(UserUserDetailLink, UserUserDetailLink.user_id == UserChild.user_id)
+        .outerjoin(UserDetail, UserDetail.id == UserUserDetailLink.user_details_id)
+        .where(UserChildLessonLink.lesson_id.in_(lesson_ids))
+        .order_by(UserChildLessonLink.lesson_id, UserChildLessonLink.signup_seq)
+    )
+    children = {lesson_id: [] for lesson_id in lesson_ids}
+    for lesson_id, child, parent_details in session.exec(query).all():
+        children[lesson_id].append((child, parent_details))
+    return children
+
+
+# full name from a UserDetail, None for a member without details
+def details_name(user_details) -> str:
+    if user_details is None:
+        return None
+    return user_details.last_name + "　" + user_details.first_name
+
+
+
+
 # admin: json: read lesson member list
 @router.get("/json/admin/lessons/users", tags={"Lesson"})
 def admin_json_read_users_of_every_lessons(session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(get_current_active_user)]):
     # if current_user.username != "user":
     #     raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authorized")
-    accessing_user = session.exec(select(User).where(User.username == current_user.username)).one()
-    if accessing_user.is_admin != True:
+    if current_user.is_admin != True:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authorized")
     current_period = get_current_period(session)
     lessons = session.exec(select(Lesson).where(Lesson.year == current_period.year, Lesson.season == current_period.season)).all()
+    # three queries in total however many members: lessons, children of lesson 1, members of the others
+    children_of_lessons = read_lesson_children(session, [lesson.id for lesson in lessons if lesson.number == 1])
+    members_of_lessons = read_lesson_members(session, [lesson.id for lesson in lessons if lesson.number != 1])
     lessons_users_list = []
     for lesson in lessons:
         users = []
         if lesson.number == 1:
-            for child in lesson.user_children:
-                parent = session.exec(select(User).where(User.id == child.user_id)).one()
+            for child, parent_details in children_of_lessons[lesson.id]:
                 child_dict = child.model_dump()
-                parent_name = parent.user_details.last_name + "　" + parent.user_details.first_name
-                parent_tel = parent.user_details.tel
-                parent_postal_code = parent.user_details.postal_code
-                parent_address = parent.user_details.address
-                child_dict["parent_name"] = parent_name
-                child_dict["parent_tel"] = parent_tel
-                child_dict["parent_postal_code"] = parent_postal_code
-                child_dict["parent_address"] = parent_address
+                child_dict["parent_name"] = details_name(parent_details)
+                child_dict["parent_tel"] = parent_details.tel if parent_details else None
+                child_dict["parent_postal_code"] = parent_details.postal_code if parent_details else None
+                child_dict["parent_address"] = parent_details.address if parent_details else None
                 users.append(child_dict)
         else:
-            for user in lesson.users:
-                user_details = user.user_details
-                users.append(user_details)
+            users = members_of_lessons[lesson.id]
         lessons_users_dict = {"lesson_number": lesson.number, "lesson_title": lesson.title, "users": users}
         lessons_users_list.append(lessons_users_dict)
     return lessons_users_list
@@ -436,25 +506,15 @@ def admin_display_users_of_every_lessons(request: Request):
 # admin: delete: remove a user from a lesson
 @router.delete("/admin/users/{username}/remove/{lesson_id}", tags=["Lesson"])
 def admin_remove_lesson_member(session: Annotated[Session, Depends(get_session)], username: str, lesson_id: int, current_user: Annotated[User, Depends(get_current_active_user)]):
-    operating_user = session.exec(select(User).where(User.username == current_user.username)).one()
-    if not operating_user.is_admin:
+    if not current_user.is_admin:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authorized")
     lesson = session.exec(select(Lesson).where(Lesson.id == lesson_id)).one()
     lesson_title = lesson.title
-    lesson_member = lesson.users
     user = session.exec(select(User).where(User.username == username)).one()
     user_details = (user.user_details).model_dump()
     user_fullname = user_details["last_name"] + "　" + user_details["first_name"]
-    if user in lesson_member:
-        lesson_member.remove(user)
-    # user_children = session.exec(select(UserChild).where(UserChild.user_id == user.id)).all()
-    if lesson.number == 1:
-        for child in user.user_children:
-            if lesson in child.lessons:
-                child.lessons.remove(lesson)
-    session.add(lesson)
-    session.commit()
-    session.refresh(lesson)
+    release_session(session)
+    submit_signup("cancel", user.id, lesson.id)
     message = f"{username}：{user_fullname}を「{lesson_title}」から削除しました。"
     return {"removed done": message}
 
@@ -462,50 +522,58 @@ def admin_remove_lesson_member(session: Annotated[Session, Depends(get_session)]
 
 # read: lesson signup position
 @router.get("/json/my/lessons/{lesson_id}/position", tags=["Lesson"])
-def json_read_lesson_signup_position(session: Annotated[Session, Depends(get_session)], lesson_id: int, current_user: Annotated[User, Depends(get_current_active_user)]):
-    lesson = session.exec(select(Lesson).where(Lesson.id == lesson_id)).one()
-    user = session.exec(select(User).where(User.username == current_user.username)).one()
-    lesson_member = lesson.users
-    if not user in lesson_member:
-        # raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not signed up to this lesson")
-        user_position = 0
-    else:
-        user_position = lesson_member.index(user) + 1
+async def json_read_lesson_signup_position(session: Annotated[AsyncSession, Depends(get_async_session)], lesson_id: int, current_user: Annotated[User, Depends(get_current_active_user_async)]):
+    # 0: not signed up to this lesson
+    user_position = (await read_signup_positions_async(session, current_user.id, [lesson_id])).get(lesson_id, 0)
     return user_position
 
 
 
 # read: lesson signup position
 @router.get("/json/my/lessons/position", tags=["Lesson"])
-def json_read_lesson_signup_position_all(session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(get_current_active_user)]):
-    current_period = get_current_period(session)
-    lessons = session.exec(select(Lesson).where(Lesson.year == current_period.year, Lesson.season == current_period.season)).all()
-    user = session.exec(select(User).where(User.username == current_user.username)).one()
+async def json_read_lesson_signup_position_all(session: Annotated[AsyncSession, Depends(get_async_session)], current_user: Annotated[User, Depends(get_current_active_user_async)]):
+    current_period = await get_current_period_async(session)
+    lesson_ids = (await session.exec(select(Lesson.id).where(Lesson.year == current_period.year, Lesson.season == current_period.season))).all()
+    positions = await read_signup_positions_async(session, current_user.id, lesson_ids)
     position_list = []
-    for lesson in lessons:
-        lesson_member = lesson.users
-        if not user in lesson_member:
-            user_position = 0
-        elif lesson.number != 1:
-            user_position = lesson_member.index(user) + 1
-        elif lesson.number == 1:
-            user_children = session.exec(select(UserChild).where(UserChild.user_id == user.id)).all()
-            user_position = 0
-            for child in user_children:
-                if child in lesson.user_children:
-                    user_position = lesson.user_children.index(child) + 1
-        positioon_dict = {"lesson_id": lesson.id, "user_position": user_position}
+    for lesson_id in lesson_ids:
+        positioon_dict = {"lesson_id": lesson_id, "user_position": positions.get(lesson_id, 0)}
         position_list.append(positioon_dict)
     return position_list
 
 
 
 
+# json: lesson board: catalog, my lessons, my positions and my children in one response for the lessons page
+@router.get("/json/my/lessons/board", tags=["Lesson"])
+async def json_read_my_lesson_board(session: Annotated[AsyncSession, Depends(get_async_session)], current_user: Annotated[User, Depends(get_current_active_user_async)]):
+    current_period = await get_current_period_async(session)
+    current_time = datetime.utcnow()
+    if current_time < current_period.start_time:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Lesson signup is not allowed yet")
+    etag, lessons_body = await get_lesson_catalog(session, current_period)
+    lesson_ids = (await session.exec(select(Lesson.id).where(Lesson.year == current_period.year, Lesson.season == current_period.season))).all()
+    my_lessons = (await session.exec(my_lessons_query(current_user.id))).all()
+    positions = await read_signup_positions_async(session, current_user.id, lesson_ids)
+    position_list = [{"lesson_id": lesson_id, "user_position": positions.get(lesson_id, 0)} for lesson_id in lesson_ids]
+    children = (await session.exec(select(UserChild).where(UserChild.user_id == current_user.id))).all()
+    # the catalog is embedded as it is cached, already serialized
+    body = b"".join([
+        b'{"lessons":', lessons_body,
+        b',"my_lessons":', lesson_list_adapter.dump_json([LessonRead.model_validate(lesson) for lesson in my_lessons]),
+        b',"positions":', json.dumps(position_list).encode("utf-8"),
+        b',"children":', child_list_adapter.dump_json([UserChildRead.model_validate(child) for child in children]),
+        b"}",
+    ])
+    return Response(content=body, media_type="application/json")
+
+
+
+
 # admin: read: lesson list of a user signed up
 @router.get("/json/admin/user/{user_id}/lessons", tags=["Lesson"])
 def admin_json_read_user_lesson_list(session: Annotated[Session, Depends(get_session)], user_id: int, current_user: Annotated[User, Depends(get_current_active_user)]):
-    user = session.exec(select(User).where(User.username == current_user.username)).one()
-    if not user.is_admin:
+    if not current_user.is_admin:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authorized")
     target_user = session.get(User, user_id)
     user_lessons = target_user.lessons
@@ -517,8 +585,7 @@ def admin_json_read_user_lesson_list(session: Annotated[Session, Depends(get_ses
 @router.post("/admin/user/{user_id}/lessons/{lesson_id}", response_model=list[LessonRead], tags=["Lesson"])
 def create_my_lessons(session: Annotated[Session, Depends(get_session)], current_user: Annotated[UserRead, Depends(get_current_active_user)], user_id: int, lesson_id: int):
     current_time = (datetime.utcnow() + timedelta(hours=9)).replace(tzinfo=timezone(timedelta(hours=9)))
-    accessing_user = session.exec(select(User).where(User.username == current_user.username)).one()
-    if not accessing_user.is_admin:
+    if not current_user.is_admin:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="not authorized")
     new_lesson = session.exec(select(Lesson).where(Lesson.id == lesson_id)).one()
     # if new_lesson.year != 2024 or new_lesson.season != 1:
@@ -526,16 +593,11 @@ def create_my_lessons(session: Annotated[Session, Depends(get_session)], current
     user = session.exec(select(User).where(User.id == user_id)).one()
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authorized")
-    if not new_lesson in user.lessons:
-        user.lessons.append(new_lesson)
-        session.add(user)
-        session.commit()
-        session.refresh(user)
-    new_lesson.capacity_left = new_lesson.capacity - len(new_lesson.users)
-    session.add(new_lesson)
-    session.commit()
-    session.refresh(new_lesson)
-    user_lessons = user.lessons
+    release_session(session)
+    # children are entered separately by the admin, so only the parent is added here
+    submit_signup("apply", user.id, new_lesson.id, children_ids=[])
+    user_lessons = session.exec(my_lessons_query(user.id)).all()
+    release_session(session)
     return user_lessons
 
 
@@ -550,16 +612,9 @@ def admin_add_children_into_lesson(session: Annotated[Session, Depends(get_sessi
         raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail="lesson_id must be 1")
     # using session below
     user = session.get(User, user_id)
-    user_children = user.user_children
-    lesson = session.get(Lesson, lesson_id)
-    if user in lesson.users:
-        for child in user_children:
-            if not child in lesson.user_children:
-                child.lessons.append(lesson)
-        lesson.capacity_left = lesson.capacity - len(lesson.user_children)
-        session.add(lesson)
-        session.commit()
-        session.refresh(lesson)
+    if session.get(UserLessonLink, (user.id, lesson_id)):
+        release_session(session)
+        submit_signup("apply", user.id, lesson_id)
         return {"children signed up to the lesson": "done"}
     else:
         return {"parent user has not signed up to the lesson": "ignored"}
@@ -575,16 +630,9 @@ def admin_add_children_into_lesson_username_ver(session: Annotated[Session, Depe
         raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail="lesson_id must be 1")
     # using session below
     user = session.exec(select(User).where(User.username == username)).one()
-    user_children = user.user_children
-    lesson = session.get(Lesson, lesson_id)
-    if user in lesson.users:
-        for child in user_children:
-            if not child in lesson.user_children:
-                child.lessons.append(lesson)
-        lesson.capacity_left = lesson.capacity - len(lesson.user_children)
-        session.add(lesson)
-        session.commit()
-        session.refresh(lesson)
+    if session.get(UserLessonLink, (user.id, lesson_id)):
+        release_session(session)
+        submit_signup("apply", user.id, lesson_id)
         return {"children signed up to the lesson": "done"}
     else:
         return {"parent user has not signed up to the lesson": "ignored"}
@@ -596,16 +644,17 @@ def admin_add_children_into_lesson_username_ver(session: Annotated[Session, Depe
 @router.get("/lessons/refresh/capacity", tags=["Lesson"])
 def refresh_lesson_capacity_left(session: Annotated[Session, Depends(get_session)]):
     current_period = get_current_period(session)
-    lessons = session.exec(select(Lesson).where(Lesson.year == current_period.year, Lesson.season == current_period.season)).all()
-    for lesson in lessons:
-        if lesson.number == 1:
-            lesson.capacity_left = lesson.capacity - len(lesson.user_children)
-        else:
-            lesson.capacity_left = lesson.capacity - len(lesson.users)
-        session.add(lesson)
+    # recount every lesson in one UPDATE instead of loading each member list
+    user_count = sa_select(func.count()).select_from(UserLessonLink).where(UserLessonLink.lesson_id == Lesson.id).scalar_subquery()
+    child_count = sa_select(func.count()).select_from(UserChildLessonLink).where(UserChildLessonLink.lesson_id == Lesson.id).scalar_subquery()
+    session.execute(
+        update(Lesson)
+        .where(Lesson.year == current_period.year, Lesson.season == current_period.season)
+        .values(capacity_left=Lesson.capacity - case((Lesson.number == 1, child_count), else_=user_count))
+    )
     session.commit()
-    for lesson in lessons:
-        session.refresh(lesson)
+    bump_catalog_version()
+    lessons = session.exec(select(Lesson).where(Lesson.year == current_period.year, Lesson.season == current_period.season)).all()
     return lessons
 
 
@@ -618,26 +667,22 @@ def json_read_lesson_applicants(lesson_id: int, session: Annotated[Session, Depe
     lesson = session.exec(select(Lesson).where(Lesson.id == lesson_id)).one()
     result = []
     if lesson.number == 1:
-        children = lesson.user_children
         counter = 1
-        for child in children:
-            user_details = child.user.user_details
+        for child, user_details in read_lesson_children(session, [lesson.id])[lesson.id]:
             child_details_out = {
                 "No.": counter,
                 "name": child.child_last_name + "　" + child.child_first_name,
                 "furigana": child.child_last_name_furigana + "　" + child.child_first_name_furigana,
-                "parent": user_details.last_name + "　" + user_details.first_name,
-                "tel": user_details.tel,
-                "address": user_details.address
+                "parent": details_name(user_details),
+                "tel": user_details.tel if user_details else None,
+                "address": user_details.address if user_details else None
                 }
             counter = counter + 1
             result.append(child_details_out)
     else:
-        users = lesson.users
         counter = 1
-        for user in users:
-            user_details = user.user_details
-            user_details_out = {"No.": counter, "name": (user_details.last_name + "　" + user_details.first_name), "tel": user_details.tel, "address": user_details.address}
+        for user_details in read_lesson_members(session, [lesson.id])[lesson.id]:
+            user_details_out = {"No.": counter, "name": details_name(user_details), "tel": user_details.tel if user_details else None, "address": user_details.address if user_details else None}
             counter = counter + 1
             result.append(user_details_out)
     return result
@@ -682,8 +727,7 @@ def json_read_lessons_each_user_applied(session: Annotated[Session, Depends(get_
 # post: admin: create lessons via spreadsheet GAS API
 @router.post("/json/admin/lessons/create")
 def json_admin_create_lessons(lessons_create: list[LessonCreate], session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(get_current_active_user)]):
-    user = session.exec(select(User).where(User.username == current_user.username)).one()
-    if user is None or not user.is_admin:
+    if not current_user.is_admin:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="not authorized")
     # print(lessons_create)
     # session.add_all(lessons_create) # this fails
@@ -691,6 +735,7 @@ def json_admin_create_lessons(lessons_create: list[LessonCreate], session: Annot
         db_lesson = Lesson.model_validate(lesson_create)
         session.add(db_lesson)
     session.commit()
+    bump_catalog_version()
     return {"ok": "done"}
 
 
@@ -698,17 +743,19 @@ def json_admin_create_lessons(lessons_create: list[LessonCreate], session: Annot
 
 # json: get my user children in current lesson
 @router.get("/json/my/children_in_current_lesson", tags=["Lesson"], response_model=list[UserChildRead])
-def json_get_my_children_in_current_lesson(
-    session: Annotated[Session, Depends(get_session)],
-    current_user: Annotated[User, Depends(get_current_active_user)]
+async def json_get_my_children_in_current_lesson(
+    session: Annotated[AsyncSession, Depends(get_async_session)],
+    current_user: Annotated[User, Depends(get_current_active_user_async)]
     ):
-    current_period = get_current_period(session)
-    children = session.exec(select(UserChild).where(UserChild.user_id == current_user.id)).all()
-    children_in_current_lesson = []
-    for child in children:
-        for lesson in child.lessons:
-            if lesson.year == current_period.year and lesson.season == current_period.season:
-                children_in_current_lesson.append(child)
+    current_period = await get_current_period_async(session)
+    # one row per child and lesson of the current period, like the loop over child.lessons did
+    children_in_current_lesson = (await session.exec(
+        select(UserChild)
+        .join(UserChildLessonLink, UserChildLessonLink.user_child_id == UserChild.id)
+        .join(Lesson, Lesson.id == UserChildLessonLink.lesson_id)
+        .where(UserChild.user_id == current_user.id, Lesson.year == current_period.year, Lesson.season == current_period.season)
+        .order_by(UserChild.id, Lesson.id)
+    )).all()
     return children_in_current_lesson
 
 
@@ -18,7 +18,7 @@ from pydantic import BaseModel
 from database import engine, get_session
 from models.lessons import Lesson, LessonCreate, LessonRead, LessonUpdate, LessonDelete
 from models.users import User, UserCreate, UserRead, UserUpdate, UserDelete, UserChild
-from routers.auth import get_current_active_user, get_hashed_password
+from routers.auth import get_current_active_user, get_hashed_password, invalidate_cached_user
 
 
 # instance of API router and templates
@@ -71,8 +71,7 @@ def verify_reset_token(token: str):
 
 @router.post("/request-password-reset/", tags=["PasswordReset"])
 def request_password_reset(request: PasswordResetRequest, session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(get_current_active_user)]):
-    user = session.exec(select(User).where(User.username == current_user.username)).one()
-    if not user.is_admin:
+    if not current_user.is_admin:
         return HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="not authorized")
     username = request.username
     token = generate_reset_token(username)
@@ -100,6 +99,7 @@ def reset_password(request: PasswordResetConfirm, session: Annotated[Session, De
     user.hashed_password = hashed_password
     session.add(user)
     session.commit()
+    invalidate_cached_user(username)
     return {"message": "Password has been reset successfully", "username": username}
 
 
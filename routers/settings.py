@@ -7,18 +7,37 @@ from fastapi.templating import Jinja2Templates
 from sqlmodel import SQLModel, Session, select
 from typing import Optional, Annotated, Dict
 from datetime import datetime, timedelta, timezone
+import os
 
 # my modules
 from database import engine, get_session
 from models.users import User
 from routers.auth import get_current_active_user
 from models.settings import Period, PeriodRequest
+from cache import TTLCache, bump_catalog_version
 
 # instance of API router and templates
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
 
 
+# process cache of the current period: upsert_period refreshes it, the ttl covers the other workers
+if "PERIOD_CACHE_TTL" in os.environ:
+    PERIOD_CACHE_TTL = float(os.getenv("PERIOD_CACHE_TTL"))
+else:
+    PERIOD_CACHE_TTL = 10.0
+
+CURRENT_PERIOD_KEY = "current"
+period_cache = TTLCache("period", maxsize=1, ttl=PERIOD_CACHE_TTL)
+
+
+# cache a detached copy so it can be shared by every request and session
+def cache_current_period(db_period: Period) -> Period:
+    cached_period = Period.model_validate(db_period)
+    period_cache.set(CURRENT_PERIOD_KEY, cached_period)
+    return cached_period
+
+
 
 # 期間情報取得
 @router.get("/admin/period", response_model=Period)
@@ -96,6 +115,8 @@ def upsert_period(
     except Exception as e:
         session.rollback()  # エラー時はロールバック
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+    cache_current_period(db_period)  # キャッシュを更新
+    bump_catalog_version()
 
     return period_request  # クライアントに送るレスポンスとしてPeriodRequestを返す
 
@@ -2,18 +2,23 @@
 
 # modules
 from fastapi import APIRouter, Request, Header, Body, HTTPException, Depends, Query, Form, status
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 from fastapi.templating import Jinja2Templates
-from sqlmodel import SQLModel, Session, select
+from sqlmodel import SQLModel, Session, select, func
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import Optional, Annotated
 from sqlalchemy.orm import selectinload
 
 # my modules
-from database import engine, get_session
+from database import engine, get_session, get_async_session
 from models.items import Item, ItemCreate, ItemRead, ItemUpdate, ItemDelete
 from models.users import User, UserCreate, UserRead, UserUpdate, UserDelete, UserIn, UserInDB, UserDetail, UserWithUserDetailCreate, UserDetailRead, UserDetailUsernameRead, UserDetailCreate, UserChild, UserChildCreate, UserChildRead
 from routers.auth import get_hashed_password
-from routers.auth import get_current_active_user
+from models.link_table import UserLessonLink
+from routers.auth import get_current_active_user, get_current_active_user_async, invalidate_cached_user
+from kana import normalize_kana, prefix_end
+from member_search import search_members
+from versioning import check_if_match, commit_versioned, set_version_etag
 
 # instance of API router and templates
 router = APIRouter()
@@ -78,8 +83,7 @@ def create_db_user_details(user_in: UserWithUserDetailCreate):
 # admin: read: children
 @router.get("/user/{user_id}/children", tags=["User"])
 def admin_read_user_children(session: Annotated[Session, Depends(get_session)], user_id: int, current_user: Annotated[User, Depends(get_current_active_user)]):
-    operating_user = session.exec(select(User).where(User.username == current_user.username)).one()
-    if not operating_user.is_admin:
+    if not current_user.is_admin:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authorized")
     user = session.exec(select(User).where(User.id == user_id)).one()
     children = user.user_children
@@ -90,7 +94,7 @@ def admin_read_user_children(session: Annotated[Session, Depends(get_session)],
 # create: my user children
 @router.post("/my/children", tags=["User"])
 def create_my_user_children(session: Annotated[Session, Depends(get_session)], children: list[UserChildCreate], current_user: Annotated[User, Depends(get_current_active_user)]):
-    user = session.exec(select(User).where(User.username == current_user.username)).one()
+    user = session.get(User, current_user.id)
     for child in children:
         child = UserChild.model_validate(child)
         user.user_children.append(child)
@@ -109,7 +113,7 @@ def create_my_user_children(session: Annotated[Session, Depends(get_session)], c
 # delete: my user children
 @router.delete("/my/children{child_id}", tags=["User"])
 def delete_my_user_children(session: Annotated[Session, Depends(get_session)], child_id: int, current_user: Annotated[User, Depends(get_current_active_user)]):
-    user = session.exec(select(User).where(User.username == current_user.username)).one()
+    user = session.get(User, current_user.id)
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Require login")
     child = session.exec(select(UserChild).where(UserChild.id == child_id and UserChild.user_id == user.id)).first()
@@ -123,8 +127,7 @@ def delete_my_user_children(session: Annotated[Session, Depends(get_session)], c
 # admin: delete: children
 @router.delete("/user/{user_id}/children/{child_id}", tags=["User"])
 def admin_delete_user_children(session: Annotated[Session, Depends(get_session)], user_id: int, child_id: int, current_user: Annotated[User, Depends(get_current_active_user)]):
-    operating_user = session.exec(select(User).where(User.username == current_user.username)).one()
-    if not operating_user.is_admin:
+    if not current_user.is_admin:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authorized")
     user = session.exec(select(User).where(User.id == user_id)).one()
     if user is None:
@@ -139,8 +142,7 @@ def admin_delete_user_children(session: Annotated[Session, Depends(get_session)]
 # json: admin: read user list
 @router.get("/json/admin/users", response_model=list[UserRead], tags=["User"])
 def read_users_list(*, offset: int = 0, limit: int = Query(default=100, le=100), session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(get_current_active_user)]):
-    operating_user = session.exec(select(User).where(User.username == current_user.username)).one()
-    if not operating_user.is_admin:
+    if not current_user.is_admin:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authorized")
     users = session.exec(select(User).offset(offset).limit(limit)).all()
     # if not users:
@@ -152,8 +154,7 @@ def read_users_list(*, offset: int = 0, limit: int = Query(default=100, le=100),
 # json: admin: read user list with data
 @router.get("/json/admin/users-full", tags=["User"])
 def read_users_list(session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(get_current_active_user)]):
-    operating_user = session.exec(select(User).where(User.username == current_user.username)).one()
-    if not operating_user.is_admin:
+    if not current_user.is_admin:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authorized")
     users = session.exec(select(User)).all()
     result = []
@@ -184,14 +185,14 @@ def read_user(session: Annotated[Session, Depends(get_session)], username: str,
 
 # json: admin: read user with user details
 @router.get("/json/admin/users/details/{username}", response_model=UserDetailUsernameRead, tags=["User"])
-def read_user_details(username: str, session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(get_current_active_user)]):
-    operating_user = session.exec(select(User).where(User.username == current_user.username)).one()
-    if not operating_user.is_admin:
+def read_user_details(username: str, session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(get_current_active_user)], response: Response):
+    if not current_user.is_admin:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authorized")
     user = session.exec(select(User).where(User.username == username)).one()
     if user is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
     user_details = user.user_details
+    set_version_etag(response, user_details.version)
     user_details_dict = user_details.model_dump()
     user_details_dict["username"] = user.username
     return user_details_dict
@@ -201,8 +202,7 @@ def read_user_details(username: str, session: Annotated[Session, Depends(get_ses
 # admin: patch: username password and is_admin
 @router.patch("/admin/users/{username}", response_model=UserRead, tags=["User"])
 def patch_user(session: Annotated[Session, Depends(get_session)], username: str, user_update: UserUpdate, current_user: Annotated[User, Depends(get_current_active_user)]):
-    operating_user = session.exec(select(User).where(User.username == current_user.username)).one()
-    if not operating_user.is_admin:
+    if not current_user.is_admin:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authorized")
     # db_user = session.get(User, user_id)
     user = session.exec(select(User).where(User.username == username)).one()
@@ -218,26 +218,30 @@ def patch_user(session: Annotated[Session, Depends(get_session)], username: str,
     session.add(user)
     session.commit()
     session.refresh(user)
+    invalidate_cached_user(username)
+    invalidate_cached_user(user.username)
     return user
 
 
 
-# admin: patch: user details
+# admin: patch: user details (If-Match: the ETag of the version the edit was made from, 409 when it is stale)
 @router.patch("/admin/userdetails/{username}", tags=["User"], response_model=UserDetailUsernameRead)
-def patch_userdetails(username: str, new_user_details: UserDetailCreate, session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(get_current_active_user)]):
-    operating_user = session.exec(select(User).where(User.username == current_user.username)).one()
-    if not username == current_user.username and not operating_user.is_admin:
+def patch_userdetails(username: str, new_user_details: UserDetailCreate, session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(get_current_active_user)],
+                      response: Response, if_match: Annotated[Optional[str], Header()] = None):
+    if not username == current_user.username and not current_user.is_admin:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed")
     user = session.exec(select(User).where(User.username == username)).one()
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     user_details = user.user_details
+    check_if_match(if_match, user_details.version)
     proper_new_user_details = new_user_details.model_dump(exclude_unset=True)
     for key, value in proper_new_user_details.items():
         setattr(user_details, key, value)
     session.add(user)
-    session.commit()
+    commit_versioned(session, user_details)
     session.refresh(user_details)
+    set_version_etag(response, user_details.version)
     user_details_out = user_details.model_dump()
     user_details_out["username"] = username
     return user_details_out
@@ -245,16 +249,19 @@ def patch_userdetails(username: str, new_user_details: UserDetailCreate, session
 
 # patch: my user details
 @router.patch("/my/userdetails", tags=["User"], response_model=UserDetailUsernameRead)
-def patch_my_userdetails(new_user_details: UserDetailCreate, session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(get_current_active_user)]):
+def patch_my_userdetails(new_user_details: UserDetailCreate, session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(get_current_active_user)],
+                         response: Response, if_match: Annotated[Optional[str], Header()] = None):
     # operating_user = session.exec(select(User).where(User.username == current_user.username)).one()
-    user = session.exec(select(User).where(User.username == current_user.username)).one()
+    user = session.get(User, current_user.id)
     user_details = user.user_details
+    check_if_match(if_match, user_details.version)
     db_new_user_details = new_user_details.model_dump(exclude_unset=True)
     for key, value in db_new_user_details.items():
         setattr(user_details, key, value)
     session.add(user)
-    session.commit()
+    commit_versioned(session, user_details)
     session.refresh(user_details)
+    set_version_etag(response, user_details.version)
     user_details_out = user_details.model_dump()
     user_details_out["username"] = current_user.username
     return user_details_out
@@ -264,8 +271,7 @@ def patch_my_userdetails(new_user_details: UserDetailCreate, session: Annotated[
 # delete: user with details
 @router.delete("/users/delete/{username}", tags=["User"])
 def delete_user(username: str, session:Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(get_current_active_user)]):
-    operating_user = session.exec(select(User).where(User.username == current_user.username)).one()
-    if current_user.username != username and not operating_user.is_admin:
+    if current_user.username != username and not current_user.is_admin:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed")
     user = session.exec(select(User).where(User.username == username)).one()
     if user is None:
@@ -274,6 +280,7 @@ def delete_user(username: str, session:Annotated[Session, Depends(get_session)],
     session.delete(user)
     session.delete(user_details)
     session.commit()
+    invalidate_cached_user(username)
     return {"deleted": user.username}
 
 
@@ -294,9 +301,9 @@ def get_username(session: Annotated[Session, Depends(get_session)], current_user
 
 # json: get my user details
 @router.get("/json/my/userdetails", tags=["User"], response_model=UserDetailUsernameRead)
-def json_get_my_userdetails(session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(get_current_active_user)]):
-    user = session.exec(select(User).where(User.username == current_user.username)).one()
-    user_details = session.exec(select(UserDetail).where(UserDetail.user_id == user.id)).one()
+def json_get_my_userdetails(session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(get_current_active_user)], response: Response):
+    user_details = session.exec(select(UserDetail).where(UserDetail.user_id == current_user.id)).one()
+    set_version_etag(response, user_details.version)
     user_details_dict = user_details.model_dump() # dict型に変更
     user_details_dict["username"] = current_user.username
     return user_details_dict
@@ -305,9 +312,8 @@ def json_get_my_userdetails(session: Annotated[Session, Depends(get_session)], c
 
 # json: get my user children
 @router.get("/json/my/children", tags=["User"], response_model=list[UserChildRead])
-def json_get_my_children(session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(get_current_active_user)]):
-    user = session.exec(select(User).where(User.username == current_user.username)).one()
-    children = session.exec(select(UserChild).where(UserChild.user_id == user.id)).all()
+async def json_get_my_children(session: Annotated[AsyncSession, Depends(get_async_session)], current_user: Annotated[User, Depends(get_current_active_user_async)]):
+    children = (await session.exec(select(UserChild).where(UserChild.user_id == current_user.id))).all()
     return children
 
 
@@ -347,24 +353,46 @@ def get_users_html_admin(request: Request):
 
 @router.get("/json/admin/users", tags=["User"])
 def admin_get_user_list_json(session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(get_current_active_user)]):
-    user = session.exec(select(User).where(User.username == current_user.username)).one()
-    if not user.is_admin:
+    if not current_user.is_admin:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authorized")
     user_details = session.exec(select(UserDetail)).all()
     return user_details
 
 
+# admin search: page size
+USER_SEARCH_LIMIT = 50
+USER_SEARCH_MAX_LIMIT = 200
+
+
+# prefix search on the normalized furigana: "ヤマ", "ﾔﾏ" and "やま" all find "やまだ"; given both, both must match
+def user_search_query(last_name_furigana: Optional[str], first_name_furigana: Optional[str]):
+    last_key = normalize_kana(last_name_furigana) if last_name_furigana else ""
+    first_key = normalize_kana(first_name_furigana) if first_name_furigana else ""
+    if not last_key and not first_key:
+        return None
+    query = select(UserDetail)
+    if last_key:
+        query = query.where(UserDetail.last_name_search >= last_key, UserDetail.last_name_search < prefix_end(last_key))
+    if first_key:
+        query = query.where(UserDetail.first_name_search >= first_key, UserDetail.first_name_search < prefix_end(first_key))
+    return query.order_by(UserDetail.last_name_search, UserDetail.first_name_search, UserDetail.id)
+
+
 @router.get("/json/admin/users/search_pre", tags=["User"])
-def  admin_user_search_pre(session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(get_current_active_user)], last_name_furigana: str = None, first_name_furigana: str = None):
-    user = session.exec(select(User).where(User.username == current_user.username)).one()
-    if not user.is_admin:
+def  admin_user_search_pre(
+    session: Annotated[Session, Depends(get_session)],
+    current_user: Annotated[User, Depends(get_current_active_user)],
+    last_name_furigana: str = None,
+    first_name_furigana: str = None,
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=USER_SEARCH_LIMIT, ge=1, le=USER_SEARCH_MAX_LIMIT),
+):
+    if not current_user.is_admin:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not Authorized")
-    if last_name_furigana and not first_name_furigana:
-        user_details = session.exec(select(UserDetail).where(UserDetail.last_name_furigana == last_name_furigana)).all()
-    elif not last_name_furigana and first_name_furigana:
-        user_details = session.exec(select(UserDetail).where(UserDetail.first_name_furigana == first_name_furigana)).all()
-    elif last_name_furigana and first_name_furigana:
-        user_details = session.exec(select(UserDetail).where(UserDetail.last_name_furigana == last_name_furigana and UserDetail.first_name_furigana == first_name_furigana)).all()
+    query = user_search_query(last_name_furigana, first_name_furigana)
+    if query is None:
+        return []
+    user_details = session.exec(query.offset(offset).limit(limit)).all()
     return user_details
 
 
@@ -374,26 +402,38 @@ def admin_user_search(
     session: Annotated[Session, Depends(get_session)], 
     current_user: Annotated[User, Depends(get_current_active_user)], 
     last_name_furigana: str = None, 
-    first_name_furigana: str = None
+    first_name_furigana: str = None,
+    q: str = None,
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=USER_SEARCH_LIMIT, ge=1, le=USER_SEARCH_MAX_LIMIT),
 ):
     # 現在のユーザーが管理者であることを確認
-    user = session.exec(select(User).where(User.username == current_user.username)).one()
-    if not user.is_admin:
+    if not current_user.is_admin:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not Authorized")
 
-    # UserDetailのリストを取得する
-    if last_name_furigana and not first_name_furigana:
-        user_details = session.exec(select(UserDetail).where(UserDetail.last_name_furigana == last_name_furigana)).all()
-    elif not last_name_furigana and first_name_furigana:
-        user_details = session.exec(select(UserDetail).where(UserDetail.first_name_furigana == first_name_furigana)).all()
-    elif last_name_furigana and first_name_furigana:
-        user_details = session.exec(select(UserDetail).where(UserDetail.last_name_furigana == last_name_furigana and UserDetail.first_name_furigana == first_name_furigana)).all()
+    # キーワード検索（名前・ふりがな・電話番号・住所・子供の名前の一部、関連度順）
+    if q:
+        return search_members(session, q, offset, limit)
+
+    # UserDetailのリストを取得する（ふりがなの前方一致、offset/limitでページ分け）
+    query = user_search_query(last_name_furigana, first_name_furigana)
+    if query is None:
+        return []
+    user_details = session.exec(query.offset(offset).limit(limit)).all()
+
+    # ユーザー、子供、受講数はページ分をまとめて取得する
+    user_ids = [detail.user_id for detail in user_details]
+    users = {user.id: user for user in session.exec(select(User).where(User.id.in_(user_ids))).all()}
+    children_of = {}
+    for child in session.exec(select(UserChild).where(UserChild.user_id.in_(user_ids)).order_by(UserChild.id)).all():
+        children_of.setdefault(child.user_id, []).append(child)
+    lesson_counts = dict(session.exec(
+        select(UserLessonLink.user_id, func.count()).where(UserLessonLink.user_id.in_(user_ids)).group_by(UserLessonLink.user_id)
+    ).all())
 
-    # 各UserDetailのuser_idを使って対応するUserを取得し、必要な情報を追加
     response = []
     for detail in user_details:
-        # user_idを使ってUserを取得
-        user = session.exec(select(User).where(User.id == detail.user_id)).one_or_none()
+        user = users.get(detail.user_id)
 
         if user:
             # Userの情報をUserDetailに追加
@@ -402,8 +442,8 @@ def admin_user_search(
                 "username": user.username,
                 "user_children": [
                     {"user_child_id": child.id, "first_name": child.child_first_name, "last_name": child.child_last_name}
-                    for child in user.user_children
-                ] if user.user_children else []
+                    for child in children_of.get(user.id, [])
+                ]
             }
             
             # UserDetailの他の情報を追加
@@ -417,7 +457,7 @@ def admin_user_search(
                 "postal_code": detail.postal_code,
                 "address": detail.address,
                 "created_time": detail.created_time,
-                "lessons": len(user.lessons)
+                "lessons": lesson_counts.get(user.id, 0)
             })
 
             # レスポンスリストに追加
@@ -0,0 +1,52 @@
+# --- serve.py ---
+# production entrypoint: prepare the database once, then run uvicorn with several worker processes
+#   WORKERS=4 python serve.py
+# every worker has its own caches and background writers; what they share goes through the database:
+# enrollments take the sqlite write lock up front (database.write_engine), the lesson catalog and period caches
+# expire after a few seconds, and a changed or deleted user is forgotten by the other workers after USER_CACHE_TTL
+
+# modules
+import os
+import uvicorn
+
+
+# settings: worker processes (WEB_CONCURRENCY is the name most hosts set), address and port
+if "WORKERS" in os.environ:
+    WORKERS = int(os.getenv("WORKERS"))
+elif "WEB_CONCURRENCY" in os.environ:
+    WORKERS = int(os.getenv("WEB_CONCURRENCY"))
+else:
+    WORKERS = 1
+
+if "HOST" in os.environ:
+    HOST = os.getenv("HOST")
+else:
+    HOST = "0.0.0.0"
+
+if "PORT" in os.environ:
+    PORT = int(os.getenv("PORT"))
+else:
+    PORT = 8000
+
+if "LOG_LEVEL" in os.environ:
+    LOG_LEVEL = os.getenv("LOG_LEVEL")
+else:
+    LOG_LEVEL = "info"
+
+
+
+def main():
+    # split the cores between the workers' password pools unless it is set explicitly
+    if "PASSWORD_WORKERS" not in os.environ:
+        os.environ["PASSWORD_WORKERS"] = str(max(1, (os.cpu_count() or 1) // WORKERS))
+    # migrations and create_all run here exactly once, not in every worker at the same time
+    from main import prepare_database
+    from database import engine
+    prepare_database()
+    engine.dispose()
+    os.environ["DATABASE_PREPARED"] = "1" # inherited by the workers: their startup skips prepare_database
+    uvicorn.run("main:app", host=HOST, port=PORT, workers=WORKERS, proxy_headers=True, log_level=LOG_LEVEL)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+# --- signup_writer.py ---
+
+# modules
+from fastapi import HTTPException, status
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import select as sa_select, insert, update, delete, func, case, literal
+from sqlalchemy.exc import OperationalError
+from concurrent.futures import Future
+from typing import Optional
+import os
+import queue
+import threading
+
+# my modules
+from database import write_engine
+from cache import bump_catalog_version
+from models.lessons import Lesson
+from models.users import UserChild
+from models.link_table import UserLessonLink, UserChildLessonLink
+
+
+# settings: how many intents are applied in one transaction and how long a caller waits for its result
+if "SIGNUP_BATCH_SIZE" in os.environ:
+    SIGNUP_BATCH_SIZE = int(os.getenv("SIGNUP_BATCH_SIZE"))
+else:
+    SIGNUP_BATCH_SIZE = 64
+
+if "SIGNUP_TIMEOUT_SECONDS" in os.environ:
+    SIGNUP_TIMEOUT_SECONDS = float(os.getenv("SIGNUP_TIMEOUT_SECONDS"))
+else:
+    SIGNUP_TIMEOUT_SECONDS = 30.0
+
+# how often a batch waits for the sqlite write lock (busy_timeout each) before it is split up
+if "SIGNUP_LOCK_ATTEMPTS" in os.environ:
+    SIGNUP_LOCK_ATTEMPTS = int(os.getenv("SIGNUP_LOCK_ATTEMPTS"))
+else:
+    SIGNUP_LOCK_ATTEMPTS = 3
+
+
+
+class SignupWriterStopped(Exception):
+    pass
+
+
+
+# one enrollment or cancel request waiting for the writer
+class SignupIntent:
+    def __init__(self, action: str, user_id: int, lesson_id: int, children_ids: Optional[list[int]] = None):
+        self.action = action # "apply" or "cancel"
+        self.user_id = user_id
+        self.lesson_id = lesson_id
+        self.children_ids = children_ids # None: every child of the user (lesson number 1 only)
+        self.future = Future() # cancelled by a caller that gave up waiting: the writer then skips the intent
+
+
+
+# single in-process writer: drains the queue and applies each batch inside one transaction
+class SignupWriter:
+    def __init__(self, batch_size: int = SIGNUP_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stopped = False
+        self.batches = 0
+        self.intents = 0
+        self.abandoned = 0
+        self.lock_timeouts = 0
+
+
+    def start(self):
+        with self.lock:
+            self.stopped = False
+            self.start_thread()
+
+
+    # with self.lock held
+    def start_thread(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.run, name="signup-writer", daemon=True)
+            self.thread.start()
+
+
+    # stop after everything already queued has been written; later submissions are refused
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            thread = self.thread
+            self.thread = None
+            # under the lock: no intent can be queued behind the sentinel
+            if thread is not None and thread.is_alive():
+                self.queue.put(None)
+        if thread is not None:
+            thread.join()
+
+
+    # starts the writer on first use, but never again after stop(): a request at shutdown gets SignupWriterStopped
+    def submit(self, intent: SignupIntent) -> Future:
+        with self.lock:
+            if self.stopped:
+                raise SignupWriterStopped()
+            self.start_thread()
+            self.queue.put(intent)
+        return intent.future
+
+
+    def run(self):
+        while True:
+            intent = self.queue.get()
+            if intent is None:
+                return
+            batch = [intent]
+            stop_after_batch = False
+            while len(batch) < self.batch_size:
+                try:
+                    intent = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if intent is None:
+                    stop_after_batch = True
+                    break
+                batch.append(intent)
+            # intents whose caller timed out were cancelled and are dropped; the others can no longer be cancelled
+            running = [intent for intent in batch if intent.future.set_running_or_notify_cancel()]
+            self.abandoned += len(batch) - len(running)
+            if running:
+                self.write_batch(running)
+            if stop_after_batch:
+                return
+
+
+    def write_batch(self, batch: list[SignupIntent], lock_attempts: int = SIGNUP_LOCK_ATTEMPTS):
+        results = []
+        try:
+            # write_engine: the batch holds the write lock from its first read, so workers in other processes wait
+            with Session(write_engine) as session:
+                for intent in batch:
+                    # rejected intents raise HTTPException before writing anything, so the batch can go on
+                    try:
+                        results.append((intent, apply_intent(session, intent), None))
+                    except HTTPException as e:
+                        results.append((intent, None, e))
+                session.commit()
+        except Exception as e:
+            if is_lock_timeout(e) and lock_attempts > 1:
+                # another worker process held the write lock past busy_timeout: nothing was written, wait for it again
+                self.lock_timeouts += 1
+                self.write_batch(batch, lock_attempts - 1)
+                return
+            if len(batch) > 1:
+                # an unexpected failure must only hit its own caller: retry one intent per transaction
+                for intent in batch:
+                    self.write_batch([intent])
+            else:
+                batch[0].future.set_exception(e)
+            return
+        self.batches += 1
+        self.intents += len(batch)
+        bump_catalog_version()
+        for intent, result, error in results:
+            if error is not None:
+                intent.future.set_exception(error)
+            else:
+                intent.future.set_result(result)
+
+
+
+# sqlite "database is locked": the busy_timeout ran out while waiting for the write lock
+def is_lock_timeout(error: Exception) -> bool:
+    return isinstance(error, OperationalError) and "locked" in str(error.orig)
+
+
+
+# apply one intent inside the writer's transaction
+def apply_intent(session: Session, intent: SignupIntent) -> dict:
+    # FOR UPDATE locks the lesson row on databases with row locks; sqlite relies on BEGIN IMMEDIATE instead
+    lesson = session.get(Lesson, intent.lesson_id, with_for_update=True)
+    if lesson is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Lesson not found")
+    if intent.action == "apply":
+        return apply_signup(session, lesson, intent.user_id, intent.children_ids)
+    elif intent.action == "cancel":
+        return apply_cancel(session, lesson, intent.user_id)
+    raise ValueError(f"unknown signup action: {intent.action}")
+
+
+
+# insert a link row unless it already exists: returns True when a row was inserted
+def insert_link(session: Session, link_model, owner_column: str, owner_id: int, lesson_id: int) -> bool:
+    owner = getattr(link_model, owner_column)
+    already_linked = sa_select(link_model.lesson_id).where(owner == owner_id, link_model.lesson_id == lesson_id).exists()
+    # next number in the lesson's signup order: MAX() is served by the (lesson_id, signup_seq) index
+    next_seq = sa_select(func.coalesce(func.max(link_model.signup_seq), 0) + 1).where(link_model.lesson_id == lesson_id).scalar_subquery()
+    statement = insert(link_model).from_select(
+        [owner_column, "lesson_id", "signup_seq"],
+        sa_select(literal(owner_id), literal(lesson_id), next_seq).where(~already_linked),
+    )
+    return session.execute(statement).rowcount > 0
+
+
+
+# signup positions of a user: {lesson_id: position}, lessons the user is not signed up to are left out
+# for lesson number 1 the position is the one of the user's last child in the lesson
+def read_signup_positions(session: Session, user_id: int, lesson_ids: Optional[list[int]] = None) -> dict:
+    return dict(session.execute(signup_positions_query(user_id, lesson_ids)).all())
+
+
+# the same on an async session
+async def read_signup_positions_async(session: AsyncSession, user_id: int, lesson_ids: Optional[list[int]] = None) -> dict:
+    return dict((await session.execute(signup_positions_query(user_id, lesson_ids))).all())
+
+
+# (lesson_id, position) rows of both link tables
+def signup_positions_query(user_id: int, lesson_ids: Optional[list[int]] = None):
+    mine = UserLessonLink.__table__.alias("mine")
+    other = UserLessonLink.__table__.alias("other")
+    user_position = (
+        sa_select(func.count())
+        .where(other.c.lesson_id == mine.c.lesson_id, other.c.signup_seq <= mine.c.signup_seq)
+        .scalar_subquery()
+    )
+    user_query = (
+        sa_select(mine.c.lesson_id, user_position)
+        .join(Lesson, Lesson.id == mine.c.lesson_id)
+        .where(mine.c.user_id == user_id, Lesson.number != 1)
+    )
+    my_child = UserChildLessonLink.__table__.alias("my_child")
+    other_child = UserChildLessonLink.__table__.alias("other_child")
+    child_position = (
+        sa_select(func.count())
+        .where(other_child.c.lesson_id == my_child.c.lesson_id, other_child.c.signup_seq <= my_child.c.signup_seq)
+        .scalar_subquery()
+    )
+    child_query = (
+        sa_select(my_child.c.lesson_id, func.max(child_position))
+        .join(UserChild, UserChild.id == my_child.c.user_child_id)
+        .join(UserLessonLink, (UserLessonLink.lesson_id == my_child.c.lesson_id) & (UserLessonLink.user_id == user_id))
+        .where(UserChild.user_id == user_id)
+        .group_by(my_child.c.lesson_id)
+    )
+    if lesson_ids is not None:
+        user_query = user_query.where(mine.c.lesson_id.in_(lesson_ids))
+        child_query = child_query.where(my_child.c.lesson_id.in_(lesson_ids))
+    return user_query.union_all(child_query)
+
+
+
+# move capacity_left by the number of members added (delta > 0) or removed (delta < 0) in one UPDATE
+def adjust_capacity_left(session: Session, lesson_id: int, link_model, delta: int):
+    member_count = sa_select(func.count()).select_from(link_model).where(link_model.lesson_id == lesson_id).scalar_subquery()
+    capacity_left = case(
+        (Lesson.capacity_left.is_(None), Lesson.capacity - member_count), # never counted yet: count once
+        else_=Lesson.capacity_left - delta,
+    )
+    session.execute(update(Lesson).where(Lesson.id == lesson_id).values(capacity_left=capacity_left))
+    return session.execute(sa_select(Lesson.capacity, Lesson.capacity_left).where(Lesson.id == lesson_id)).one()
+
+
+
+def apply_signup(session: Session, lesson: Lesson, user_id: int, children_ids: Optional[list[int]]) -> dict:
+    inserted = insert_link(session, UserLessonLink, "user_id", user_id, lesson.id)
+    if lesson.number == 1: # subject to change: lessons for children
+        children_query = sa_select(UserChild.id).where(UserChild.user_id == user_id)
+        if children_ids is not None:
+            children_query = children_query.where(UserChild.id.in_(children_ids))
+        added = 0
+        for child_id in session.execute(children_query).scalars().all():
+            added += insert_link(session, UserChildLessonLink, "user_child_id", child_id, lesson.id)
+        link_model = UserChildLessonLink
+    else:
+        added = 1 if inserted else 0
+        link_model = UserLessonLink
+    if added > 0:
+        capacity, capacity_left = adjust_capacity_left(session, lesson.id, link_model, added)
+    else:
+        capacity, capacity_left = lesson.capacity, lesson.capacity_left
+    position = read_signup_positions(session, user_id, [lesson.id]).get(lesson.id, 0)
+    if capacity is None or position <= capacity:
+        signup_status = "enrolled"
+    else:
+        signup_status = "waitlisted"
+    return {"status": signup_status, "position": position, "capacity_left": capacity_left}
+
+
+
+def apply_cancel(session: Session, lesson: Lesson, user_id: int) -> dict:
+    removed = session.execute(delete(UserLessonLink).where(UserLessonLink.user_id == user_id, UserLessonLink.lesson_id == lesson.id)).rowcount
+    if removed == 0:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not signed up")
+    if lesson.number == 1: # subject to change: lessons for children
+        my_children = sa_select(UserChild.id).where(UserChild.user_id == user_id)
+        removed = session.execute(delete(UserChildLessonLink).where(UserChildLessonLink.lesson_id == lesson.id, UserChildLessonLink.user_child_id.in_(my_children))).rowcount
+        link_model = UserChildLessonLink
+    else:
+        link_model = UserLessonLink
+    capacity, capacity_left = adjust_capacity_left(session, lesson.id, link_model, -removed)
+    return {"status": "cancelled", "position": 0, "capacity_left": capacity_left}
+
+
+
+# process-wide writer used by the lesson routers
+signup_writer = SignupWriter()
+
+
+def start_signup_writer():
+    signup_writer.start()
+
+
+def stop_signup_writer():
+    signup_writer.stop()
+
+
+def busy_exception() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Signup is busy, please retry")
+
+
+# hand an intent to the writer and wait for its result.
+# 503 only when the intent will never be applied: it is cancelled while still queued, or the writer has stopped
+def submit_signup(action: str, user_id: int, lesson_id: int, children_ids: Optional[list[int]] = None) -> dict:
+    try:
+        future = signup_writer.submit(SignupIntent(action, user_id, lesson_id, children_ids))
+    except SignupWriterStopped:
+        raise busy_exception()
+    try:
+        return future.result(timeout=SIGNUP_TIMEOUT_SECONDS)
+    except TimeoutError:
+        if future.cancel():
+            raise busy_exception()
+        # already in a batch: the batch settles it either way, so wait for the outcome
+        return future.result()
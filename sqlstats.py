@@ -0,0 +1,126 @@
+# --- sqlstats.py ---
+
+# modules
+from sqlalchemy import event
+from contextvars import ContextVar
+import os
+import threading
+import time
+
+# my modules
+from database import engine, async_engine
+
+
+# settings: add X-SQL-Count / X-SQL-Time headers to every response (debugging only)
+if "SQL_STATS_HEADERS" in os.environ:
+    SQL_STATS_HEADERS = os.getenv("SQL_STATS_HEADERS").lower() in ("1", "true", "yes")
+else:
+    SQL_STATS_HEADERS = False
+
+
+
+# statements and database time of the request being handled
+class RequestSQLStats:
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+
+
+# set by the middleware, read by the engine events: sync handlers run in the threadpool with a copy of this context
+current_sql_stats: ContextVar[RequestSQLStats] = ContextVar("current_sql_stats", default=None)
+
+
+
+# totals per route template, e.g. "GET /json/my/lessons/{lesson_id}/position"
+class SQLStatsReport:
+    def __init__(self):
+        self.routes = {}
+        self.lock = threading.Lock()
+
+
+    def add(self, route: str, stats: RequestSQLStats):
+        with self.lock:
+            entry = self.routes.get(route)
+            if entry is None:
+                entry = {"requests": 0, "statements": 0, "seconds": 0.0, "max_statements": 0}
+                self.routes[route] = entry
+            entry["requests"] += 1
+            entry["statements"] += stats.statements
+            entry["seconds"] += stats.seconds
+            entry["max_statements"] = max(entry["max_statements"], stats.statements)
+
+
+    # routes with the most statements per request first
+    def report(self) -> list:
+        with self.lock:
+            rows = []
+            for route, entry in self.routes.items():
+                rows.append({
+                    "route": route,
+                    "requests": entry["requests"],
+                    "statements": entry["statements"],
+                    "statements_per_request": entry["statements"] / entry["requests"],
+                    "max_statements": entry["max_statements"],
+                    "db_ms_per_request": entry["seconds"] * 1000 / entry["requests"],
+                })
+        return sorted(rows, key=lambda row: row["statements_per_request"], reverse=True)
+
+
+    def reset(self):
+        with self.lock:
+            self.routes.clear()
+
+
+sql_stats_report = SQLStatsReport()
+
+
+
+# engine events: statements run outside a request (background writers, scripts) are not counted
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_sql_stats.get() is not None:
+        conn.info.setdefault("sql_stats_started", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_sql_stats.get()
+    if stats is not None and conn.info.get("sql_stats_started"):
+        stats.statements += 1
+        stats.seconds += time.perf_counter() - conn.info["sql_stats_started"].pop()
+
+
+# the async engine runs its statements through a sync engine with the same events
+for counted_engine in (engine, async_engine.sync_engine):
+    event.listen(counted_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(counted_engine, "after_cursor_execute", after_cursor_execute)
+
+
+
+# asgi middleware: one RequestSQLStats per http request
+class SQLStatsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestSQLStats()
+        token = current_sql_stats.set(stats)
+
+        async def send_with_headers(message):
+            # statements of streamed bodies run after the headers are sent and only show up in the report
+            if SQL_STATS_HEADERS and message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-sql-count", str(stats.statements).encode()))
+                headers.append((b"x-sql-time", f"{stats.seconds * 1000:.3f}ms".encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            current_sql_stats.reset(token)
+            route = scope.get("route")
+            route_path = route.path if route is not None else "(unmatched)"
+            sql_stats_report.add(f"{scope['method']} {route_path}", stats)
@@ -40,10 +40,11 @@ function attachEventListeners() {
 
 // render lesson list
 async function renderLessons() {
-    const lessons = await fetchLessons();
-    const myLessons = await fetchMyLessons();
-    const position_list = await get_lesson_signup_position();
-    const userChildren = await fetchUserChildren();
+    const board = await fetchLessonBoard();
+    const lessons = board.lessons;
+    const myLessons = board.my_lessons;
+    const position_list = board.positions;
+    const userChildren = board.children;
     const lessonList = document.getElementById("lesson-list");
 
     // clear the previous lesson list
@@ -161,11 +162,42 @@ async function renderLessons() {
 
 
 
+// get lessons, my lessons, my signup positions and my children in one request
+async function fetchLessonBoard() {
+    const token = loadAccessToken();
+    const emptyBoard = {lessons: [], my_lessons: [], positions: [], children: []};
+    if (!token) {
+        return {...emptyBoard, lessons: await fetchLessons()};
+    };
+    const response = await fetch("/json/my/lessons/board", {
+        method: "GET",
+        headers: {"Content-Type": "application/json", "Authorization": "Bearer " + token},
+    });
+    if (response.ok) {
+        const board = await response.json();
+        console.log("success: fetchLessonBoard()", board);
+        return board;
+    } else if (response.status == 403) {
+        console.error("error: fetchLessonBoard()");
+        document.querySelector(".not-allowed").classList.remove("hidden");
+        return emptyBoard;
+    } else {
+        // logged out or expired token: the lesson list is public
+        console.error("error: fetchLessonBoard()");
+        return {...emptyBoard, lessons: await fetchLessons()};
+    };
+};
+
+
+
+
 // get lessons
 async function fetchLessons() {
+    // no-cache: revalidate with If-None-Match, an unchanged catalog comes back as a cheap 304
     const response = await fetch("/json/lessons", {
         method: "GET",
         headers: {"Content-Type": "application/json"},
+        cache: "no-cache",
     });
     if (response.ok) {
         const lessons = await response.json();
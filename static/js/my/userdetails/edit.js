@@ -1,5 +1,8 @@
 // my/userdetails/edit.js
 
+// 読み込んだ利用者情報のバージョン（ETag）: 保存時に If-Match で送り、他の画面で先に変更されていれば 409 が返る
+let userDetailsEtag = null;
+
 document.addEventListener("DOMContentLoaded", function () {
     renderEditForm();
 });
@@ -27,6 +30,7 @@ async function fetchMyUserDetails() {
         headers: {"Content-Type": "application/json", "Authorization": "Bearer " + token},
     });
     if (response.ok) {
+        userDetailsEtag = response.headers.get("ETag");
         return await response.json();
     } else {
         console.error("error: fetchMyUserDetails()");
@@ -45,19 +49,27 @@ document.getElementById("save-btn").addEventListener("click", async function ()
         }
     });
 
+    const headers = {
+        "Content-Type": "application/json",
+        "Authorization": "Bearer " + token
+    };
+    if (userDetailsEtag) {
+        headers["If-Match"] = userDetailsEtag;
+    }
     const response = await fetch("/my/userdetails", {
         method: "PATCH",
-        headers: {
-            "Content-Type": "application/json",
-            "Authorization": "Bearer " + token
-        },
+        headers: headers,
         body: JSON.stringify(data)
     });
 
     if (response.ok) {
+        userDetailsEtag = response.headers.get("ETag");
         document.getElementById("status-message").textContent = "変更が保存されました。";
         document.getElementById("status-message").classList.remove("hidden");
         console.log("success: patched my userdetails");
+    } else if (response.status == 409) {
+        document.getElementById("status-message").textContent = "他の画面で利用者情報が変更されました。ページを再読み込みしてから編集してください。";
+        document.getElementById("status-message").classList.remove("hidden");
     } else {
         document.getElementById("status-message").textContent = "エラーが発生しました。";
         document.getElementById("status-message").classList.remove("hidden");
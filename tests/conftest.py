@@ -0,0 +1,106 @@
+# --- tests/conftest.py ---
+# the app binds its engines to DB_CONNECTION_STRING when database.py is imported, so the environment is set up here,
+# before any test module imports the app: every test run gets a new sqlite file in a temporary directory.
+
+# modules
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+workdir = tempfile.mkdtemp(prefix="yoro-sc-tests-")
+os.environ["DB_CONNECTION_STRING"] = f"sqlite:///{os.path.join(workdir, 'test.sqlite')}"
+os.environ["LOG_PATH"] = os.path.join(workdir, "logs.jsonl")
+os.environ["BCRYPT_ROUNDS"] = "4"
+os.environ["PASSWORD_WORKERS"] = "0" # hash in the calling thread: no worker processes to spawn
+sys.path.insert(0, ROOT)
+os.chdir(ROOT) # static/ and templates/ are served from the working directory
+
+from datetime import datetime, timedelta
+from fastapi.testclient import TestClient
+from sqlmodel import Session, select
+import pytest
+
+
+
+@pytest.fixture(scope="session")
+def client():
+    import main
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture(scope="session")
+def club(client):
+    return Club()
+
+
+
+# seeding helpers: tests share one database, so each test uses its own year/season and username prefix
+class Club:
+    def __init__(self):
+        from database import engine
+        self.engine = engine
+
+
+    # make year/season the current period, open since an hour ago
+    def open_season(self, year: int, season: int):
+        from models.settings import Period
+        from routers.settings import period_cache, CURRENT_PERIOD_KEY
+        with Session(self.engine) as session:
+            period = session.exec(select(Period)).first() or Period(year=year, season=season, start_time=datetime.utcnow(), end_time=datetime.utcnow())
+            period.year = year
+            period.season = season
+            period.start_time = datetime.utcnow() - timedelta(hours=1)
+            period.end_time = datetime.utcnow() + timedelta(days=14)
+            session.add(period)
+            session.commit()
+        period_cache.invalidate(CURRENT_PERIOD_KEY)
+
+
+    def add_lesson(self, year: int, season: int, number: int = 2, capacity: int = 100) -> int:
+        from models.lessons import Lesson
+        with Session(self.engine) as session:
+            lesson = Lesson(year=year, season=season, number=number, title=f"教室{year}-{season}-{number}", teacher="講師", day="水",
+                            time="10:00〜11:30", price=1000, description="", capacity=capacity, lessons=10)
+            session.add(lesson)
+            session.commit()
+            return lesson.id
+
+
+    # members with details (and children): [(user_id, username), ...]
+    def add_members(self, prefix: str, count: int, children: int = 0) -> list:
+        from models.users import User, UserDetail, UserChild
+        members = []
+        with Session(self.engine) as session:
+            for i in range(count):
+                user = User(username=f"{prefix}{i:04d}", hashed_password="-", is_active=True, is_admin=False)
+                user.user_details = UserDetail(first_name="太郎", last_name="山田", first_name_furigana="たろう", last_name_furigana="やまだ",
+                                               tel="0584-32-0000", postal_code="503-1300", address="養老町高田")
+                for j in range(children):
+                    user.user_children.append(UserChild(child_first_name=f"子{j}", child_last_name="山田",
+                                                        child_first_name_furigana="こ", child_last_name_furigana="やまだ"))
+                session.add(user)
+                session.flush()
+                user.user_details.user_id = user.id
+                for child in user.user_children:
+                    child.user_id = user.id
+                members.append((user.id, user.username))
+            session.commit()
+        return members
+
+
+    def make_admin(self, user_id: int):
+        from models.users import User
+        with Session(self.engine) as session:
+            user = session.get(User, user_id)
+            user.is_admin = True
+            session.add(user)
+            session.commit()
+        from routers.auth import user_cache
+        user_cache.invalidate()
+
+
+    def headers(self, username: str) -> dict:
+        from routers.auth import create_access_token
+        return {"Authorization": "Bearer " + create_access_token(data={"sub": username}, expires_delta=timedelta(hours=1))}
@@ -0,0 +1,69 @@
+# --- tests/test_backup.py ---
+
+# modules
+import sqlite3
+import subprocess
+import sys
+import time
+
+# my modules
+import database
+
+
+
+WRITER = """
+import sqlite3, sys
+connection = sqlite3.connect(sys.argv[1], timeout=5)
+while True:
+    connection.execute("INSERT INTO filler (body) VALUES ('y')")
+    connection.commit()
+"""
+
+
+def make_source(path, rows: int = 20000):
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("CREATE TABLE filler (id INTEGER PRIMARY KEY, body TEXT)")
+    connection.executemany("INSERT INTO filler (body) VALUES (?)", [("x" * 500,) for i in range(rows)])
+    connection.commit()
+    connection.close()
+
+
+
+# writes from another connection keep restarting a page-by-page copy: it finishes in one step after BACKUP_MAX_RESTARTS
+def test_backup_falls_back_to_one_step_under_writes(tmp_path, monkeypatch):
+    source_db = str(tmp_path / "source.sqlite")
+    make_source(source_db)
+    monkeypatch.setattr(database, "BACKUP_PAGES_PER_STEP", 1)
+    monkeypatch.setattr(database, "BACKUP_STEP_SLEEP", 0.01)
+    monkeypatch.setattr(database, "BACKUP_MAX_RESTARTS", 2)
+
+    # another worker process writing all the time (threads of this process would not get to run during the copy)
+    writer = subprocess.Popen([sys.executable, "-c", WRITER, source_db])
+    job = {}
+    try:
+        time.sleep(0.3)
+        backup_db = database.backup_online(source_db, str(tmp_path / "backup.sqlite"), job, compress=False)
+    finally:
+        writer.kill()
+        writer.wait()
+
+    assert job["restarts"] == 2
+    assert job["remaining"] == 0
+    connection = sqlite3.connect(backup_db)
+    assert connection.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    assert connection.execute("SELECT COUNT(*) FROM filler WHERE body != 'y'").fetchone()[0] == 20000
+    connection.close()
+
+
+
+# GET /backupdatabase can be called any number of times: only the newest finished jobs are kept
+def test_finished_backup_jobs_are_evicted(monkeypatch):
+    monkeypatch.setattr(database, "backup_jobs", {})
+    monkeypatch.setattr(database, "BACKUP_JOBS_KEPT", 3)
+    database.backup_jobs["running"] = {"status": "running"}
+    for i in range(5):
+        database.backup_jobs[f"job{i}"] = {"status": "done"}
+    with database.backup_lock:
+        database.prune_backup_jobs()
+    assert list(database.backup_jobs) == ["running", "job2", "job3", "job4"]
@@ -0,0 +1,87 @@
+# --- tests/test_logs.py ---
+
+# modules
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import json
+
+# my modules
+import logs
+
+
+
+def write_entries(file_path, count: int):
+    lines = [json.dumps({"user_name": "山田　太郎", "user_tel": "0584-32-0000", "user_address": "養老町", "lesson_number": 2,
+                         "lesson_title": "ヨガ", "action": "apply", "timestamp": f"2026-01-01T00:00:{i:02d}+09:00"}, ensure_ascii=False)
+             for i in range(count)]
+    with open(file_path, "a", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+# a clock stuck at one instant: every rotation gets the same timestamp label
+class FrozenDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return datetime(2026, 1, 1, 12, 0, 0, tzinfo=tz)
+
+
+
+# segments closed at the same instant get distinct names, and no closed segment is overwritten
+def test_rotations_never_overwrite_segments(tmp_path, monkeypatch):
+    monkeypatch.setattr(logs, "LOG_MAX_BYTES", 1)
+    monkeypatch.setattr(logs, "datetime", FrozenDatetime)
+    file_path = tmp_path / "logs.jsonl"
+
+    for count in (1, 2, 3):
+        write_entries(file_path, count)
+        logs.rotate_if_needed(file_path)
+        assert not file_path.exists()
+
+    segments = logs.closed_segments(file_path)
+    assert len(segments) == 3
+    assert sum(1 for path in segments if path.suffix == ".gz") == 2
+    timestamps = [log["timestamp"][-8:-6] for log in logs.read_logs(file_path, legacy_path=tmp_path / "logs.json")]
+    assert timestamps == ["00", "00", "01", "00", "01", "02"]
+
+
+
+# counters updated from many request threads add up exactly
+def test_log_writer_counters_under_concurrent_submits(tmp_path, monkeypatch):
+    monkeypatch.setattr(logs, "insert_audit_logs", lambda batch: None)
+    writer = logs.LogWriter(file_path=tmp_path / "logs.jsonl", maxsize=50)
+    writer.start()
+    log = {"user_name": "山田　太郎", "user_tel": "0584-32-0000", "user_address": "養老町", "lesson_number": 2,
+           "lesson_title": "ヨガ", "action": "apply", "timestamp": "2026-01-01T00:00:00+09:00"}
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for future in [executor.submit(lambda: [writer.submit(dict(log)) for i in range(500)]) for j in range(8)]:
+            future.result()
+    writer.stop()
+
+    stats = writer.stats()
+    assert stats["enqueued"] + stats["direct_writes"] == 4000
+    assert stats["written"] == 4000
+    assert sum(1 for log in logs.read_logs(tmp_path / "logs.jsonl", legacy_path=tmp_path / "logs.json")) == 4000
+
+
+
+# a rerun after the writer (or an interrupted import) already added some rows inserts only the missing ones
+def test_import_logs_skips_rows_already_in_the_table(client, tmp_path):
+    from sqlmodel import Session, select, func
+    from database import engine
+    from models.logs import AuditLog
+
+    file_path = tmp_path / "logs.jsonl"
+    entries = [{"user_name": f"取込　{i % 3}", "user_tel": "0584-32-0000", "user_address": "養老町", "lesson_number": 2,
+                "lesson_title": "取込テスト", "action": "apply", "timestamp": f"2099-01-01T00:00:{i // 2:02d}+09:00"} for i in range(10)]
+    entries.append(dict(entries[-1])) # the same signup logged twice is kept twice
+    logs.write_log_lines(entries, file_path)
+    logs.insert_audit_logs(entries[:4])
+
+    def imported():
+        with Session(engine) as session:
+            return session.exec(select(func.count(AuditLog.id)).where(AuditLog.lesson_title == "取込テスト")).one()
+
+    assert logs.import_logs(chunk_size=3, file_path=file_path, legacy_path=tmp_path / "logs.json") == len(entries) - 4
+    assert imported() == len(entries)
+    assert logs.import_logs(file_path=file_path, legacy_path=tmp_path / "logs.json") == 0
+    assert imported() == len(entries)
@@ -0,0 +1,29 @@
+# --- tests/test_metrics.py ---
+
+# my modules
+import routers.html
+
+
+
+# without METRICS_KEY only a scraper on this host gets the metrics (the test client is not one)
+def test_metrics_are_closed_by_default(client, monkeypatch):
+    monkeypatch.setattr(routers.html, "METRICS_KEY", None)
+    assert client.get("/metrics").status_code == 401
+
+
+def test_metrics_by_route_template(client, club, monkeypatch):
+    monkeypatch.setattr(routers.html, "METRICS_KEY", "secret")
+    club.open_season(2106, 1)
+    lesson_id = club.add_lesson(2106, 1)
+    [(user_id, username)] = club.add_members("metrics", 1)
+    assert client.get(f"/json/my/lessons/{lesson_id}/position", headers=club.headers(username)).status_code == 200
+    client.get("/no/such/page")
+
+    assert client.get("/metrics", params={"key": "wrong"}).status_code == 401
+    response = client.get("/metrics", params={"key": "secret"})
+    assert response.status_code == 200
+    text = response.text
+    assert 'http_requests_total{method="GET",route="/json/my/lessons/{lesson_id}/position",status="200"}' in text
+    assert 'route="(unmatched)",status="404"' in text
+    assert f"/json/my/lessons/{lesson_id}/position" not in text
+    assert 'http_requests_in_flight{method="GET"} 1' in text
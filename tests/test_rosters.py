@@ -0,0 +1,73 @@
+# --- tests/test_rosters.py ---
+
+# modules
+from sqlmodel import Session, select
+
+# my modules
+from sqlstats import sql_stats_report
+from models.users import User, UserChild
+from models.link_table import UserLessonLink, UserChildLessonLink
+
+
+
+ROSTER_ROUTE = "GET /json/admin/lessons/users"
+
+
+# statements run by one roster request (after a warm-up request has filled the user cache)
+def roster_statements(client, headers) -> int:
+    assert client.get("/json/admin/lessons/users", headers=headers).status_code == 200
+    sql_stats_report.reset()
+    response = client.get("/json/admin/lessons/users", headers=headers)
+    assert response.status_code == 200
+    [row] = [row for row in sql_stats_report.report() if row["route"] == ROSTER_ROUTE]
+    return row["max_statements"]
+
+
+def sign_up(engine, lesson_id: int, child_lesson_id: int, members: list):
+    with Session(engine) as session:
+        for user_id, username in members:
+            session.add(UserLessonLink(user_id=user_id, lesson_id=lesson_id))
+            for child in session.exec(select(UserChild).where(UserChild.user_id == user_id)).all():
+                session.add(UserChildLessonLink(user_child_id=child.id, lesson_id=child_lesson_id))
+        session.commit()
+
+
+
+# the admin roster runs the same number of statements with hundreds of members as with a handful
+def test_roster_statements_do_not_grow_with_members(client, club):
+    club.open_season(2104, 1)
+    lesson_id = club.add_lesson(2104, 1)
+    child_lesson_id = club.add_lesson(2104, 1, number=1)
+    [(admin_id, admin_name)] = club.add_members("rosteradmin", 1)
+    club.make_admin(admin_id)
+    headers = club.headers(admin_name)
+
+    sign_up(club.engine, lesson_id, child_lesson_id, club.add_members("rostera", 5, children=1))
+    few = roster_statements(client, headers)
+    sign_up(club.engine, lesson_id, child_lesson_id, club.add_members("rosterb", 300, children=2))
+    many = roster_statements(client, headers)
+
+    assert many == few
+    lessons = {lesson["lesson_number"]: lesson["users"] for lesson in client.get("/json/admin/lessons/users", headers=headers).json()}
+    assert len(lessons[2]) == 305
+    assert len(lessons[1]) == 605
+
+
+
+# a member who has not entered their details keeps their seat on the roster
+def test_roster_lists_members_without_details(client, club):
+    club.open_season(2105, 1)
+    lesson_id = club.add_lesson(2105, 1)
+    [(admin_id, admin_name)] = club.add_members("rosternodetailadmin", 1)
+    club.make_admin(admin_id)
+    with Session(club.engine) as session:
+        user = User(username="rosternodetail", hashed_password="-", is_active=True, is_admin=False)
+        session.add(user)
+        session.commit()
+        members = [(user.id, user.username)]
+    sign_up(club.engine, lesson_id, lesson_id, members + club.add_members("rosterdetail", 1))
+
+    [lesson] = client.get("/json/admin/lessons/users", headers=club.headers(admin_name)).json()
+    assert len(lesson["users"]) == 2
+    assert lesson["users"][0] is None
+    assert lesson["users"][1]["last_name"] == "山田"
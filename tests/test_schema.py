@@ -0,0 +1,44 @@
+# --- tests/test_schema.py ---
+
+# modules
+from alembic import command
+from sqlalchemy import inspect, text
+from sqlmodel import create_engine
+import pytest
+
+# my modules
+import database
+import main
+
+
+
+@pytest.fixture
+def old_database(client, tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.sqlite'}")
+    monkeypatch.setattr(main, "engine", engine)
+    monkeypatch.setattr(database, "engine", engine)
+    # a database of the current schema taken back to the revision before the version columns
+    main.prepare_database()
+    command.downgrade(main.alembic_config(), "c2a7e9f04d61")
+    yield engine
+    engine.dispose()
+
+
+def lesson_columns(engine) -> set:
+    return {column["name"] for column in inspect(engine).get_columns("lesson")}
+
+
+
+# starting the app on a database that is behind runs the migrations first
+def test_prepare_upgrades_a_stamped_database(old_database):
+    assert "version" not in lesson_columns(old_database)
+    main.prepare_database()
+    assert "version" in lesson_columns(old_database)
+
+
+# without a revision the migrations cannot be run: startup stops with the missing columns instead of failing on the first query
+def test_prepare_refuses_an_unstamped_database_that_is_behind(old_database):
+    with old_database.begin() as connection:
+        connection.execute(text("DROP TABLE alembic_version"))
+    with pytest.raises(RuntimeError, match="lesson.version"):
+        main.prepare_database()
@@ -0,0 +1,26 @@
+# --- tests/test_signup_positions.py ---
+
+# modules
+from sqlmodel import Session
+
+# my modules
+from models.users import User
+from models.lessons import Lesson
+
+
+
+# link rows added through the relationship (admin and legacy paths) are numbered after the writer's rows
+def test_relationship_appends_get_a_position(client, club):
+    club.open_season(2103, 1)
+    lesson_id = club.add_lesson(2103, 1)
+    members = club.add_members("append", 3)
+    headers = [club.headers(username) for user_id, username in members]
+    assert client.post(f"/lessons/{lesson_id}", headers=headers[0]).status_code == 200
+
+    with Session(club.engine) as session:
+        lesson = session.get(Lesson, lesson_id)
+        lesson.users.extend([session.get(User, user_id) for user_id, username in members[1:]])
+        session.commit()
+
+    positions = [client.get(f"/json/my/lessons/{lesson_id}/position", headers=h).json() for h in headers]
+    assert positions == [1, 2, 3]
@@ -0,0 +1,120 @@
+# --- tests/test_signup_writer.py ---
+
+# modules
+from concurrent.futures import ThreadPoolExecutor
+from sqlmodel import Session, select, func
+import sqlite3
+import threading
+import time
+
+# my modules
+import signup_writer as signup_writer_module
+from signup_writer import SignupWriter, SignupWriterStopped, SignupIntent, signup_writer
+from logs import LogWriter, log_writer
+from models.link_table import UserLessonLink
+from models.logs import AuditLog
+
+
+
+# hold the sqlite write lock from another connection: the writer's BEGIN IMMEDIATE waits until release_after runs out
+def hold_write_lock(engine, release_after: float) -> threading.Thread:
+    connection = sqlite3.connect(engine.url.database, check_same_thread=False)
+    connection.isolation_level = None
+    connection.execute("BEGIN IMMEDIATE")
+
+    def release():
+        time.sleep(release_after)
+        connection.execute("ROLLBACK")
+        connection.close()
+
+    thread = threading.Thread(target=release)
+    thread.start()
+    return thread
+
+
+def count_links(engine, lesson_id: int) -> int:
+    with Session(engine) as session:
+        return session.exec(select(func.count()).select_from(UserLessonLink).where(UserLessonLink.lesson_id == lesson_id)).one()
+
+
+# audit log rows of a lesson, after everything queued so far has been written
+def count_audit_logs(engine, lesson_title: str, action: str) -> int:
+    log_writer.stop()
+    log_writer.start()
+    with Session(engine) as session:
+        return session.exec(select(func.count(AuditLog.id)).where(AuditLog.lesson_title == lesson_title, AuditLog.action == action)).one()
+
+
+
+# more waiting signups than the pool has connections (5 + 10 overflow): the handlers give their connection back while they wait
+def test_signup_rush_does_not_hold_the_pool(client, club):
+    club.open_season(2101, 1)
+    lesson_id = club.add_lesson(2101, 1)
+    members = club.add_members("rush", 60)
+    headers = [club.headers(username) for user_id, username in members]
+    engine = club.engine
+
+    lock_thread = hold_write_lock(engine, 1.5)
+    with ThreadPoolExecutor(max_workers=len(headers)) as executor:
+        responses = [executor.submit(client.post, f"/lessons/{lesson_id}", headers=h) for h in headers]
+        # every handler has reached the writer by now, and the writer waits for the lock with its one connection
+        time.sleep(1.0)
+        checked_out = engine.pool.checkedout()
+        statuses = [response.result().status_code for response in responses]
+    lock_thread.join()
+
+    assert checked_out <= 2
+    assert statuses == [200] * len(members)
+    assert count_links(engine, lesson_id) == len(members)
+    assert count_audit_logs(engine, f"教室2101-1-2", "apply") == len(members)
+
+
+
+# callers that time out while their intent is still queued get 503, and the intent is never applied
+def test_timed_out_signups_are_not_applied(client, club, monkeypatch):
+    monkeypatch.setattr(signup_writer_module, "SIGNUP_TIMEOUT_SECONDS", 0.3)
+    club.open_season(2102, 1)
+    lesson_id = club.add_lesson(2102, 1)
+    members = club.add_members("late", 21)
+    headers = [club.headers(username) for user_id, username in members]
+    engine = club.engine
+    abandoned = signup_writer.abandoned
+
+    lock_thread = hold_write_lock(engine, 1.5)
+    with ThreadPoolExecutor(max_workers=len(headers)) as executor:
+        # the first intent is taken into a batch that waits for the lock: it can no longer be cancelled
+        first = executor.submit(client.post, f"/lessons/{lesson_id}", headers=headers[0])
+        time.sleep(0.3)
+        rest = [executor.submit(client.post, f"/lessons/{lesson_id}", headers=h) for h in headers[1:]]
+        statuses = [first.result().status_code] + [response.result().status_code for response in rest]
+    lock_thread.join()
+    signup_writer.stop()
+    signup_writer.start()
+
+    assert statuses[0] == 200
+    assert statuses[1:] == [503] * (len(members) - 1)
+    assert count_links(engine, lesson_id) == 1
+    assert signup_writer.abandoned - abandoned == len(members) - 1
+    assert count_audit_logs(engine, f"教室2102-1-2", "apply") == 1
+
+
+
+def test_stopped_writers_are_not_restarted(tmp_path):
+    writer = SignupWriter()
+    writer.start()
+    writer.stop()
+    try:
+        writer.submit(SignupIntent("apply", 1, 1))
+        assert False, "submit after stop() must be refused"
+    except SignupWriterStopped:
+        pass
+    assert writer.thread is None
+
+    logs = LogWriter(file_path=tmp_path / "logs.jsonl")
+    logs.start()
+    logs.stop()
+    logs.submit({"user_name": "山田　太郎", "user_tel": "0584-32-0000", "user_address": "養老町", "lesson_number": 2,
+                 "lesson_title": "ヨガ", "action": "apply", "timestamp": "2026-01-01T00:00:00+09:00"})
+    assert logs.thread is None
+    assert logs.stats()["direct_writes"] == 1
+    assert (tmp_path / "logs.jsonl").read_text(encoding="utf-8").count("\n") == 1
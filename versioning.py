@@ -0,0 +1,46 @@
+# --- versioning.py ---
+# optimistic concurrency for edits of lessons and user details: both tables carry a version column that the orm
+# puts in the WHERE of every UPDATE and bumps (version_id_col), so of two edits made from the same version only the first commits.
+# GET and PATCH responses send the version as ETag; a PATCH with a stale If-Match gets 409 instead of overwriting the other edit.
+
+# modules
+from fastapi import HTTPException, Response, status
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+from typing import Optional
+
+
+
+def version_etag(version: int) -> str:
+    return '"' + str(version) + '"'
+
+
+def set_version_etag(response: Response, version: int):
+    response.headers["ETag"] = version_etag(version)
+
+
+
+def conflict_exception(version: int) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Modified by someone else, reload and retry", headers={"ETag": version_etag(version)})
+
+
+# no If-Match: the edit applies to whatever version is stored (clients that do not send it keep the old behaviour)
+def check_if_match(if_match: Optional[str], version: int):
+    if not if_match:
+        return
+    tags = [tag.strip().removeprefix("W/") for tag in if_match.split(",")]
+    if "*" not in tags and version_etag(version) not in tags:
+        raise conflict_exception(version)
+
+
+# commit the edit of a versioned row: another commit since it was read makes the UPDATE match no row
+def commit_versioned(session: Session, instance):
+    model, id = type(instance), instance.id
+    try:
+        session.commit()
+    except StaleDataError:
+        session.rollback()
+        current = session.get(model, id)
+        if current is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
+        raise conflict_exception(current.version)